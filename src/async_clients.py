@@ -0,0 +1,59 @@
+"""
+Shared AsyncOpenAI clients.
+
+The async methods of the API wrappers share one client, and so one HTTP
+connection pool, per endpoint and event loop. Connections are bound to the
+loop that opened them, so every loop gets its own clients, which go away
+with the loop.
+"""
+import asyncio
+import os
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 16
+
+_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def shared_async_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None
+) -> AsyncOpenAI:
+    """
+    Return the AsyncOpenAI client of an endpoint for the running loop.
+
+    Args:
+        api_key: OpenAI API key. Defaults to environment variable.
+        base_url: Alternative API endpoint, e.g. a local mock server.
+
+    Raises:
+        RuntimeError: If called outside of a running event loop
+    """
+    loop = asyncio.get_running_loop()
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    clients = _CLIENTS.setdefault(loop, {})
+    key = (api_key, base_url)
+    if key not in clients:
+        clients[key] = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+            ))
+        )
+    return clients[key]
+
+
+async def close_async_clients() -> None:
+    """Close the clients of the running loop, e.g. before it shuts down."""
+    clients = _CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
@@ -0,0 +1,298 @@
+"""
+Module for low-latency playback of synthesized speech.
+
+A single output stream stays open for the life of the process. Clips are
+queued as iterables of raw PCM chunks, playback starts as soon as the first
+buffer arrives, consecutive clips are crossfaded and buffer underruns are
+counted and reported to the tracer as a "playback" span per clip.
+"""
+import contextvars
+import queue
+import threading
+import time
+import wave
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+import numpy as np
+import sounddevice as sd
+
+from tracing import current_turn
+from tts import PCM_RATE
+
+
+@dataclass
+class PlaybackConfig:
+    """Configuration for the playback engine."""
+    rate: int = PCM_RATE
+    blocksize: int = 480
+    crossfade: float = 0.03
+    max_buffered: float = 2.0
+    device: Optional[Union[int, str]] = None
+
+
+@dataclass
+class _Clip:
+    """A queued clip and the callback fired when it becomes audible."""
+    chunks: Iterable[bytes]
+    on_start: Optional[Callable[[], None]] = None
+    # Context of the caller of play(), so the chunks are produced within
+    # its turn and their spans are not lost on the feeder thread.
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+def read_wav_chunks(path: Union[str, Path], chunk_frames: int = 4800) -> Iterator[bytes]:
+    """
+    Read a 16-bit mono WAV file as PCM chunks.
+
+    Raises:
+        ValueError: If the file is not 16-bit mono.
+    """
+    # pylint: disable=no-member
+    with wave.open(str(path), "rb") as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError(f"Unsupported WAV format in {path}")
+        while True:
+            data = wf.readframes(chunk_frames)
+            if not data:
+                break
+            yield data
+    # pylint: enable=no-member
+
+
+class PlaybackEngine:  # pylint: disable=too-many-instance-attributes
+    """Plays queued PCM clips through one persistent output stream."""
+
+    def __init__(self, config: Optional[PlaybackConfig] = None) -> None:
+        """
+        Initialize the playback engine.
+
+        Args:
+            config: PlaybackConfig object with output parameters
+        """
+        config = config or PlaybackConfig()
+        self.config = config
+        self.underruns = 0
+        self.clips_played = 0
+        self._clips: "queue.Queue[Optional[_Clip]]" = queue.Queue()
+        self._buffer: deque = deque()
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._clip_started = False
+        self._generation = 0
+        self._pending_start: deque = deque()
+        self._stream: Optional[sd.RawOutputStream] = None
+        self._feeder: Optional[threading.Thread] = None
+        # Start callbacks are handed over by the audio thread and run here,
+        # so they never block the device.
+        self._started: "queue.SimpleQueue[Optional[Callable[[], None]]]" = queue.SimpleQueue()
+        self._notifier: Optional[threading.Thread] = None
+        self._crossfade_samples = int(config.crossfade * config.rate)
+        self._max_samples = int(config.max_buffered * config.rate)
+
+    def start(self) -> None:
+        """Open the output stream and start the feeder thread."""
+        if self._stream is not None:
+            return
+        self._stream = sd.RawOutputStream(
+            samplerate=self.config.rate,
+            channels=1,
+            dtype="int16",
+            blocksize=self.config.blocksize,
+            latency="low",
+            device=self.config.device,
+            callback=self._callback
+        )
+        self._stream.start()
+        self._feeder = threading.Thread(target=self._feed, name="playback-feeder", daemon=True)
+        self._feeder.start()
+        self._notifier = threading.Thread(target=self._notify, name="playback-events",
+                                          daemon=True)
+        self._notifier.start()
+
+    def play(
+        self,
+        chunks: Iterable[bytes],
+        on_start: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Queue a clip of 16-bit mono PCM at the configured rate.
+
+        Args:
+            chunks: Raw PCM chunks, consumed lazily as playback progresses
+            on_start: Called from the playback event thread when the clip becomes audible
+        """
+        self.start()
+        self._clips.put(_Clip(chunks, on_start))
+
+    def play_file(
+        self,
+        path: Union[str, Path],
+        on_start: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Queue a 16-bit mono WAV file."""
+        self.play(read_wav_chunks(path), on_start)
+
+    def clear(self) -> None:
+        """Drop every queued clip and silence the output."""
+        try:
+            while True:
+                self._clips.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            self._generation += 1
+            self._buffer.clear()
+            self._buffered = 0
+            self._pending_start.clear()
+            self._space.notify_all()
+
+    def close(self) -> None:
+        """Stop the feeder and close the output stream."""
+        self.clear()
+        if self._feeder is not None:
+            self._clips.put(None)
+            self._feeder.join(1.0)
+            self._feeder = None
+        if self._notifier is not None:
+            self._started.put(None)
+            self._notifier.join(1.0)
+            self._notifier = None
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+    def _feed(self) -> None:
+        """Pull clips from the queue and push their samples to the buffer."""
+        tail = np.zeros(0, dtype=np.int16)
+        while True:
+            clip = self._clips.get()
+            if clip is None:
+                return
+
+            with self._lock:
+                generation = self._generation
+                start_entry = [self._buffered + len(tail), clip.on_start]
+                self._pending_start.append(start_entry)
+            underruns = self.underruns
+            start = time.perf_counter()
+            pushed = clip.context.run(self._feed_clip, clip, tail, generation)
+            self._report(clip, start, self.underruns - underruns)
+
+            with self._lock:
+                self._clip_started = False
+                if not pushed and start_entry in self._pending_start:
+                    self._pending_start.remove(start_entry)
+            # Hold back the end of the clip only if another one is waiting
+            # to be blended into it.
+            tail = self._hold_tail() if not self._clips.empty() else tail[:0]
+            self.clips_played += 1
+
+    def _notify(self) -> None:
+        """Run the start callbacks queued by the audio thread."""
+        while True:
+            on_start = self._started.get()
+            if on_start is None:
+                return
+            try:
+                on_start()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Error in playback start callback: {e}")
+
+    @staticmethod
+    def _report(clip: _Clip, start: float, underruns: int) -> None:
+        """Record the clip's playback and underruns on the turn that queued it."""
+        if underruns:
+            print(f"Playback underruns: {underruns}")
+        turn = clip.context.run(current_turn)
+        if turn is not None:
+            turn.record("playback", start, time.perf_counter() - start, underruns=underruns)
+
+    def _feed_clip(self, clip: _Clip, tail: np.ndarray, generation: int) -> int:
+        """Push one clip's samples, blending its head with the held tail."""
+        pushed = 0
+        remainder = b""
+        try:
+            for chunk in clip.chunks:
+                if generation != self._generation:
+                    break
+                data = remainder + chunk
+                usable = len(data) - len(data) % 2
+                remainder = data[usable:]
+                samples = np.frombuffer(data[:usable], dtype=np.int16)
+                if len(tail) and len(samples):
+                    samples, tail = self._crossfade(tail, samples), tail[:0]
+                if len(samples):
+                    self._push(samples)
+                    pushed += len(samples)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Error during playback: {e}")
+        if len(tail) and generation == self._generation:
+            self._push(tail)
+        return pushed
+
+    def _crossfade(self, tail: np.ndarray, head: np.ndarray) -> np.ndarray:
+        """Blend the held tail of the previous clip into the next one."""
+        length = min(len(tail), len(head))
+        fade = np.linspace(0.0, 1.0, length, dtype=np.float32)
+        mixed = (tail[:length] * (1.0 - fade) + head[:length] * fade).astype(np.int16)
+        return np.concatenate((tail[length:], mixed, head[length:]))
+
+    def _hold_tail(self) -> np.ndarray:
+        """Take the last crossfade samples back out of the buffer."""
+        held = []
+        needed = self._crossfade_samples
+        with self._lock:
+            while needed and self._buffer:
+                block = self._buffer.pop()
+                if len(block) > needed:
+                    self._buffer.append(block[:-needed])
+                    block = block[-needed:]
+                held.append(block)
+                needed -= len(block)
+                self._buffered -= len(block)
+        return np.concatenate(held[::-1]) if held else np.zeros(0, dtype=np.int16)
+
+    def _push(self, samples: np.ndarray) -> None:
+        """Append samples, waiting while the buffer is full."""
+        with self._space:
+            while self._buffered >= self._max_samples:
+                self._space.wait(0.1)
+            self._buffer.append(samples)
+            self._buffered += len(samples)
+            # Only a clip that started playing can starve; the wait for
+            # its first chunk is latency, not an underrun.
+            self._clip_started = True
+
+    def _callback(self, outdata, frames, _time, status) -> None:
+        """Fill the device buffer from the sample queue (audio thread)."""
+        if status.output_underflow:
+            self.underruns += 1
+        out = np.frombuffer(outdata, dtype=np.int16)
+        filled = 0
+        started = []
+        with self._lock:
+            while filled < frames and self._buffer:
+                block = self._buffer.popleft()
+                take = min(frames - filled, len(block))
+                out[filled:filled + take] = block[:take]
+                if take < len(block):
+                    self._buffer.appendleft(block[take:])
+                filled += take
+            self._buffered -= filled
+            for pending in self._pending_start:
+                pending[0] -= filled
+            while self._pending_start and self._pending_start[0][0] < 0:
+                started.append(self._pending_start.popleft()[1])
+            if filled < frames and self._clip_started:
+                self.underruns += 1
+            self._space.notify_all()
+        out[filled:] = 0
+
+        for on_start in started:
+            if on_start is not None:
+                self._started.put(on_start)
@@ -0,0 +1,457 @@
+"""
+Interchangeable speech-to-text, text generation and text-to-speech engines.
+
+Each kind of engine follows a small protocol with a blocking call and a
+streaming one, and is looked up by name in a registry. The OpenAI API is the
+default; faster-whisper and Piper run on the local CPU without any network
+round trip, and the fake engines return deterministic results for offline
+benchmarks.
+
+Engines are chosen in ~/.config/hermine/backends.json, for instance:
+
+    {"stt": {"name": "faster-whisper", "model": "small"},
+     "tts": {"name": "piper", "model": "/path/to/fr_FR-siwis-medium.onnx"},
+     "llm": {"name": "openai", "cache": true}}
+
+or with the HERMINE_STT, HERMINE_TTS and HERMINE_LLM environment variables,
+which take precedence over the file. The "cache" option of the openai chat
+model answers repeated questions from the local response cache.
+"""
+import inspect
+import json
+import math
+import os
+import subprocess
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (Any, Callable, Dict, Iterator, List, Optional, Protocol,
+                    Union, runtime_checkable)
+
+import numpy as np
+
+from resample import FormatConverter
+from response_cache import ResponseCache
+from stt import AudioTranscriber
+from text_generator import TextGenerator
+from tts import PCM_RATE, TextToSpeechConverter
+from tracing import mark, span
+
+KINDS = ("stt", "tts", "llm")
+DEFAULT_CONFIG_PATH = Path.home() / ".config" / "hermine" / "backends.json"
+
+
+@dataclass
+class ChatReply:
+    """Reply of a chat model, with the tool calls it requested."""
+    content: str = ""
+    tool_calls: list = field(default_factory=list)
+
+
+@runtime_checkable
+class SpeechToText(Protocol):
+    """Turns a recording into text."""
+
+    def transcribe(self, audio_path: Union[str, Path]) -> str:
+        """Transcribe a whole recording."""
+
+    def transcribe_stream(self, audio_path: Union[str, Path]) -> Iterator[str]:
+        """Yield the transcript segment by segment."""
+
+
+@runtime_checkable
+class TextToSpeech(Protocol):
+    """Turns text into raw 16-bit mono PCM at PCM_RATE."""
+
+    def synthesize(self, text: str) -> bytes:
+        """Synthesize a whole reply."""
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        """Yield PCM chunks as they are synthesized."""
+
+
+@runtime_checkable
+class ChatModel(Protocol):
+    """Generates replies to a conversation."""
+
+    def complete(self, messages: List[dict], tools: Optional[list] = None) -> ChatReply:
+        """Generate a whole reply, possibly requesting tools."""
+
+    def stream(self, messages: List[dict]) -> Iterator[str]:
+        """Yield the reply as it is generated."""
+
+
+_REGISTRY: Dict[str, Dict[str, Callable[..., Any]]] = {kind: {} for kind in KINDS}
+
+
+def register(kind: str, name: str) -> Callable:
+    """Class decorator adding an engine to the registry."""
+    def decorator(factory):
+        _REGISTRY[kind][name] = factory
+        return factory
+    return decorator
+
+
+def available(kind: str) -> List[str]:
+    """Names of the registered engines of a kind."""
+    return sorted(_REGISTRY[kind])
+
+
+@dataclass
+class BackendConfig:
+    """Which engine to use for each stage, with its options."""
+    stt: str = "openai"
+    tts: str = "openai"
+    llm: str = "openai"
+    options: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @classmethod
+    def from_environment(cls) -> "BackendConfig":
+        """Read the configuration file, then the environment overrides."""
+        config = cls()
+        path = Path(os.environ.get("HERMINE_BACKENDS", DEFAULT_CONFIG_PATH))
+        if path.exists():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"Error reading backend configuration {path}: {e}")
+                data = {}
+            for kind in KINDS:
+                entry = data.get(kind)
+                if isinstance(entry, str):
+                    setattr(config, kind, entry)
+                elif isinstance(entry, dict):
+                    entry = dict(entry)
+                    setattr(config, kind, entry.pop("name", getattr(config, kind)))
+                    config.options[kind] = entry
+        for kind in KINDS:
+            setattr(config, kind, os.environ.get(f"HERMINE_{kind.upper()}", getattr(config, kind)))
+        return config
+
+
+def create_backend(kind: str, config: BackendConfig, **defaults) -> Any:
+    """
+    Instantiate the configured engine of a kind.
+
+    Args:
+        kind: "stt", "tts" or "llm"
+        config: BackendConfig naming the engine
+        **defaults: Shared settings such as api_key, passed only to the
+            engines that accept them
+
+    Returns:
+        The engine instance
+
+    Raises:
+        ValueError: If the engine is not registered, or a required option
+            is missing from its configuration
+    """
+    name = getattr(config, kind)
+    factory = _REGISTRY[kind].get(name)
+    if factory is None:
+        raise ValueError(f"Unknown {kind} backend '{name}', "
+                         f"available: {', '.join(available(kind))}")
+    parameters = inspect.signature(factory).parameters
+    options = {key: value for key, value in defaults.items() if key in parameters}
+    options.update(config.options.get(kind, {}))
+    missing = [parameter.name for parameter in parameters.values()
+               if parameter.default is parameter.empty
+               and parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)
+               and parameter.name not in options]
+    if missing:
+        raise ValueError(f"The {name} {kind} backend needs the "
+                         f"{', '.join(repr(option) for option in missing)} option "
+                         f"in {DEFAULT_CONFIG_PATH} or $HERMINE_BACKENDS")
+    return factory(**options)
+
+
+# OpenAI
+
+
+@register("stt", "openai")
+class OpenAISpeechToText:
+    """Transcription with the OpenAI API."""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = "whisper-1"
+    ) -> None:
+        self.transcriber = AudioTranscriber(api_key=api_key, model=model, base_url=base_url)
+
+    def transcribe(self, audio_path: Union[str, Path]) -> str:
+        """Transcribe a whole recording."""
+        return self.transcriber.transcribe_file(str(audio_path))
+
+    def transcribe_stream(self, audio_path: Union[str, Path]) -> Iterator[str]:
+        """The API returns the transcript in one piece."""
+        yield self.transcribe(audio_path)
+
+
+@register("tts", "openai")
+class OpenAITextToSpeech:
+    """Speech synthesis with the OpenAI API."""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = "tts-1-hd",
+        voice: str = "sage"
+    ) -> None:
+        self.converter = TextToSpeechConverter(
+            model=model, voice=voice, api_key=api_key, base_url=base_url
+        )
+
+    def synthesize(self, text: str) -> bytes:
+        """Synthesize a whole reply."""
+        return b"".join(self.stream(text))
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        """Yield PCM chunks as they are downloaded."""
+        return self.converter.stream_speech(text, response_format="pcm")
+
+
+@register("llm", "openai")
+class OpenAIChatModel:
+    """Chat completions with the OpenAI API, through TextGenerator."""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = "gpt-4o-mini",
+        cache: bool = False
+    ) -> None:
+        self.generator = TextGenerator(api_key=api_key, model=model, base_url=base_url,
+                                       cache=ResponseCache() if cache else None)
+        self.model = model
+
+    def complete(self, messages: List[dict], tools: Optional[list] = None) -> ChatReply:
+        """Generate a whole reply, possibly requesting tools; empty if the request failed."""
+        options = {"tools": tools} if tools else {}
+        message = self.generator.complete(messages, **options)
+        if message is None:
+            return ChatReply("")
+        return ChatReply(message.content or "", list(message.tool_calls or []))
+
+    def stream(self, messages: List[dict]) -> Iterator[str]:
+        """Yield the reply as the tokens arrive."""
+        return self.generator.stream(messages)
+
+
+# Local engines
+
+
+@register("stt", "faster-whisper")
+class FasterWhisperSpeechToText:
+    """Transcription on the local CPU with faster-whisper (CTranslate2)."""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        model: str = "small",
+        device: str = "cpu",
+        compute_type: str = "int8",
+        language: Optional[str] = "fr",
+        beam_size: int = 1
+    ) -> None:
+        """
+        Load the model.
+
+        Args:
+            model: Model size or path to a converted model
+            device: "cpu" or "cuda"
+            compute_type: Quantization, int8 is the fastest on CPU
+            language: Spoken language, None to detect it
+            beam_size: Beam width, 1 is greedy decoding
+
+        Raises:
+            RuntimeError: If faster-whisper is not installed
+        """
+        try:
+            from faster_whisper import WhisperModel  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise RuntimeError("faster-whisper is not installed, "
+                               "run: pip install faster-whisper") from e
+        self.model = WhisperModel(model, device=device, compute_type=compute_type)
+        self.language = language
+        self.beam_size = beam_size
+
+    def transcribe(self, audio_path: Union[str, Path]) -> str:
+        """Transcribe a whole recording."""
+        return " ".join(self.transcribe_stream(audio_path))
+
+    def transcribe_stream(self, audio_path: Union[str, Path]) -> Iterator[str]:
+        """Yield segments as the decoder produces them."""
+        with span("stt", bytes=Path(audio_path).stat().st_size) as stats:
+            segments, _info = self.model.transcribe(
+                str(audio_path), language=self.language,
+                beam_size=self.beam_size, vad_filter=True
+            )
+            stats["chars"] = 0
+            for segment in segments:
+                text = segment.text.strip()
+                stats["chars"] += len(text)
+                yield text
+
+
+@register("tts", "piper")
+class PiperTextToSpeech:
+    """Speech synthesis on the local CPU with the Piper command line engine."""
+
+    def __init__(
+        self,
+        model: str,
+        executable: str = "piper",
+        speaker: Optional[int] = None,
+        chunk_size: int = 4096
+    ) -> None:
+        """
+        Initialize the engine.
+
+        Args:
+            model: Path to the .onnx voice, its .onnx.json config must be next to it
+            executable: Piper binary
+            speaker: Speaker id for multi-speaker voices
+            chunk_size: Size of the chunks read from Piper in bytes
+        """
+        self.model = model
+        self.executable = executable
+        self.speaker = speaker
+        self.chunk_size = chunk_size
+        try:
+            voice = json.loads(Path(f"{model}.json").read_text(encoding="utf-8"))
+            self.rate = int(voice["audio"]["sample_rate"])
+        except (OSError, ValueError, KeyError):
+            self.rate = 22050
+
+    def synthesize(self, text: str) -> bytes:
+        """Synthesize a whole reply."""
+        return b"".join(self.stream(text))
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        """Yield PCM chunks resampled to PCM_RATE as Piper writes them."""
+        command = [self.executable, "--model", self.model, "--output-raw"]
+        if self.speaker is not None:
+            command += ["--speaker", str(self.speaker)]
+        converter = FormatConverter(self.rate, 1, PCM_RATE)
+
+        with span("tts", chars=len(text)) as stats, subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL) as process:
+            try:
+                process.stdin.write(text.encode("utf-8"))
+                process.stdin.close()
+                stats["bytes"] = 0
+                leftover = b""
+                while chunk := process.stdout.read(self.chunk_size):
+                    chunk = leftover + chunk
+                    even = len(chunk) - len(chunk) % 2
+                    leftover = chunk[even:]
+                    pcm = converter.convert(chunk[:even])
+                    if pcm:
+                        if not stats["bytes"]:
+                            mark("tts.first_byte")
+                        stats["bytes"] += len(pcm)
+                        yield pcm
+                pcm = converter.flush()
+                if pcm:
+                    stats["bytes"] += len(pcm)
+                    yield pcm
+            finally:
+                if process.poll() is None:
+                    process.kill()
+        if process.returncode:
+            raise RuntimeError(f"Piper exited with status {process.returncode}")
+
+
+# Deterministic fakes
+
+
+@register("stt", "fake")
+class FakeSpeechToText:
+    """Returns a fixed transcript."""
+
+    def __init__(self, transcript: str = "Quelle est la version du noyau ?",
+                 latency: float = 0.0) -> None:
+        self.transcript = transcript
+        self.latency = latency
+
+    def transcribe(self, audio_path: Union[str, Path]) -> str:
+        """Return the configured transcript after the configured delay."""
+        with span("stt", bytes=Path(audio_path).stat().st_size) as stats:
+            time.sleep(self.latency)
+            stats["chars"] = len(self.transcript)
+            return self.transcript
+
+    def transcribe_stream(self, audio_path: Union[str, Path]) -> Iterator[str]:
+        """Yield the configured transcript."""
+        yield self.transcribe(audio_path)
+
+
+@register("tts", "fake")
+class FakeTextToSpeech:
+    """Synthesizes a tone whose length follows the text."""
+
+    def __init__(self, latency: float = 0.0, seconds_per_char: float = 0.05,
+                 chunk_size: int = 4800) -> None:
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.chunk_size = chunk_size
+
+    def synthesize(self, text: str) -> bytes:
+        """Synthesize a whole reply."""
+        return b"".join(self.stream(text))
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        """Yield a 220 Hz tone in chunks."""
+        with span("tts", chars=len(text)) as stats:
+            time.sleep(self.latency)
+            frames = int(min(len(text) * self.seconds_per_char, 10.0) * PCM_RATE)
+            tone = 3000 * np.sin(2 * math.pi * 220 * np.arange(frames) / PCM_RATE)
+            pcm = tone.astype(np.int16).tobytes()
+            stats["bytes"] = len(pcm)
+            for offset in range(0, len(pcm), self.chunk_size):
+                if not offset:
+                    mark("tts.first_byte")
+                yield pcm[offset:offset + self.chunk_size]
+
+
+@register("llm", "fake")
+class FakeChatModel:
+    """Repeats the last user message, or returns a fixed reply."""
+
+    def __init__(self, reply: Optional[str] = None, latency: float = 0.0,
+                 token_latency: float = 0.0) -> None:
+        self.reply = reply
+        self.latency = latency
+        self.token_latency = token_latency
+
+    def _reply_to(self, messages: List[dict]) -> str:
+        """The deterministic reply to a conversation."""
+        if self.reply is not None:
+            return self.reply
+        content = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"),
+                       "")
+        if not isinstance(content, str):
+            content = " ".join(part.get("text", "") for part in content)
+        return f"Vous avez dit : {content}"
+
+    def complete(self, messages: List[dict],
+                 tools: Optional[list] = None) -> ChatReply:  # pylint: disable=unused-argument
+        """Return the reply after the configured delays; never requests tools."""
+        return ChatReply("".join(self.stream(messages)))
+
+    def stream(self, messages: List[dict]) -> Iterator[str]:
+        """Yield the reply word by word."""
+        with span("llm.completion") as stats:
+            time.sleep(self.latency)
+            words = self._reply_to(messages).split(" ")
+            stats["completion_tokens"] = len(words)
+            for index, word in enumerate(words):
+                if not index:
+                    mark("llm.first_token")
+                else:
+                    time.sleep(self.token_latency)
+                yield word if not index else f" {word}"
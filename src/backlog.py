@@ -0,0 +1,97 @@
+"""
+Process backlogs outside of the GUI: transcribe a folder of voice memos, then
+summarize the transcripts, as concurrent batches within the API rate limits.
+
+    python3 backlog.py transcribe ~/Memos --output memos.jsonl
+    python3 backlog.py summarize memos.jsonl --output summaries.jsonl
+
+An interrupted run resumes where it stopped when started again with the same
+arguments.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from batch import BatchConfig
+from stt import AudioTranscriber
+from text_generator import Message, TextGenerator
+
+AUDIO_SUFFIXES = (".wav", ".mp3", ".m4a", ".ogg", ".webm", ".flac")
+SUMMARY_PROMPT = "Résume cette note vocale en quelques phrases."
+
+
+def _write_results(output: Path, entries: List[dict]) -> None:
+    """Write the results as JSON lines."""
+    with open(output, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def transcribe(directory: Path, output: Path, config: BatchConfig) -> int:
+    """Transcribe every audio file of a directory, returning the number of failures."""
+    files = sorted(p for p in directory.iterdir() if p.suffix.lower() in AUDIO_SUFFIXES)
+    checkpoint = output.with_name(output.name + ".checkpoint")
+    texts = AudioTranscriber().transcribe_batch(files, config, checkpoint)
+    _write_results(output, [{"file": str(f), "text": t} for f, t in zip(files, texts)])
+    return _finish(checkpoint, texts)
+
+
+def summarize(transcripts: Path, output: Path, config: BatchConfig, prompt: str) -> int:
+    """Summarize the transcripts written by transcribe, returning the number of failures."""
+    with open(transcripts, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    entries = [entry for entry in entries if entry.get("text")]
+    conversations = [
+        [Message(role="system", content=prompt), Message(role="user", content=entry["text"])]
+        for entry in entries
+    ]
+    checkpoint = output.with_name(output.name + ".checkpoint")
+    summaries = TextGenerator().generate_batch(conversations, config, checkpoint)
+    _write_results(output, [{"file": entry["file"], "summary": summary}
+                            for entry, summary in zip(entries, summaries)])
+    return _finish(checkpoint, summaries)
+
+
+def _finish(checkpoint: Path, results: List[Optional[str]]) -> int:
+    """Drop the checkpoint of a complete batch and report failures."""
+    failures = sum(result is None for result in results)
+    if failures:
+        print(f"{failures} of {len(results)} items failed, run again to retry them")
+    else:
+        checkpoint.unlink(missing_ok=True)
+    return failures
+
+
+def main() -> int:
+    """Parse the command line and run the batch."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=BatchConfig.concurrency)
+    parser.add_argument("--requests-per-minute", type=float,
+                        help="Initial request limit, refined from the API responses")
+    parser.add_argument("--tokens-per-minute", type=float,
+                        help="Initial token limit, refined from the API responses")
+    commands = parser.add_subparsers(dest="command", required=True)
+    transcribe_parser = commands.add_parser("transcribe", help="Transcribe a folder of recordings")
+    transcribe_parser.add_argument("directory", type=Path)
+    transcribe_parser.add_argument("--output", type=Path, default=Path("transcripts.jsonl"))
+    summarize_parser = commands.add_parser("summarize", help="Summarize transcripts")
+    summarize_parser.add_argument("transcripts", type=Path)
+    summarize_parser.add_argument("--output", type=Path, default=Path("summaries.jsonl"))
+    summarize_parser.add_argument("--prompt", default=SUMMARY_PROMPT)
+    args = parser.parse_args()
+
+    config = BatchConfig(concurrency=args.concurrency,
+                         requests_per_minute=args.requests_per_minute,
+                         tokens_per_minute=args.tokens_per_minute)
+    if args.command == "transcribe":
+        failures = transcribe(args.directory, args.output, config)
+    else:
+        failures = summarize(args.transcripts, args.output, config, args.prompt)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""
+Concurrent batch processing within the API rate limits.
+
+Items are processed by a pool of asyncio workers. Before each request a
+token bucket for requests per minute and one for tokens per minute are
+drawn from. The buckets are resized from the x-ratelimit-* response headers,
+so the batch settles just under the account's limits. Requests rejected
+with 429 are retried with exponential backoff, honoring Retry-After.
+Results come back in input order, and finished items are appended to a
+checkpoint file so that a crashed batch resumes where it stopped.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (Any, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Tuple,
+                    Union)
+
+import openai
+
+# Errors worth retrying; anything else fails the item immediately.
+TRANSIENT_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse a reset duration such as "20ms", "1s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+
+@dataclass
+class BatchConfig:
+    """Configuration for batch processing."""
+    concurrency: int = 8
+    max_retries: int = 6
+    backoff: float = 1.0
+    max_backoff: float = 60.0
+    # Starting limits, refined from the response headers.
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+class _Bucket:
+    """Token bucket refilled continuously over one minute."""
+
+    def __init__(self, per_minute: Optional[float]) -> None:
+        self.capacity = per_minute
+        self.level = per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """Add what accrued since the last refill."""
+        if self.capacity:
+            self.level = min(self.capacity,
+                             self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken, 0 when unlimited."""
+        if not self.capacity:
+            return 0.0
+        # A request larger than the bucket only waits for a full bucket.
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60.0 / self.capacity)
+
+    def resize(self, limit: Optional[str], remaining: Optional[str]) -> None:
+        """Follow the limit and remaining count reported by the API."""
+        try:
+            if limit is not None:
+                if not self.capacity:
+                    # First time the limit is known: start from a full bucket.
+                    self.level = float(limit)
+                self.capacity = float(limit)
+            if remaining is not None:
+                self.level = min(self.level, float(remaining))
+        except ValueError:
+            pass
+
+
+class RateLimiter:
+    """Paces requests against requests-per-minute and tokens-per-minute limits."""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None
+    ) -> None:
+        """
+        Initialize the limiter.
+
+        Args:
+            requests_per_minute: Initial request limit, None until a response reports it
+            tokens_per_minute: Initial token limit, None until a response reports it
+        """
+        self.requests = _Bucket(requests_per_minute)
+        self.tokens = _Bucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 0.0) -> None:
+        """Wait until a request of the given token cost may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                delay = max(self.paused_until - now,
+                            self.requests.wait_time(1),
+                            self.tokens.wait_time(tokens))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.requests.level -= 1
+            self.tokens.level -= tokens
+
+    def refund(self, estimated: float, actual: float) -> None:
+        """Correct the token bucket once the real usage is known."""
+        if self.tokens.capacity:
+            self.tokens.level = min(self.tokens.capacity,
+                                    self.tokens.level + estimated - actual)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Resize the buckets from x-ratelimit-* response headers."""
+        self.requests.resize(headers.get("x-ratelimit-limit-requests"),
+                             headers.get("x-ratelimit-remaining-requests"))
+        self.tokens.resize(headers.get("x-ratelimit-limit-tokens"),
+                           headers.get("x-ratelimit-remaining-tokens"))
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                self.pause(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 1.0)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every request for a while, e.g. after a 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Delay requested by a Retry-After-Ms or Retry-After header, in seconds."""
+    try:
+        return float(headers["retry-after-ms"]) / 1000.0
+    except (KeyError, ValueError):
+        return parse_duration(headers.get("retry-after"))
+
+
+def item_key(item: Any) -> str:
+    """Stable identity of an input, used to match checkpoint entries."""
+    payload = json.dumps(item, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class BatchCheckpoint:
+    """Append-only JSON lines record of finished items."""
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        Initialize the checkpoint.
+
+        Args:
+            path: File to append to, created on the first result
+        """
+        self.path = Path(path)
+
+    def load(self, keys: List[str]) -> Dict[int, Any]:
+        """Results already recorded for these inputs, by index."""
+        done: Dict[int, Any] = {}
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return done
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) < len(data):
+            # Drop the last line cut short by a crash, or the next record
+            # would be appended to it and lost.
+            os.truncate(self.path, len(complete))
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            index = entry.get("index")
+            if isinstance(index, int) and index < len(keys) \
+                    and keys[index] == entry.get("key"):
+                done[index] = entry.get("result")
+        return done
+
+    def record(self, index: int, key: str, result: Any) -> None:
+        """Append one finished item."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"index": index, "key": key, "result": result},
+                               ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self) -> None:
+        """Delete the checkpoint once the batch is complete."""
+        self.path.unlink(missing_ok=True)
+
+
+# A worker sends one request and returns the result, the response headers
+# and the tokens actually used (None if unknown).
+Worker = Callable[[Any], Awaitable[Tuple[Any, Mapping[str, str], Optional[float]]]]
+
+
+class BatchRunner:  # pylint: disable=too-few-public-methods
+    """Runs a worker over many items concurrently within the rate limits."""
+
+    def __init__(self, config: Optional[BatchConfig] = None) -> None:
+        """
+        Initialize the runner.
+
+        Args:
+            config: BatchConfig object with batch parameters
+        """
+        self.config = config or BatchConfig()
+        self.limiter = RateLimiter(self.config.requests_per_minute,
+                                   self.config.tokens_per_minute)
+
+    async def run(
+        self,
+        items: Iterable[Any],
+        worker: Worker,
+        estimate: Callable[[Any], float] = lambda item: 0.0,
+        checkpoint: Optional[Union[str, Path]] = None
+    ) -> List[Any]:
+        """
+        Process every item.
+
+        Args:
+            items: Inputs, JSON-serializable if a checkpoint is used
+            worker: Coroutine function processing one item
+            estimate: Token cost of an item, reserved before sending it
+            checkpoint: File recording finished items for resumption
+
+        Returns:
+            Results in input order, None for items that failed
+        """
+        items = list(items)
+        keys = [item_key(item) for item in items]
+        store = BatchCheckpoint(checkpoint) if checkpoint else None
+        results: List[Any] = [None] * len(items)
+        done = store.load(keys) if store else {}
+        for index, result in done.items():
+            results[index] = result
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(items)):
+            if index not in done:
+                queue.put_nowait(index)
+
+        async def consume() -> None:
+            while not queue.empty():
+                index = queue.get_nowait()
+                results[index] = await self._process(items[index], worker, estimate)
+                if store and results[index] is not None:
+                    # The record is fsynced, keep that off the event loop.
+                    await asyncio.to_thread(store.record, index, keys[index], results[index])
+
+        workers = min(self.config.concurrency, queue.qsize())
+        await asyncio.gather(*(consume() for _ in range(workers)))
+        return results
+
+    async def _process(self, item: Any, worker: Worker, estimate: Callable[[Any], float]) -> Any:
+        """Process one item, retrying transient failures."""
+        cost = estimate(item)
+        for attempt in range(self.config.max_retries + 1):
+            await self.limiter.acquire(cost)
+            try:
+                result, headers, used = await worker(item)
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.config.max_retries:
+                    print(f"Error processing batch item after {attempt + 1} attempts: {e}")
+                    return None
+                delay = min(self.config.max_backoff, self.config.backoff * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                response = getattr(e, "response", None)
+                if response is not None:
+                    delay = max(delay, retry_after(response.headers) or 0.0)
+                    if isinstance(e, openai.RateLimitError):
+                        self.limiter.update(response.headers)
+                        self.limiter.pause(delay)
+                await asyncio.sleep(delay)
+                continue
+            except (openai.APIError, ValueError, OSError) as e:
+                print(f"Error processing batch item: {e}")
+                return None
+            self.limiter.update(headers)
+            if used is not None:
+                self.limiter.refund(cost, used)
+            return result
+        return None
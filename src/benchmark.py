@@ -0,0 +1,300 @@
+"""
+End-to-end latency benchmark for the Hermine turn pipeline.
+
+Feeds WAV fixtures through the turns of HerminePipeline, from transcription
+to the spoken reply, against the local mock server (or any compatible
+endpoint, or the fake engines without any network) and reports p50/p95 of the
+latencies a user perceives, all measured from the start of the turn by the
+spans the pipeline traces.
+"""
+import argparse
+import asyncio
+import json
+import math
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import wave
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from async_clients import close_async_clients
+from backends import BackendConfig
+from pipeline import Conversation, HerminePipeline
+from stt import AudioTranscriber
+from text_generator import Message, TextGenerator
+from tracing import Tracer, Turn
+from tts import TextToSpeechConverter
+from mock_openai_server import MockOpenAIServer, add_latency_arguments, config_from_args
+
+METRICS = ("time_to_transcript", "time_to_first_token", "time_to_first_audio", "turn_total")
+
+
+@dataclass
+class TurnTiming:
+    """Latencies of one benchmarked turn, in seconds from the turn start."""
+    time_to_transcript: float = 0.0
+    time_to_first_token: float = 0.0
+    time_to_first_audio: float = 0.0
+    turn_total: float = 0.0
+
+
+@dataclass
+class BenchmarkReport:
+    """Collected timings with percentile helpers."""
+    turns: List[TurnTiming] = field(default_factory=list)
+
+    def percentile(self, metric: str, q: float) -> float:
+        """Linearly interpolated percentile of a metric."""
+        values = sorted(getattr(turn, metric) for turn in self.turns)
+        if not values:
+            return math.nan
+        position = (len(values) - 1) * q / 100.0
+        lower = math.floor(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/mean of every metric, in milliseconds."""
+        return {
+            metric: {
+                "p50": self.percentile(metric, 50) * 1000,
+                "p95": self.percentile(metric, 95) * 1000,
+                "mean": statistics.fmean(getattr(t, metric) for t in self.turns) * 1000,
+            }
+            for metric in METRICS
+        }
+
+
+def synthesize_fixture(path: Path, seconds: float = 2.0, rate: int = 16000) -> Path:
+    """Write a short spoken-like fixture when no recordings are supplied."""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 3 * i / rate)
+        sample = int(6000 * envelope * math.sin(2 * math.pi * 180 * i / rate))
+        frames += sample.to_bytes(2, "little", signed=True)
+
+    # pylint: disable=no-member
+    with wave.open(str(path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(bytes(frames))
+    # pylint: enable=no-member
+    return path
+
+
+def _timing(turn: Turn, total: float) -> TurnTiming:
+    """Latencies of a traced turn, from the end of its stages and its milestones."""
+    ends: Dict[str, float] = {}
+    for recorded in turn.spans:
+        # Milestones are recorded from the turn start, they end when they happened.
+        ends.setdefault(recorded.name, recorded.start - turn.started_at + recorded.duration)
+    # A whole, not streamed, reply has its first token when the completion ends.
+    first_token = ends.get("llm.first_token", ends.get("llm.completion", ends.get("llm.cache")))
+    return TurnTiming(
+        time_to_transcript=ends.get("stt", 0.0),
+        time_to_first_token=first_token or 0.0,
+        time_to_first_audio=ends.get("tts.first_byte", 0.0),
+        turn_total=total
+    )
+
+
+class PipelineBenchmark:
+    """Runs headless turns through HerminePipeline and reads their traces."""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: str = "benchmark",
+        backends: Optional[BackendConfig] = None
+    ) -> None:
+        """
+        Initialize the benchmarked pipeline.
+
+        Args:
+            base_url: API endpoint to benchmark against
+            api_key: API key sent to the endpoint
+            backends: Engines to benchmark, the OpenAI ones by default
+        """
+        self.pipeline = HerminePipeline(api_key=api_key, base_url=base_url,
+                                        backends=backends or BackendConfig())
+        # Spans stay in memory, the user's traces and metrics are left alone.
+        self.tracer = Tracer()
+
+    def run_turn(self, fixture: Path) -> TurnTiming:
+        """Run one turn, from the recording to the spoken reply, and time every stage."""
+        with tempfile.TemporaryDirectory() as scratch:
+            turn = self.tracer.start_turn()
+            try:
+                self.pipeline.run_turn(Conversation(), audio_path=fixture,
+                                       output_path=Path(scratch) / "reply.wav", turn=turn)
+                total = turn.elapsed()
+            finally:
+                turn.finish()
+        return _timing(turn, total)
+
+    def run(self, fixtures: List[Path], turns: int, warmup: int = 1) -> BenchmarkReport:
+        """Run warmup turns, then the measured turns, cycling through fixtures."""
+        for index in range(warmup):
+            self.run_turn(fixtures[index % len(fixtures)])
+
+        report = BenchmarkReport()
+        for index in range(turns):
+            report.turns.append(self.run_turn(fixtures[index % len(fixtures)]))
+        return report
+
+
+async def measure_concurrency(base_url: str, fixture: Path, requests: int) -> Dict[str, float]:
+    """
+    Run async turns one at a time, then all at once on this thread.
+
+    Args:
+        base_url: API endpoint to benchmark against
+        fixture: Recording to transcribe
+        requests: Number of turns in flight together
+
+    Returns:
+        Wall times in seconds, the peak number of turns in flight and the
+        number of client threads started while they ran
+    """
+    transcriber = AudioTranscriber(api_key="benchmark", base_url=base_url)
+    generator = TextGenerator(api_key="benchmark", base_url=base_url)
+    tts = TextToSpeechConverter(api_key="benchmark", base_url=base_url)
+    in_flight = {"now": 0, "peak": 0}
+
+    def client_threads() -> int:
+        # The in-process mock server handles each request on its own thread.
+        return sum("process_request" not in thread.name for thread in threading.enumerate())
+
+    async def turn() -> None:
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        transcript = await transcriber.transcribe_file_async(str(fixture))
+        reply = [fragment async for fragment in generator.stream_async(
+            [Message(role="user", content=transcript)])]
+        async for _ in tts.stream_speech_async("".join(reply) or "...", response_format="pcm"):
+            pass
+        in_flight["now"] -= 1
+
+    try:
+        start = time.perf_counter()
+        await turn()
+        sequential = time.perf_counter() - start
+
+        threads = client_threads()
+        start = time.perf_counter()
+        await asyncio.gather(*(turn() for _ in range(requests)))
+        concurrent = time.perf_counter() - start
+        return {
+            "single_turn_s": sequential,
+            "concurrent_s": concurrent,
+            "peak_in_flight": in_flight["peak"],
+            "threads_started": client_threads() - threads,
+        }
+    finally:
+        await close_async_clients()
+
+
+def _load_fixtures(directory: Optional[str], scratch: Path) -> List[Path]:
+    """Collect WAV fixtures, synthesizing one if none are given."""
+    if directory:
+        fixtures = sorted(Path(directory).glob("*.wav"))
+        if not fixtures:
+            raise FileNotFoundError(f"No WAV fixtures found in {directory}")
+        return fixtures
+    return [synthesize_fixture(scratch / "fixture.wav")]
+
+
+def _offline_backends(args: argparse.Namespace) -> BackendConfig:
+    """Fake engines with the same simulated latencies as the mock server."""
+    return BackendConfig(stt="fake", tts="fake", llm="fake", options={
+        "stt": {"latency": args.transcription_latency},
+        "llm": {"latency": args.first_token_latency,
+                "token_latency": 1.0 / args.tokens_per_second},
+        "tts": {"latency": args.speech_first_byte_latency},
+    })
+
+
+def _print_report(report: BenchmarkReport) -> None:
+    """Print a summary table."""
+    print(f"{'metric':<22}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for metric, values in report.summary().items():
+        print(f"{metric:<22}{values['p50']:>10.1f}{values['p95']:>10.1f}{values['mean']:>10.1f}")
+
+
+def _check_concurrency(args: argparse.Namespace) -> int:
+    """Run measure_concurrency and fail if the turns did not overlap."""
+    with tempfile.TemporaryDirectory() as scratch:
+        fixture = _load_fixtures(args.fixtures, Path(scratch))[0]
+        if args.base_url:
+            result = asyncio.run(measure_concurrency(
+                args.base_url, fixture, args.async_requests))
+        else:
+            with MockOpenAIServer(config_from_args(args)) as server:
+                result = asyncio.run(measure_concurrency(
+                    server.base_url, fixture, args.async_requests))
+
+    for name, value in result.items():
+        print(f"{name:<22}{value:>10.3f}" if isinstance(value, float) else f"{name:<22}{value:>10}")
+    # Fully serialized turns would take requests * single turn.
+    if result["concurrent_s"] > result["single_turn_s"] * max(2.0, args.async_requests / 4):
+        print(f"{args.async_requests} async turns took {result['concurrent_s']:.2f} s, "
+              "they did not run concurrently")
+        return 1
+    return 0
+
+
+def main() -> int:
+    """Run the benchmark and return a non-zero status on regression."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", help="Directory of recorded WAV fixtures")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--base-url", help="Benchmark an existing endpoint instead of the mock")
+    parser.add_argument("--offline", action="store_true",
+                        help="Benchmark the fake engines instead of an API endpoint")
+    add_latency_arguments(parser)
+    parser.add_argument("--async-requests", type=int,
+                        help="Instead, check that this many async turns overlap on one thread")
+    parser.add_argument("--json", help="Write the summary to this file")
+    parser.add_argument("--max-p95-ms", type=float,
+                        help="Fail if the p95 total turn time exceeds this budget")
+    args = parser.parse_args()
+
+    if args.async_requests:
+        return _check_concurrency(args)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        fixtures = _load_fixtures(args.fixtures, Path(scratch))
+        server = None
+        if args.offline:
+            benchmark = PipelineBenchmark(backends=_offline_backends(args))
+        elif args.base_url:
+            benchmark = PipelineBenchmark(args.base_url)
+        else:
+            server = MockOpenAIServer(config_from_args(args)).start()
+            benchmark = PipelineBenchmark(server.base_url)
+        try:
+            report = benchmark.run(fixtures, args.turns, args.warmup)
+        finally:
+            if server:
+                server.stop()
+
+    _print_report(report)
+    summary = report.summary()
+    if args.json:
+        Path(args.json).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    if args.max_p95_ms is not None and summary["turn_total"]["p95"] > args.max_p95_ms:
+        print(f"p95 turn time {summary['turn_total']['p95']:.1f} ms exceeds "
+              f"budget of {args.max_p95_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
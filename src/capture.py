@@ -0,0 +1,252 @@
+"""
+Module for always-open microphone capture.
+
+The input stream runs in PortAudio callback mode and writes into a ring
+buffer that is never locked: the callback is the only writer and only
+advances a byte counter after the data is in place, and readers copy from
+behind that counter. Readers wait on events instead of polling, so no Python
+loop spins while waiting for audio, and a new reader can start a little in
+the past to keep the first syllable (pre-roll).
+
+The device is opened at its native rate and channel count, and the callback
+converts each buffer to the configured format before storing it.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Optional, Set, Tuple
+
+import pyaudio
+
+from resample import FormatConverter
+
+
+@dataclass
+class CaptureConfig:  # pylint: disable=too-many-instance-attributes
+    """Configuration for the capture engine."""
+    channels: int = 1
+    rate: int = 16000
+    chunk: int = 512
+    format: int = pyaudio.paInt16
+    buffer_seconds: float = 30.0
+    preroll: float = 0.3
+    device_index: Optional[int] = None
+    native_format: bool = True
+
+
+def device_format(
+    audio: pyaudio.PyAudio,
+    device_index: Optional[int] = None,
+    max_channels: int = 2
+) -> Optional[Tuple[int, int]]:
+    """
+    Native sample rate and channel count of an input device.
+
+    Args:
+        audio: PyAudio instance
+        device_index: Device to query, the default input if omitted
+        max_channels: Upper bound on the channel count, multichannel
+            virtual devices report far more than the microphone has
+
+    Returns:
+        (rate, channels), or None if the device cannot be queried
+    """
+    try:
+        if device_index is None:
+            info = audio.get_default_input_device_info()
+        else:
+            info = audio.get_device_info_by_index(device_index)
+    except (IOError, OSError):
+        return None
+    return int(info["defaultSampleRate"]), max(1, min(int(info["maxInputChannels"]), max_channels))
+
+
+def open_converter(
+    audio: pyaudio.PyAudio,
+    rate: int,
+    channels: int,
+    sample_format: int,
+    device_index: Optional[int] = None
+) -> Tuple[int, int, Optional[FormatConverter]]:
+    """
+    Choose how to open an input device to obtain the given format.
+
+    Only 16-bit mono output is converted; other formats are requested
+    from the device as they are.
+
+    Returns:
+        (rate, channels, converter) to open the device with, the converter
+        being None if the device is opened in the wanted format
+    """
+    native = device_format(audio, device_index)
+    if native is None or channels != 1 or sample_format != pyaudio.paInt16 \
+            or native == (rate, channels):
+        return rate, channels, None
+    return native[0], native[1], FormatConverter(native[0], native[1], rate)
+
+
+class CaptureEngine:  # pylint: disable=too-many-instance-attributes
+    """Keeps an input stream open and buffers the most recent audio."""
+
+    def __init__(self, config: CaptureConfig, audio: Optional[pyaudio.PyAudio] = None) -> None:
+        """
+        Initialize the capture engine.
+
+        Args:
+            config: CaptureConfig object with capture parameters
+            audio: PyAudio instance to share, a new one is created if omitted
+        """
+        self.config = config
+        self.audio = audio or pyaudio.PyAudio()
+        self.frame_size = self.audio.get_sample_size(config.format) * config.channels
+        self.size = int(config.buffer_seconds * config.rate) * self.frame_size
+        self._ring = bytearray(self.size)
+        self._view = memoryview(self._ring)
+        self.written = 0
+        self.overflows = 0
+        self._waiters: Set[threading.Event] = set()
+        self._stream = None
+        self._converter: Optional[FormatConverter] = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the input stream is open."""
+        return self._stream is not None
+
+    def start(self) -> None:
+        """Open the input stream in callback mode."""
+        if self._stream is not None:
+            return
+        rate, channels, self._converter = self.config.rate, self.config.channels, None
+        if self.config.native_format:
+            rate, channels, self._converter = open_converter(
+                self.audio, self.config.rate, self.config.channels,
+                self.config.format, self.config.device_index
+            )
+        self._stream = self.audio.open(
+            format=self.config.format,
+            channels=channels,
+            rate=rate,
+            input=True,
+            input_device_index=self.config.device_index,
+            frames_per_buffer=self.config.chunk * rate // self.config.rate,
+            stream_callback=self._callback
+        )
+        self._stream.start_stream()
+
+    def stop(self) -> None:
+        """Close the input stream."""
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        for event in list(self._waiters):
+            event.set()
+
+    def _callback(self, in_data, _frame_count, _time_info, status):
+        """Copy a PortAudio buffer into the ring (PortAudio thread)."""
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        if self._converter is not None:
+            in_data = self._converter.convert(in_data)
+        length = len(in_data)
+        start = self.written % self.size
+        first = min(length, self.size - start)
+        self._view[start:start + first] = in_data[:first]
+        if first < length:
+            self._view[:length - first] = in_data[first:]
+        # Publish only once the bytes are in place.
+        self.written += length
+        for event in list(self._waiters):
+            event.set()
+        return None, pyaudio.paContinue
+
+    def reader(self, preroll: Optional[float] = None) -> "CaptureReader":
+        """
+        Create a reader starting slightly before now.
+
+        Args:
+            preroll: Seconds of already captured audio to include,
+                defaults to the configured pre-roll
+
+        Returns:
+            CaptureReader positioned at the start of the pre-roll
+        """
+        self.start()
+        preroll = self.config.preroll if preroll is None else preroll
+        back = int(preroll * self.config.rate) * self.frame_size
+        return CaptureReader(self, max(0, self.written - back))
+
+    def copy(self, position: int, length: int) -> bytes:
+        """Copy bytes starting at an absolute stream position."""
+        start = position % self.size
+        first = min(length, self.size - start)
+        data = bytes(self._view[start:start + first])
+        if first < length:
+            data += bytes(self._view[:length - first])
+        return data
+
+    def terminate(self) -> None:
+        """Stop capturing and release PortAudio."""
+        self.stop()
+        self.audio.terminate()
+
+
+class CaptureReader:
+    """Consumer of a CaptureEngine, usable where a blocking pyaudio stream is."""
+
+    def __init__(self, engine: CaptureEngine, position: int) -> None:
+        """
+        Initialize the reader.
+
+        Args:
+            engine: Engine to read from
+            position: Absolute byte position of the first byte to read
+        """
+        self.engine = engine
+        self.position = position
+        self.overruns = 0
+        self._event = threading.Event()
+        engine._waiters.add(self._event)  # pylint: disable=protected-access
+
+    def available(self) -> int:
+        """Number of bytes ready to be read."""
+        return self.engine.written - self.position
+
+    def read(self, num_frames: int, exception_on_overflow: bool = False) -> bytes:
+        """
+        Block until num_frames are captured and return them.
+
+        Mirrors pyaudio.Stream.read. If the reader fell more than a ring
+        length behind, it skips to the oldest audio still buffered.
+
+        Raises:
+            OSError: If the engine stops before enough audio is captured, or
+                on overrun when exception_on_overflow is set.
+        """
+        length = num_frames * self.engine.frame_size
+        while self.available() < length:
+            self._event.clear()
+            if self.available() >= length:
+                break
+            if not self.engine.running:
+                raise OSError("Capture engine stopped")
+            self._event.wait(0.5)
+
+        lag = self.available() - self.engine.size
+        if lag > 0:
+            self.overruns += 1
+            if exception_on_overflow:
+                raise OSError("Capture reader overrun")
+            self.position += lag + length
+
+        data = self.engine.copy(self.position, length)
+        self.position += length
+        return data
+
+    def stop_stream(self) -> None:
+        """Stop consuming; the engine itself keeps running."""
+        self.close()
+
+    def close(self) -> None:
+        """Detach from the engine."""
+        self.engine._waiters.discard(self._event)  # pylint: disable=protected-access
@@ -0,0 +1,385 @@
+"""
+Headless Hermine service.
+
+Runs the record, STT, LLM, tools and TTS pipeline behind a Unix socket so
+scripts, hotkeys and the GTK window can share one warm process. The protocol
+is one JSON object per line in each direction.
+
+Requests carry a "cmd" and an optional "session" (conversation) name:
+
+    {"cmd": "ping"}
+    {"cmd": "text", "text": "...", "speak": true}
+    {"cmd": "turn", "audio": "/path/to/recording.wav", "speak": true}
+    {"cmd": "listen", "play": true}
+    {"cmd": "reset", "purge": false}
+    {"cmd": "profile", "seconds": 10, "wait": false}
+
+Replies are {"ok": true, ...} or {"ok": false, "error": "..."}.
+Sessions are recorded in the journal and resumed when the daemon restarts.
+"""
+import argparse
+import json
+import math
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Optional
+
+from gi.repository import GLib
+
+from pipeline import Conversation, HerminePipeline, TurnResult
+from audio_output import PlaybackEngine
+from voice_recorder import VoiceRecorder, RecorderConfig
+from profiling import MAX_CAPTURE_SECONDS, MIN_CAPTURE_SECONDS, PROFILING
+from journal import SessionJournal
+
+# Without XDG_RUNTIME_DIR, each user gets their own directory under /tmp.
+RUNTIME_DIR = (Path(os.environ["XDG_RUNTIME_DIR"]) / "hermine" if os.environ.get("XDG_RUNTIME_DIR")
+               else Path(f"/tmp/hermine-{os.getuid()}"))
+SOCKET_PATH = Path(os.environ.get("HERMINE_SOCKET", str(RUNTIME_DIR / "hermine.sock")))
+
+
+def private_directory(path: Path) -> Path:
+    """
+    Create a directory only the current user can enter.
+
+    Raises:
+        PermissionError: If it already exists and belongs to someone else.
+    """
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = path.lstat()
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a directory owned by the current user")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def checked_recording(path: str) -> Path:
+    """
+    Validate a recording sent by a client before it is uploaded for transcription.
+
+    Raises:
+        PermissionError: If it is not a WAV file owned by the current user.
+    """
+    resolved = Path(path).resolve()
+    try:
+        info = resolved.stat()
+        with open(resolved, "rb") as f:
+            header = f.read(12)
+    except OSError as e:
+        raise PermissionError(f"Cannot read recording {path}: {e}") from e
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a file owned by the current user")
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise PermissionError(f"{path} is not a WAV recording")
+    return resolved
+
+
+class HermineService:  # pylint: disable=too-many-instance-attributes
+    """Dispatches requests to a shared pipeline, one conversation per session."""
+
+    def __init__(
+        self,
+        pipeline: Optional[HerminePipeline] = None,
+        journal: Optional[SessionJournal] = None
+    ) -> None:
+        """
+        Initialize the service.
+
+        Args:
+            pipeline: Pipeline to use, created with default settings if omitted
+            journal: Journal sessions are resumed from and recorded to,
+                None keeps them in memory only
+        """
+        self.pipeline = pipeline or HerminePipeline()
+        self.journal = journal
+        self.sessions: Dict[str, Conversation] = {}
+        self._sessions_lock = threading.Lock()
+        self._microphone = threading.Lock()
+        self._recorder: Optional[VoiceRecorder] = None
+        self._player: Optional[PlaybackEngine] = None
+        self.commands = {
+            "ping": self._cmd_ping,
+            "reset": self._cmd_reset,
+            "text": self._cmd_text,
+            "turn": self._cmd_turn,
+            "listen": self._cmd_listen,
+            "profile": self._cmd_profile,
+        }
+        private_directory(RUNTIME_DIR)
+
+    def conversation(self, session: str) -> Conversation:
+        """Get or create the conversation of a session."""
+        with self._sessions_lock:
+            if session not in self.sessions:
+                self.sessions[session] = Conversation.resume(self.journal, session)
+            return self.sessions[session]
+
+    def handle(self, request: dict) -> dict:
+        """
+        Execute one request.
+
+        Args:
+            request: Decoded request object
+
+        Returns:
+            Reply object
+        """
+        command = request.get("cmd")
+        session = str(request.get("session", "default"))
+        handler = self.commands.get(command)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command: {command}"}
+        try:
+            return {"ok": True, **handler(session, request)}
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Error handling {command}: {e}")
+            return {"ok": False, "error": str(e)}
+
+    def _output_path(self, session: str, request: dict) -> Optional[Path]:
+        """Per-session reply file, or None when no file is wanted."""
+        if not request.get("speak", True) or request.get("play"):
+            return None
+        safe_session = "".join(c if c.isalnum() else "_" for c in session)
+        return RUNTIME_DIR / f"response-{safe_session}.wav"
+
+    def _cmd_ping(self, _session: str, _request: dict) -> dict:
+        """Health check."""
+        return {"pid": os.getpid(), "sessions": len(self.sessions)}
+
+    def _cmd_reset(self, session: str, request: dict) -> dict:
+        """Forget a session's history, and with "purge" delete it from the journal."""
+        self.conversation(session).reset(purge=bool(request.get("purge")))
+        return {}
+
+    def _cmd_text(self, session: str, request: dict) -> dict:
+        """Answer a text message."""
+        result = self.pipeline.run_turn(
+            self.conversation(session),
+            text=str(request["text"]),
+            output_path=self._output_path(session, request)
+        )
+        return self._finish(result, request)
+
+    def _cmd_turn(self, session: str, request: dict) -> dict:
+        """Answer a recording made by the client."""
+        result = self.pipeline.run_turn(
+            self.conversation(session),
+            audio_path=checked_recording(str(request["audio"])),
+            output_path=self._output_path(session, request)
+        )
+        return self._finish(result, request)
+
+    def _cmd_listen(self, session: str, request: dict) -> dict:
+        """Record from the microphone until silence, then answer."""
+        with self._microphone:
+            if self._recorder is None:
+                self._recorder = VoiceRecorder(
+                    RecorderConfig(output_file=str(RUNTIME_DIR / "recording.wav"))
+                )
+            audio_path = self._recorder.record_until_silence()
+        request.setdefault("play", True)
+        return self._cmd_turn(session, {**request, "audio": audio_path})
+
+    def _cmd_profile(self, _session: str, request: dict) -> dict:
+        """Capture a CPU and allocation profile of the daemon."""
+        seconds = float(request.get("seconds", 10))
+        if not math.isfinite(seconds):
+            raise ValueError(f"Invalid profile length: {seconds}")
+        seconds = min(max(seconds, MIN_CAPTURE_SECONDS), MAX_CAPTURE_SECONDS)
+        if request.get("wait"):
+            report = PROFILING.capture(seconds)
+            if report is None:
+                raise RuntimeError("A profile is already being captured")
+            return {"report": str(report)}
+        if not PROFILING.capture_async(seconds):
+            raise RuntimeError("A profile is already being captured")
+        return {"report_dir": str(PROFILING.report_dir)}
+
+    def _finish(self, result: TurnResult, request: dict) -> dict:
+        """Stream the reply to the speakers if asked and serialize the result."""
+        if request.get("play") and result.reply:
+            if self._player is None:
+                self._player = PlaybackEngine()
+            self._player.play(self.pipeline.speak_stream(result.reply))
+        return asdict(result)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serves JSON lines on one client connection."""
+
+    server: "HermineServer"
+
+    def handle(self) -> None:
+        if not self._same_user():
+            self.wfile.write(b'{"ok": false, "error": "Permission denied"}\n')
+            return
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                reply = self.server.service.handle(request)
+            except json.JSONDecodeError as e:
+                reply = {"ok": False, "error": f"Invalid request: {e}"}
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+    def _same_user(self) -> bool:
+        """Whether the peer runs as the daemon's user, checked with SO_PEERCRED."""
+        try:
+            credentials = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                  struct.calcsize("3i"))
+        except (AttributeError, OSError):
+            # No peer credentials on this platform: rely on the socket permissions.
+            return True
+        _pid, uid, _gid = struct.unpack("3i", credentials)
+        return uid == os.getuid()
+
+
+class HermineServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server handling each client in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, service: HermineService) -> None:
+        private_directory(path.parent)
+        if path.exists():
+            if HermineClient(path).available():
+                raise RuntimeError(f"Another Hermine daemon is listening on {path}")
+            path.unlink()
+        # The socket is created by bind(): make it private from the start.
+        umask = os.umask(0o177)
+        try:
+            super().__init__(str(path), _RequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        self.path = path
+        self.service = service
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.path.unlink(missing_ok=True)
+
+
+class HermineClient:
+    """Client for the daemon socket."""
+
+    def __init__(self, path: Path = SOCKET_PATH, timeout: Optional[float] = 120.0) -> None:
+        """
+        Initialize the client.
+
+        Args:
+            path: Socket of the daemon
+            timeout: Seconds to wait for a reply, None waits forever
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+
+    def available(self) -> bool:
+        """Whether a daemon answers on the socket."""
+        try:
+            return bool(HermineClient(self.path, timeout=1.0).request("ping").get("pid"))
+        except (OSError, RuntimeError):
+            return False
+
+    def request(self, command: str, **fields) -> dict:
+        """
+        Send one request and wait for its reply.
+
+        Raises:
+            ConnectionError: If the daemon cannot be reached.
+            RuntimeError: If the daemon reports an error.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(str(self.path))
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise ConnectionError(f"Hermine daemon not running on {self.path}") from e
+            sock.sendall(json.dumps({"cmd": command, **fields}).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as reader:
+                line = reader.readline()
+        if not line:
+            raise ConnectionError("Hermine daemon closed the connection")
+        reply = json.loads(line)
+        if not reply.pop("ok", False):
+            raise RuntimeError(reply.get("error", "Unknown daemon error"))
+        return reply
+
+
+def serve(path: Path = SOCKET_PATH) -> None:
+    """Run the daemon until interrupted."""
+    server = HermineServer(path, HermineService(journal=SessionJournal.from_environment()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Hermine daemon listening on {path}")
+
+    def on_profile_signal() -> bool:
+        PROFILING.capture_async()
+        return True
+
+    # kill -USR1 <pid> captures a profile.
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, on_profile_signal)
+
+    # Portal responses are delivered as D-Bus signals on the GLib main loop.
+    loop = GLib.MainLoop()
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main() -> int:
+    """Command line entry point for the daemon and a minimal client."""
+    parser = argparse.ArgumentParser(description="Hermine headless service")
+    parser.add_argument("--socket", type=Path, default=SOCKET_PATH)
+    parser.add_argument("--session", default="default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="Run the daemon")
+    commands.add_parser("ping", help="Check that the daemon is running")
+    commands.add_parser("listen", help="Record a question and play the answer")
+    reset_parser = commands.add_parser("reset", help="Forget the session history")
+    reset_parser.add_argument("--purge", action="store_true",
+                              help="Also delete the session from the journal")
+    text_parser = commands.add_parser("text", help="Ask a question in text")
+    text_parser.add_argument("text")
+    profile_parser = commands.add_parser("profile", help="Profile the daemon")
+    profile_parser.add_argument("--seconds", type=float, default=10.0,
+                                help="Length of the capture, 1 to 300 seconds")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket)
+        return 0
+
+    fields = {"session": args.session}
+    if args.command == "text":
+        fields.update(text=args.text, speak=False)
+    elif args.command == "profile":
+        fields.update(seconds=args.seconds, wait=True)
+    elif args.command == "reset":
+        fields.update(purge=args.purge)
+    try:
+        reply = HermineClient(args.socket).request(args.command, **fields)
+    except (ConnectionError, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    print(json.dumps(reply, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
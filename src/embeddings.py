@@ -0,0 +1,62 @@
+"""
+Cheap local text embeddings.
+
+Texts are embedded as L2-normalized hashed character n-gram counts. This is
+not a semantic model, but it is deterministic, needs no download and is
+good enough to compare short spoken commands and questions that share
+wording.
+"""
+import re
+import unicodedata
+import zlib
+from typing import Iterable
+
+import numpy as np
+
+
+def normalize_text(text: str, keep: str = "") -> str:
+    """
+    Lowercase, strip accents and punctuation, and collapse whitespace.
+
+    Args:
+        text: Text to normalize
+        keep: Punctuation characters to leave in place
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(rf"[^\w\s{re.escape(keep)}]", " ", text)
+    return " ".join(text.split())
+
+
+class HashingEmbedder:
+    """Embeds text as hashed character n-grams."""
+
+    def __init__(self, dimensions: int = 1024, ngrams: tuple = (2, 3, 4)) -> None:
+        """
+        Initialize the embedder.
+
+        Args:
+            dimensions: Size of the embedding vectors
+            ngrams: Character n-gram lengths to count
+        """
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed one text as a unit vector."""
+        padded = f" {normalize_text(text)} "
+        indices = [
+            zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dimensions
+            for n in self.ngrams
+            for i in range(len(padded) - n + 1)
+        ]
+        vector = np.bincount(indices, minlength=self.dimensions).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts: Iterable[str]) -> np.ndarray:
+        """Embed several texts as the rows of a matrix."""
+        rows = [self.embed(text) for text in texts]
+        if not rows:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.vstack(rows)
@@ -0,0 +1,250 @@
+"""
+Module for preparing captured images before they are sent to the model.
+
+Screenshots are decoded, downscaled and re-encoded in a worker process so
+the large raw PNGs never block the caller, and the encoded result is cached
+by the content hash of the source file.
+"""
+import base64
+import hashlib
+import io
+import multiprocessing
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image
+
+
+@dataclass
+class ImageConfig:
+    """Configuration for image preparation."""
+    max_edge: int = 1568
+    format: str = "JPEG"
+    quality: int = 80
+    cache_size: int = 32
+    workers: int = 1
+
+
+@dataclass
+class PreparedImage:
+    """An encoded image ready to be attached to a chat request."""
+    key: str
+    mime_type: str
+    data: bytes
+    width: int
+    height: int
+
+    def to_data_url(self) -> str:
+        """Encode the image as a data URL."""
+        payload = base64.b64encode(self.data).decode("ascii")
+        return f"data:{self.mime_type};base64,{payload}"
+
+    def to_content_part(self) -> dict:
+        """Convert the image to a chat message content part."""
+        return {"type": "image_url", "image_url": {"url": self.to_data_url()}}
+
+
+def _encode_image(path: str, max_edge: int, fmt: str, quality: int) -> tuple:
+    """Decode, downscale and re-encode an image. Runs in a worker process."""
+    with Image.open(path) as image:
+        image.draft("RGB", (max_edge, max_edge))
+        image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt, quality=quality)
+        return buffer.getvalue(), image.width, image.height
+
+
+def _file_digest(path: Path) -> str:
+    """Hash a file's content in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImagePipeline:
+    """Downscales images off the caller's process and caches the results."""
+
+    def __init__(self, config: Optional[ImageConfig] = None) -> None:
+        """
+        Initialize the image pipeline.
+
+        Args:
+            config: ImageConfig object with encoding parameters
+        """
+        self.config = config or ImageConfig()
+        self._executor = None
+        self._cache: "OrderedDict[str, PreparedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def mime_type(self) -> str:
+        """MIME type produced by the configured encoder."""
+        return f"image/{self.config.format.lower()}"
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Start the worker process on first use."""
+        with self._lock:
+            if self._executor is None:
+                # Forking a multithreaded GTK process can copy held locks into
+                # the child, so workers come from a clean forkserver instead.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.config.workers,
+                    mp_context=multiprocessing.get_context("forkserver")
+                )
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Forget a broken pool so the next image starts a new one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _encode_locally(self, key: str, path: Path) -> PreparedImage:
+        """Encode in this process, when no worker process is usable."""
+        data, width, height = _encode_image(str(path), self.config.max_edge,
+                                            self.config.format, self.config.quality)
+        prepared = PreparedImage(key, self.mime_type, data, width, height)
+        self._store(key, prepared)
+        return prepared
+
+    def prepare(self, path: Union[str, Path]) -> Future:
+        """
+        Prepare an image for the model.
+
+        Args:
+            path: Path to the captured image
+
+        Returns:
+            Future resolving to a PreparedImage
+
+        Raises:
+            FileNotFoundError: If the image doesn't exist.
+        """
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Image file not found: {path}")
+
+        # Include the settings so a config change never serves a stale encoding.
+        key = (f"{_file_digest(path)}:{self.config.max_edge}:"
+               f"{self.config.format}:{self.config.quality}")
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                future: Future = Future()
+                future.set_result(cached)
+                return future
+
+        result: Future = Future()
+        executor = self._get_executor()
+        try:
+            work = executor.submit(
+                _encode_image,
+                str(path),
+                self.config.max_edge,
+                self.config.format,
+                self.config.quality
+            )
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            try:
+                result.set_result(self._encode_locally(key, path))
+            except OSError as e:
+                result.set_exception(e)
+            return result
+
+        def on_done(done: Future) -> None:
+            error = done.exception()
+            if isinstance(error, BrokenProcessPool):
+                # The worker died, e.g. killed for memory: encode here instead.
+                self._discard_executor(executor)
+                try:
+                    result.set_result(self._encode_locally(key, path))
+                except OSError as e:
+                    result.set_exception(e)
+                return
+            if error is not None:
+                result.set_exception(error)
+                return
+            data, width, height = done.result()
+            prepared = PreparedImage(key, self.mime_type, data, width, height)
+            self._store(key, prepared)
+            result.set_result(prepared)
+
+        work.add_done_callback(on_done)
+        return result
+
+    def _store(self, key: str, prepared: PreparedImage) -> None:
+        """Insert an entry and evict the least recently used ones."""
+        with self._lock:
+            self._cache[key] = prepared
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.config.cache_size:
+                self._cache.popitem(last=False)
+
+    def shutdown(self) -> None:
+        """Stop the worker process."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def attach_images(messages: list, images: list) -> list:
+    """
+    Attach prepared images to the last user message of a request.
+
+    The history itself is left untouched so the images are only sent once.
+
+    Args:
+        messages: Chat messages for the request
+        images: PreparedImage objects to attach
+
+    Returns:
+        A new message list
+    """
+    if not images:
+        return messages
+
+    request = list(messages)
+    for index in range(len(request) - 1, -1, -1):
+        message = request[index]
+        if message.get("role") == "user":
+            content = message.get("content") or ""
+            parts = [{"type": "text", "text": content}] if isinstance(content, str) \
+                else list(content)
+            parts.extend(image.to_content_part() for image in images)
+            request[index] = {**message, "content": parts}
+            break
+    return request
+
+
+def main() -> None:
+    """Prepare an image given on the command line and report the result."""
+    if len(sys.argv) != 2:
+        print("Usage: image_pipeline.py IMAGE")
+        return
+
+    pipeline = ImagePipeline()
+    try:
+        prepared = pipeline.prepare(sys.argv[1]).result()
+        print(f"{prepared.width}x{prepared.height} {prepared.mime_type}, "
+              f"{len(prepared.data)} bytes")
+    except (FileNotFoundError, OSError) as e:
+        print(f"Error: {e}")
+    finally:
+        pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Local intent matching for simple commands.
+
+Frequent commands such as "lock my screen" are recognized on the transcript
+and dispatched to their tool directly, skipping the chat completion round
+trip. The matcher is built from the tool registry: a regex grammar covers
+the exact phrasings, and an optional embedding classifier catches close
+variants of tools that take no arguments and change nothing. Negated
+commands ("don't lock the screen") are always left to the model.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from embeddings import HashingEmbedder, normalize_text
+
+DEFAULT_CONFIRMATION_DIR = Path.home() / ".cache" / "hermine" / "confirmations"
+
+# Phrasings are matched against normalized text (lowercase, no accents, no
+# punctuation besides what filename patterns use). Named groups become tool
+# arguments. File searches are left to the model, which presents the results;
+# a fixed confirmation could not.
+GRAMMAR: Dict[str, List[str]] = {
+    "lock_session": [
+        r"(?:please )?lock (?:my |the )?(?:screen|session|computer)(?: please)?",
+        r"(?:peux[ -]tu |tu peux )?verrouille[rz]? (?:mon |l |la |le )?"
+        r"(?:ecran|session|ordinateur|ordi)(?: s il te plait)?",
+    ],
+    "take_screenshot": [
+        r"(?:please )?take a (?:screenshot|screen shot|screen capture)(?: please)?",
+        r"(?:peux[ -]tu |tu peux )?(?:prends?|faire|fais) une capture(?: d ecran)?"
+        r"(?: s il te plait)?",
+    ],
+}
+
+# Extra examples for the embedding classifier.
+EXAMPLES: Dict[str, List[str]] = {
+    "lock_session": ["lock the screen", "verrouille l'écran", "verrouiller la session"],
+    "take_screenshot": ["take a screenshot", "capture d'écran", "fais une capture d'écran"],
+}
+
+# Tools acting on the system are only dispatched on an exact phrasing, never
+# on a similar-sounding one.
+SIDE_EFFECT_TOOLS = frozenset({"lock_session", "create_files"})
+
+# Negation words, matched on normalized text ("don't" becomes "don t").
+NEGATION = re.compile(r"\b(?:not|no|never|don t|dont|do not|doesn t|pas|ne|n|jamais|non)\b")
+
+CONFIRMATIONS: Dict[str, str] = {
+    "lock_session": "Session verrouillée.",
+    "take_screenshot": "Capture d'écran effectuée.",
+}
+
+# Spoken instead of the confirmation when the tool did not succeed.
+FAILURES: Dict[str, str] = {
+    "lock_session": "Je n'ai pas pu verrouiller la session.",
+    "take_screenshot": "La capture d'écran a échoué.",
+}
+
+
+@dataclass
+class IntentMatch:
+    """A transcript recognized as a direct tool call."""
+    name: str
+    arguments: Dict[str, str] = field(default_factory=dict)
+    confidence: float = 1.0
+    confirmation: str = ""
+
+    def as_tool_call(self) -> SimpleNamespace:
+        """Shape the match like a tool call returned by the API."""
+        return SimpleNamespace(function=SimpleNamespace(
+            name=self.name,
+            arguments=json.dumps(self.arguments)
+        ))
+
+
+class IntentMatcher:
+    """Matches transcripts against the tool registry."""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        tools: Iterable[dict],
+        grammar: Optional[Dict[str, List[str]]] = None,
+        examples: Optional[Dict[str, List[str]]] = None,
+        embedder: Optional[HashingEmbedder] = None,
+        threshold: float = 0.8,
+        side_effects: Iterable[str] = SIDE_EFFECT_TOOLS
+    ) -> None:
+        """
+        Initialize the matcher.
+
+        Args:
+            tools: Tool registry in the chat completions format
+            grammar: Regex phrasings per tool name
+            examples: Example phrasings for the embedding classifier
+            embedder: Enables the embedding classifier when given
+            threshold: Minimum similarity for an embedding match
+            side_effects: Tools kept out of the embedding classifier
+        """
+        grammar = GRAMMAR if grammar is None else grammar
+        examples = EXAMPLES if examples is None else examples
+        side_effects = set(side_effects)
+        self.threshold = threshold
+        self.embedder = embedder
+        self.patterns: Dict[str, List[re.Pattern]] = {}
+        labels, texts = [], []
+
+        for tool in tools:
+            function = tool["function"]
+            name = function["name"]
+            required = set(function.get("parameters", {}).get("required", []))
+            compiled = [re.compile(pattern) for pattern in grammar.get(name, [])]
+            # A phrasing is only usable if it captures every required argument.
+            compiled = [p for p in compiled if required <= set(p.groupindex)]
+            if compiled:
+                self.patterns[name] = compiled
+            if not required and name not in side_effects and embedder is not None:
+                for text in examples.get(name, []) + [function.get("description", "")]:
+                    labels.append(name)
+                    texts.append(text)
+
+        self._labels = labels
+        self._vectors = embedder.embed_many(texts) if embedder is not None else None
+
+    def match(self, transcript: str) -> Optional[IntentMatch]:
+        """
+        Recognize a transcript as a direct tool call.
+
+        Args:
+            transcript: What the user said
+
+        Returns:
+            IntentMatch if a high-confidence intent was found, else None
+        """
+        text = normalize_text(transcript, keep=".*-")
+        # Drop sentence punctuation but keep dots inside filenames.
+        text = re.sub(r"[.-]+(?=\s|$)", "", text).strip()
+        # Filenames such as "no.txt" are not negations.
+        if NEGATION.search(re.sub(r"\S*[.*]\S*", " ", text)):
+            return None
+        for name, patterns in self.patterns.items():
+            for pattern in patterns:
+                found = pattern.fullmatch(text)
+                if found:
+                    arguments = {k: v for k, v in found.groupdict().items() if v}
+                    return IntentMatch(name, arguments, 1.0,
+                                       CONFIRMATIONS.get(name, "C'est fait."))
+
+        if self.embedder is None or not self._labels:
+            return None
+        scores = self._vectors @ self.embedder.embed(text)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            name = self._labels[best]
+            return IntentMatch(name, {}, float(scores[best]),
+                               CONFIRMATIONS.get(name, "C'est fait."))
+        return None
+
+
+class ConfirmationCache:
+    """Keeps synthesized confirmations on disk so they play without a request."""
+
+    def __init__(self, directory: Path = DEFAULT_CONFIRMATION_DIR, voice: str = "",
+                 persist: bool = True) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            directory: Where the PCM clips are stored
+            voice: Identity of the TTS engine, model, voice and sample rate,
+                so clips of another voice are never replayed
+            persist: Store the clips on disk, not only in memory
+        """
+        self.directory = directory
+        self.voice = voice
+        self.persist = persist
+        self._memory: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, text: str) -> Path:
+        """File holding the clip of a text."""
+        key = hashlib.sha256(f"{self.voice}\n{text}".encode("utf-8")).hexdigest()[:32]
+        return self.directory / f"{key}.pcm"
+
+    def get(self, text: str) -> Optional[bytes]:
+        """Return the cached clip of a text, if any."""
+        with self._lock:
+            if text in self._memory:
+                return self._memory[text]
+        if not self.persist:
+            return None
+        try:
+            data = self._path(text).read_bytes()
+        except OSError:
+            return None
+        with self._lock:
+            self._memory[text] = data
+        return data
+
+    def stream(
+        self,
+        text: str,
+        synthesize: Callable[[str], Iterable[bytes]],
+        chunk_size: int = 4800
+    ) -> Iterator[bytes]:
+        """
+        Yield the clip of a text, synthesizing and storing it on a miss.
+
+        Args:
+            text: Confirmation to speak
+            synthesize: Produces PCM chunks for a text
+            chunk_size: Size of the chunks yielded from the cache
+        """
+        data = self.get(text)
+        if data is not None:
+            for offset in range(0, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+            return
+
+        chunks = []
+        for chunk in synthesize(text):
+            chunks.append(chunk)
+            yield chunk
+        data = b"".join(chunks)
+        with self._lock:
+            self._memory[text] = data
+        if not self.persist:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # A clip cut short by a crash or a concurrent writer must never be replayed.
+            fd, tmp_file = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_file, self._path(text))
+            except OSError:
+                os.unlink(tmp_file)
+                raise
+        except OSError as e:
+            print(f"Error caching confirmation: {e}")
@@ -0,0 +1,404 @@
+"""
+Append-only session journal.
+
+Every message of a conversation (user turns, replies, tool results), every
+reset and the recordings and replies of each turn are appended to a SQLite
+database in WAL mode, so a restarted Hermine picks up where it stopped
+without replaying anything through the API. Writes are queued and committed
+in batches by a background thread; reads go through a memory-mapped
+connection and an index on (session, kind, id), so loading the tail of a
+session costs the same after a day or after months of history.
+
+The journal holds every conversation, so its directory and files are only
+readable by their owner, records and audio older than the retention period
+are deleted when it is opened, and a session can be purged entirely.
+
+    python3 journal.py show --session window
+    python3 journal.py prune --days 7
+    python3 journal.py purge --session window
+    python3 journal.py benchmark --records 1000000
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from tracing import current_turn
+
+DATA_DIR = Path(os.environ.get("XDG_DATA_HOME", str(Path.home() / ".local" / "share"))) / "hermine"
+MMAP_SIZE = 256 * 1024 * 1024
+BATCH_SIZE = 512
+# Records and kept audio older than this are deleted when the journal is
+# opened; 0 keeps everything.
+RETENTION_DAYS = float(os.environ.get("HERMINE_JOURNAL_RETENTION_DAYS", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    turn_id TEXT,
+    created REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_by_session ON records (session, kind, id);
+"""
+
+Record = Tuple[str, str, Optional[str], float, str]
+
+
+class SessionJournal:
+    """Appends conversation records off the caller's thread and loads session tails."""
+
+    def __init__(self, path: Union[str, Path], keep_audio: bool = False,
+                 retention_days: float = 0.0) -> None:
+        """
+        Open or create the journal.
+
+        Args:
+            path: SQLite database file
+            keep_audio: Copy the recordings and replies next to the journal,
+                as the originals are overwritten by the next turn
+            retention_days: Delete older records and audio, 0 keeps everything
+
+        Raises:
+            sqlite3.Error: If the database is corrupt, locked or cannot be opened
+            OSError: If the directory or file cannot be created
+        """
+        self.path = Path(path)
+        self.audio_dir = self.path.parent / "audio"
+        self.keeps_audio = keep_audio
+        self._restrict()
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+            if retention_days > 0:
+                self._prune(connection, retention_days)
+        self._reader = self._connect()
+        self._reader_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Record]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="hermine-journal",
+                                        daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_environment(cls) -> Optional["SessionJournal"]:
+        """
+        Open the journal named by HERMINE_JOURNAL.
+
+        A copy of each turn's audio is kept unless HERMINE_JOURNAL_AUDIO=0, and
+        records older than HERMINE_JOURNAL_RETENTION_DAYS are deleted. A corrupt
+        journal is moved aside and a new one started.
+
+        Returns:
+            The journal, None if HERMINE_JOURNAL is set empty or it cannot be opened
+        """
+        path = os.environ.get("HERMINE_JOURNAL", str(DATA_DIR / "journal.sqlite3"))
+        if not path:
+            return None
+        options = {"keep_audio": os.environ.get("HERMINE_JOURNAL_AUDIO", "1") != "0",
+                   "retention_days": RETENTION_DAYS}
+        try:
+            return cls(path, **options)
+        except sqlite3.OperationalError as e:
+            # Locked by another process or not writable: leave it alone.
+            print(f"Error opening the journal, continuing without it: {e}")
+            return None
+        except sqlite3.DatabaseError as e:
+            print(f"The journal {path} is corrupt: {e}")
+        except OSError as e:
+            print(f"Error opening the journal, continuing without it: {e}")
+            return None
+        try:
+            aside = _move_aside(Path(path))
+            print(f"Moved the corrupt journal to {aside}, starting a new one")
+            return cls(path, **options)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error opening the journal, continuing without it: {e}")
+            return None
+
+    def _restrict(self) -> None:
+        """Create the journal readable by its owner only, and tighten an older one."""
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if self.path.parent == DATA_DIR:
+            os.chmod(DATA_DIR, 0o700)
+        # SQLite creates the -wal and -shm files with the mode of the database.
+        os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.chmod(f"{self.path}{suffix}", 0o600)
+            except FileNotFoundError:
+                pass
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the journal's settings."""
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL commits survive crashes of the process; only a power loss may
+        # drop the last few batches.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        return connection
+
+    def append(self, session: str, kind: str, payload: dict) -> None:
+        """
+        Queue a record; returns immediately.
+
+        Args:
+            session: Conversation the record belongs to
+            kind: "message", "audio" or "reset"
+            payload: JSON-serializable content of the record
+        """
+        turn = current_turn()
+        self._queue.put((
+            session,
+            kind,
+            turn.turn_id if turn is not None else None,
+            time.time(),
+            json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        ))
+
+    def keep_audio(self, path: Union[str, Path]) -> Optional[str]:
+        """
+        Reference to an audio file that outlives the next turn.
+
+        Returns:
+            The path of a copy in the journal, None when audio is not kept,
+            as the original is overwritten by the next turn
+        """
+        if not self.keeps_audio:
+            return None
+        turn = current_turn()
+        prefix = turn.turn_id if turn is not None else f"{time.time():.6f}"
+        target = self.audio_dir / f"{prefix}-{Path(path).name}"
+        try:
+            self.audio_dir.mkdir(mode=0o700, exist_ok=True)
+            shutil.copyfile(path, target)
+        except OSError as e:
+            print(f"Error keeping audio in the journal: {e}")
+            return None
+        return str(target)
+
+    def tail(self, session: str, kind: str = "message", limit: int = 100) -> List[dict]:
+        """
+        The latest records of a session since its last reset, oldest first.
+
+        Args:
+            session: Conversation to read
+            kind: Kind of records to return
+            limit: Maximum number of records, negative for all of them
+        """
+        self.flush()
+        with self._reader_lock:
+            (reset_id,) = self._reader.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM records WHERE session = ? AND kind = 'reset'",
+                (session,)
+            ).fetchone()
+            rows = self._reader.execute(
+                "SELECT payload FROM records WHERE session = ? AND kind = ? AND id > ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session, kind, reset_id, limit)
+            ).fetchall()
+        return [json.loads(payload) for (payload,) in reversed(rows)]
+
+    def prune(self, days: float) -> int:
+        """
+        Delete the records and kept audio older than a number of days.
+
+        Returns:
+            Number of records deleted
+        """
+        self.flush()
+        with closing(self._connect()) as connection:
+            return self._prune(connection, days)
+
+    def _prune(self, connection: sqlite3.Connection, days: float) -> int:
+        """Delete what is older than a number of days through a connection."""
+        cutoff = time.time() - days * 86400
+        connection.execute("PRAGMA secure_delete=ON")
+        # Ids grow with time, so the old records are the ones before the
+        # first recent one, found without an index on the creation time.
+        with connection:
+            (first,) = connection.execute(
+                "SELECT COALESCE((SELECT id FROM records WHERE created >= ? ORDER BY id LIMIT 1), "
+                "(SELECT COALESCE(MAX(id), 0) + 1 FROM records))",
+                (cutoff,)
+            ).fetchone()
+            deleted = connection.execute("DELETE FROM records WHERE id < ?", (first,)).rowcount
+        for audio in self.audio_dir.glob("*") if self.audio_dir.is_dir() else ():
+            try:
+                if audio.stat().st_mtime < cutoff:
+                    audio.unlink()
+            except OSError as e:
+                print(f"Error deleting old journal audio: {e}")
+        if deleted:
+            _erase_deleted(connection)
+        return deleted
+
+    def purge(self, session: str) -> int:
+        """
+        Delete every record of a session and the audio kept for it.
+
+        Returns:
+            Number of records deleted
+        """
+        self.flush()
+        with closing(self._connect()) as connection:
+            # Overwrite the deleted records instead of only unlinking their pages.
+            connection.execute("PRAGMA secure_delete=ON")
+            with connection:
+                audio = connection.execute(
+                    "SELECT payload FROM records WHERE session = ? AND kind = 'audio'",
+                    (session,)
+                ).fetchall()
+                deleted = connection.execute("DELETE FROM records WHERE session = ?",
+                                             (session,)).rowcount
+            _erase_deleted(connection)
+        for (payload,) in audio:
+            path = Path(json.loads(payload).get("path", ""))
+            if path.parent == self.audio_dir:
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError as e:
+                    print(f"Error deleting journal audio: {e}")
+        return deleted
+
+    def flush(self) -> None:
+        """Wait until every queued record is committed."""
+        if self._writer.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        """Commit the queued records and stop the writer."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        with self._reader_lock:
+            self._reader.close()
+
+    def _write_loop(self) -> None:
+        """Commit queued records, everything queued at once in one transaction."""
+        connection = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            running = len(records) == len(batch)
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO records (session, kind, turn_id, created, payload) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        records
+                    )
+            except sqlite3.Error as e:
+                print(f"Error writing to the journal: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        connection.close()
+
+
+def _erase_deleted(connection: sqlite3.Connection) -> None:
+    """Copy the zeroed pages of deleted records into the database and empty the WAL."""
+    try:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.OperationalError as e:
+        # A busy reader only delays it until the next checkpoint.
+        print(f"Error checkpointing the journal: {e}")
+
+
+def _move_aside(path: Path) -> Path:
+    """Rename a database and its WAL files out of the way, returns the new name."""
+    aside = path.with_name(f"{path.name}.corrupt-{time.strftime('%Y%m%d-%H%M%S')}")
+    for suffix in ("", "-wal", "-shm"):
+        source = Path(f"{path}{suffix}")
+        if source.exists():
+            os.replace(source, f"{aside}{suffix}")
+    return aside
+
+
+def show(journal: SessionJournal, session: str, limit: int) -> None:
+    """Print the latest messages of a session."""
+    for message in journal.tail(session, limit=limit):
+        content = message.get("content")
+        print(f"{message.get('role', '?'):>9}: {content}")
+
+
+def benchmark(records: int) -> None:
+    """Measure appends and resume time against a journal holding many records."""
+    with tempfile.TemporaryDirectory() as scratch:
+        journal = SessionJournal(Path(scratch) / "journal.sqlite3")
+        start = time.perf_counter()
+        for index in range(records):
+            role = "user" if index % 2 == 0 else "assistant"
+            # A handful of sessions, like the window and a few daemon clients.
+            journal.append(f"session-{index % 4}", "message",
+                           {"role": role, "content": f"Message {index} " + "x" * 80})
+        queued = time.perf_counter() - start
+        journal.flush()
+        written = time.perf_counter() - start
+        size = journal.path.stat().st_size + Path(f"{journal.path}-wal").stat().st_size
+        journal.close()
+
+        start = time.perf_counter()
+        resumed = SessionJournal(journal.path)
+        messages = resumed.tail("session-0", limit=60)
+        resume = time.perf_counter() - start
+        resumed.close()
+
+    print(f"records               {records:>12}")
+    print(f"append (caller) us    {queued / records * 1e6:>12.2f}")
+    print(f"write records/s       {records / written:>12.0f}")
+    print(f"journal MB            {size / 1e6:>12.1f}")
+    print(f"open + tail ms        {resume * 1000:>12.2f}  ({len(messages)} messages)")
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    show_parser = commands.add_parser("show", help="Print the tail of a session")
+    show_parser.add_argument("--session", default="default")
+    show_parser.add_argument("--limit", type=int, default=20)
+    prune_parser = commands.add_parser("prune", help="Delete records older than some days")
+    prune_parser.add_argument("--days", type=float, default=RETENTION_DAYS or 30.0)
+    purge_parser = commands.add_parser("purge", help="Delete every record of a session")
+    purge_parser.add_argument("--session", default="default")
+    benchmark_parser = commands.add_parser("benchmark", help="Measure write and resume speed")
+    benchmark_parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        benchmark(args.records)
+        return
+    journal = SessionJournal.from_environment()
+    if journal is None:
+        print("The journal is disabled or could not be opened")
+        return
+    if args.command == "prune":
+        print(f"Deleted {journal.prune(args.days)} records")
+    elif args.command == "purge":
+        print(f"Deleted {journal.purge(args.session)} records")
+    else:
+        show(journal, args.session, args.limit)
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
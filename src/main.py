@@ -4,8 +4,8 @@ Hermine - A copilot for Linux
 import os
 import sys
 import math
+import signal
 import threading
-import json
 from typing import Tuple, List, Optional
 
 import gi
@@ -13,14 +13,15 @@ gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
 from gi.repository import Gtk, GLib, Gdk, Gio  # pylint: disable=wrong-import-position
 import cairo  # pylint: disable=wrong-import-position
-import vlc  # pylint: disable=wrong-import-position
-from openai import OpenAI  # pylint: disable=wrong-import-position
 
 from voice_recorder import VoiceRecorder, RecorderConfig  # pylint: disable=wrong-import-position relative-beyond-top-level
-from tts import TextToSpeechConverter  # pylint: disable=wrong-import-position relative-beyond-top-level
-from stt import AudioTranscriber  # pylint: disable=wrong-import-position relative-beyond-top-level
-from portal_dbus import DesktopPortal  # pylint: disable=wrong-import-position relative-beyond-top-level
-from tools import search_file_and_get_urls, create_files # pylint: disable=wrong-import-position relative-beyond-top-level
+from pipeline import Conversation, HerminePipeline  # pylint: disable=wrong-import-position relative-beyond-top-level
+from daemon import HermineClient  # pylint: disable=wrong-import-position relative-beyond-top-level
+from audio_output import PlaybackEngine  # pylint: disable=wrong-import-position relative-beyond-top-level
+from wake_word import WakeWordListener  # pylint: disable=wrong-import-position relative-beyond-top-level
+from tracing import TRACER, current_turn, mark, use_turn  # pylint: disable=wrong-import-position relative-beyond-top-level
+from profiling import PROFILING  # pylint: disable=wrong-import-position relative-beyond-top-level
+from journal import SessionJournal  # pylint: disable=wrong-import-position relative-beyond-top-level
 
 APP_NAME = "Hermine"
 APP_VERSION = "0.0.1"
@@ -29,83 +30,8 @@ APP_AUTHORS = ["Melvin Redondo--Tanis"]
 APP_LICENSE = "Any"
 APP_WEBSITE = "https://melvinredondotanis.github.io/hermine"
 IS_RESIZABLE = False
-
-CLIENT = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-PROMPT = """
-            Vous êtes un assistant vocal pour le système Linux.
-            \\ Votre nom est Hermine. Vous avez une connaissance approfondie
-            \\ du système d'exploitation de l'utilisateur et pouvez fournir des
-            \\ explications précises et efficaces.
-        """
-TOOLS = [
-    {
-        "type": "function",
-        "function": {
-            "name": "take_screenshot",
-            "description": "Take a screenshot of the current screen"
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "lock_session",
-            "description": "Lock the current session"
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "search_file_and_get_urls",
-            "description": "Search for files matching the pattern in the user's home directory",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "filename_pattern": {
-                        "type": "string",
-                        "description": "Search pattern for filenames"
-                    }
-                },
-                "required": ["filename_pattern"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "create_files",
-            "description": "Create files with the given content",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "files": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "name": {
-                                    "type": "string",
-                                    "description": "Name of the file"
-                                },
-                                "content": {
-                                    "type": "string",
-                                    "description": "Content of the file"
-                                }
-                            },
-                            "required": ["name", "content"]
-                        }
-                    },
-                    "path": {
-                        "type": "string",
-                        "description": "Directory path where files should be created"
-                    }
-                },
-                "required": ["files"]
-            }
-        }
-    }
-]
-DBUS_PORTAL = DesktopPortal()
-
+DAEMON_SESSION = "window"
+PROFILE_SECONDS = 10
 
 FPS = 60
 FRAME_DELAY_MS = int(1000 / FPS)
@@ -298,7 +224,7 @@ class Orb(Gtk.DrawingArea):
         cr.fill()
 
 
-class HermineWindow(Gtk.ApplicationWindow):
+class HermineWindow(Gtk.ApplicationWindow):  # pylint: disable=too-many-instance-attributes
     """Main application window with menus and orb"""
 
     def __init__(self, application: Gtk.Application) -> None:
@@ -310,11 +236,20 @@ class HermineWindow(Gtk.ApplicationWindow):
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
         self.add(self.main_box)  # pylint: disable=no-member
 
-        config = RecorderConfig(output_file="hermine_recording.wav")
+        config = RecorderConfig(
+            output_file="hermine_recording.wav",
+            persistent=os.environ.get("HERMINE_PERSISTENT_CAPTURE") == "1"
+        )
         self.voice_recorder = VoiceRecorder(config)
         self.recording_thread = None
         self.is_recording = False
-        self.conversation_history = []
+        # Pick up the conversation where the previous run left it.
+        self.conversation = Conversation.resume(SessionJournal.from_environment(), DAEMON_SESSION)
+        self.daemon = HermineClient()
+        self.pipeline = None
+        self.player = PlaybackEngine()
+        self.wake_word = None
+        self.turn = None
 
         self._create_menu()
         self._setup_orb()
@@ -333,6 +268,12 @@ class HermineWindow(Gtk.ApplicationWindow):
         self.main_box.pack_start(menubar, False, False, 0)  # pylint: disable=no-member
 
         file_menu = self._create_menu_item("Files", menubar)
+        self._create_menu_item(
+            "Hands-free mode",
+            file_menu.get_submenu(),
+            callback=self._toggle_hands_free,
+            check=True
+        )
         self._create_menu_item(
             "Quit",
             file_menu.get_submenu(),
@@ -340,13 +281,16 @@ class HermineWindow(Gtk.ApplicationWindow):
         )
 
         info_menu = self._create_menu_item("Help", menubar)
+        self._create_menu_item("Profile for 10 seconds", info_menu.get_submenu(),
+                               callback=self._start_profile)
         self._create_menu_item("About", info_menu.get_submenu(),
                                callback=self._show_about_dialog)
 
     def _create_menu_item(self, label: str, parent_menu: Gtk.MenuShell,
-                          callback: Optional[callable] = None) -> Gtk.MenuItem:
-        """Helper to create and attach menu items"""
-        menu_item = Gtk.MenuItem(label=label)
+                          callback: Optional[callable] = None,
+                          check: bool = False) -> Gtk.MenuItem:
+        """Helper to create and attach menu items, check items show an on/off state"""
+        menu_item = Gtk.CheckMenuItem(label=label) if check else Gtk.MenuItem(label=label)
 
         if isinstance(parent_menu, Gtk.MenuBar):
             submenu = Gtk.Menu()
@@ -376,6 +320,48 @@ class HermineWindow(Gtk.ApplicationWindow):
         about_dialog.run()  # pylint: disable=no-member
         about_dialog.destroy()
 
+    def _start_profile(self, _: Gtk.MenuItem) -> None:
+        """Capture a CPU and allocation profile in the background"""
+        if PROFILING.capture_async(PROFILE_SECONDS):
+            print(f"Profiling for {PROFILE_SECONDS} seconds...")
+        else:
+            print("A profile is already being captured")
+
+    def _toggle_hands_free(self, item: Gtk.CheckMenuItem) -> None:
+        """Start or stop listening for the wake word to match the menu check"""
+        if not item.get_active():
+            if self.wake_word is not None:
+                self.wake_word.stop()
+                self.wake_word = None
+                # Close the microphone, unless a recording still reads from it.
+                if not self.is_recording:
+                    self.voice_recorder.release_capture()
+                print("Hands-free mode disabled")
+            return
+        if self.wake_word is not None:
+            return
+
+        listener = WakeWordListener(
+            self.voice_recorder.ensure_capture(),
+            lambda: GLib.idle_add(self._on_wake_word)
+        )
+        if not listener.detector.templates:
+            print("No wake word enrolled, run: python3 wake_word.py enroll")
+            self.voice_recorder.release_capture()
+            # Re-enters this handler unchecked, with nothing left to stop.
+            item.set_active(False)
+            return
+        self.wake_word = listener
+        self.wake_word.start()
+        print("Hands-free mode enabled")
+
+    def _on_wake_word(self) -> bool:
+        """Start a turn when the wake word is heard"""
+        if not self.is_recording:
+            self.orb.activate()
+            self._start_recording(until_silence=True)
+        return False
+
     def _on_orb_clicked(self, widget: Orb, _: Gdk.Event) -> bool:
         """Toggle orb activation and recording on click"""
         if self.is_recording:
@@ -386,13 +372,17 @@ class HermineWindow(Gtk.ApplicationWindow):
             self._start_recording()
         return True
 
-    def _start_recording(self) -> None:
+    def _start_recording(self, until_silence: bool = False) -> None:
         """Start recording in a separate thread"""
         if self.is_recording:
             return
 
         self.is_recording = True
-        self.recording_thread = threading.Thread(target=self._recording_thread_function)
+        self.turn = TRACER.start_turn()
+        self.recording_thread = threading.Thread(
+            target=self._recording_thread_function,
+            args=(self.turn, until_silence)
+        )
         self.recording_thread.daemon = True
         self.recording_thread.start()
 
@@ -403,116 +393,87 @@ class HermineWindow(Gtk.ApplicationWindow):
             if self.recording_thread and self.recording_thread.is_alive():
                 self.recording_thread.join(0.5)
 
-    def _recording_thread_function(self) -> None:
+    def _recording_thread_function(self, turn, until_silence: bool = False) -> None:
         """Record audio and update UI when finished"""
         try:
-            # Record audio continuously until stopped manually
-            self.voice_recorder.record_continuously()
-
-            GLib.idle_add(self._recording_finished)
+            with use_turn(turn):
+                if until_silence:
+                    self.voice_recorder.record_until_silence()
+                else:
+                    # Record audio continuously until stopped manually
+                    self.voice_recorder.record_continuously()
+
+            GLib.idle_add(self._recording_finished, turn)
         except Exception as e:  # pylint: disable=broad-exception-caught
             print(f"Error during recording: {e}")
-            GLib.idle_add(self._recording_finished)
+            GLib.idle_add(self._recording_finished, turn)
 
-    def _recording_finished(self) -> None:
+    def _recording_finished(self, turn) -> None:
         """Handle UI updates when recording is finished"""
         self.is_recording = False
         if self.orb.active:
             self.orb.active = False
-
-        if not hasattr(self, 'conversation_history'):
-            self.conversation_history = [
-                {"role": "system", "content": PROMPT}
-            ]
-
-        threading.Thread(target=self._process_transcription, daemon=True).start()
-
-    def _process_transcription(self) -> None:
-        """Process audio transcription in a separate thread"""
-        stt = AudioTranscriber()
+        if self.wake_word is None:
+            # Hands-free mode was turned off during the recording.
+            self.voice_recorder.release_capture()
+
+        self._run_in_turn(turn, self._process_turn, os.path.abspath("hermine_recording.wav"))
+
+    @staticmethod
+    def _run_in_turn(turn, target: callable, *args) -> None:
+        """Run target in a daemon thread with the given turn active"""
+        def run() -> None:
+            with use_turn(turn):
+                target(*args)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _process_turn(self, audio_path: str) -> None:
+        """Answer the recording, through the daemon when one is running"""
+        # The turn this thread was started for; self.turn may already be the next one.
+        turn = current_turn()
+        playing = False
         try:
-            transcription = stt.transcribe_file("hermine_recording.wav")
-            if transcription:
-                GLib.idle_add(self._call_openai_api, transcription)
-        except Exception as e: # pylint: disable=broad-exception-caught
-            print(f"Error during transcription: {e}")
-
-    def _call_openai_api(self, transcription: str) -> None:
-        """Call OpenAI API in a separate thread"""
-        self.conversation_history.append({"role": "user", "content": transcription})
-        threading.Thread(target=self._execute_openai_call, daemon=True).start()
-
-    def _execute_openai_call(self) -> None: # pylint: disable=too-many-branches
-        """Execute the OpenAI API call in a separate thread"""
-        completion = CLIENT.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=self.conversation_history,
-            tools=TOOLS
-        )
-
-        response_message = completion.choices[0].message
-
-        if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
-            for tool_call in response_message.tool_calls:
-                if tool_call.function.name == "take_screenshot":
-                    DBUS_PORTAL.take_screenshot()
-                elif tool_call.function.name == "lock_session":
-                    DBUS_PORTAL.lock_session()
-                elif tool_call.function.name == "search_file_and_get_urls":
-                    args = json.loads(tool_call.function.arguments)
-                    filename_pattern = args.get("filename_pattern")
-                    print(f"Searching for files matching '{filename_pattern}'")
-                    if filename_pattern:
-                        results = search_file_and_get_urls(filename_pattern)
-                        if results:
-                            result_message = (f"Found files matching '{filename_pattern}':\n" +
-                                              "\n".join(results))
-                        else:
-                            result_message = f"No files found matching '{filename_pattern}'"
-                        self.conversation_history.append({
-                            "role": "function", 
-                            "name": "search_file_and_get_urls", 
-                            "content": result_message
-                        })
-                elif tool_call.function.name == "create_files":
-                    args = json.loads(tool_call.function.arguments)
-                    files = args.get("files")
-                    if files:
-                        results = create_files(files)
-                        if results:
-                            result_message = ("Files created successfully:\n" +
-                                              "\n".join(results))
-                        else:
-                            result_message = "Failed to create files"
-                        self.conversation_history.append({
-                            "role": "function", 
-                            "name": "create_files", 
-                            "content": result_message
-                        })
-
-        response_text = response_message.content or ""
-
-        if response_text:
-            self.conversation_history.append({"role": "assistant", "content": response_text})
-            GLib.idle_add(self._generate_speech, response_text)
-
-    def _generate_speech(self, text: str) -> None:
-        """Generate speech in a separate thread"""
-        threading.Thread(target=self._execute_speech_generation, args=(text,), daemon=True).start()
-
-    def _execute_speech_generation(self, text: str) -> None:
-        """Execute speech generation in a separate thread"""
-        try:
-            tts = TextToSpeechConverter()
-            output_file = tts.generate_speech(text, "hermine_response.mp3")
-            GLib.idle_add(self._play_audio, str(output_file))
-        except Exception as e: # pylint: disable=broad-exception-caught
-            print(f"Error during speech generation: {e}")
+            if self.daemon.available():
+                reply = self.daemon.request("turn", audio=audio_path, session=DAEMON_SESSION)
+                if reply.get("audio_path"):
+                    self._play_audio(reply["audio_path"], turn)
+                    playing = True
+            else:
+                if self.pipeline is None:
+                    self.pipeline = HerminePipeline()
+                result = self.pipeline.run_turn(
+                    self.conversation,
+                    audio_path=audio_path,
+                    turn=turn
+                )
+                if result.reply:
+                    # Playback starts with the first PCM chunk from the API.
+                    self.player.play(
+                        self.pipeline.speak_stream(result.reply),
+                        on_start=self._playback_started(turn)
+                    )
+                    playing = True
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Error during turn: {e}")
+        finally:
+            # Spoken turns end when playback starts, the others end here.
+            if turn is not None and not playing:
+                turn.finish()
 
-    def _play_audio(self, file_path: str) -> None:
+    def _play_audio(self, file_path: str, turn=None) -> None:
         """Play the generated audio"""
-        player = vlc.MediaPlayer(file_path)
-        player.play()
+        self.player.play_file(file_path, on_start=self._playback_started(turn))
+
+    @staticmethod
+    def _playback_started(turn) -> callable:
+        """Build the callback closing a turn when its reply becomes audible"""
+        def on_start() -> None:
+            if turn is not None:
+                with use_turn(turn):
+                    mark("playback.start")
+                turn.finish()
+        return on_start
 
 
 class HermineApp(Gtk.Application):
@@ -521,6 +482,15 @@ class HermineApp(Gtk.Application):
     def __init__(self) -> None:
         super().__init__(application_id="com.melvinredondotanis.hermine",
                          flags=Gio.ApplicationFlags.FLAGS_NONE)
+        if os.environ.get("HERMINE_METRICS_PORT"):
+            TRACER.serve_metrics(int(os.environ["HERMINE_METRICS_PORT"]))
+        # kill -USR1 <pid> captures a profile without touching the window.
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, self._on_profile_signal)
+
+    def _on_profile_signal(self) -> bool:
+        """Capture a profile on SIGUSR1"""
+        PROFILING.capture_async(PROFILE_SECONDS)
+        return True
 
     def do_activate(self) -> None: # pylint: disable=arguments-differ
         """Create and show the main window when the application is activated"""
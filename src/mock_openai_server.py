@@ -0,0 +1,354 @@
+"""
+Offline mock of the OpenAI endpoints used by Hermine.
+
+Speaks chat/completions (including streaming), audio/transcriptions and
+audio/speech with configurable latency and throughput so the pipeline can be
+benchmarked without live API calls. A request rate limit can be enforced,
+with the same x-ratelimit-* headers and 429 responses as the real API.
+"""
+import argparse
+import json
+import math
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+
+
+@dataclass
+class MockServerConfig:  # pylint: disable=too-many-instance-attributes
+    """Latency and throughput settings of the mock server."""
+    transcription_latency: float = 0.35
+    first_token_latency: float = 0.45
+    tokens_per_second: float = 80.0
+    speech_first_byte_latency: float = 0.3
+    speech_bytes_per_second: float = 192000.0
+    speech_chunk_size: int = 4800
+    transcript: str = "Quelle est la version de mon noyau ?"
+    reply: str = ("Vous pouvez afficher la version du noyau avec la commande "
+                  "uname -r dans un terminal.")
+    sample_rate: int = 24000
+    requests_per_minute: Optional[int] = None
+
+
+def _words(text: str) -> Iterator[str]:
+    """Split text into token-like pieces that keep their spacing."""
+    for index, word in enumerate(text.split(" ")):
+        yield word if index == 0 else f" {word}"
+
+
+def _tone(seconds: float, rate: int, frequency: float = 220.0) -> bytes:
+    """Render a 16-bit mono sine tone used as fake speech."""
+    count = int(seconds * rate)
+    return b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * frequency * i / rate)))
+        for i in range(count)
+    )
+
+
+def _wav_header(data_size: int, rate: int) -> bytes:
+    """Build a WAV header for 16-bit mono PCM."""
+    return (b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVEfmt " +
+            struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16) +
+            b"data" + struct.pack("<I", data_size))
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """Request handler for the mocked endpoints."""
+
+    protocol_version = "HTTP/1.1"
+    server: "_MockHTTPServer"
+    rate_headers: Dict[str, str] = {}
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep benchmark output clean."""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Dispatch POST requests to the mocked endpoints."""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = self.path.split("?", 1)[0].rstrip("/")
+
+        try:
+            admitted, self.rate_headers = self.server.admit()
+            if not admitted:
+                self._send_json({"error": {"message": "Rate limit reached for requests",
+                                           "type": "requests", "code": "rate_limit_exceeded"}},
+                                429)
+            elif path.endswith("/chat/completions"):
+                self._chat(json.loads(body or b"{}"))
+            elif path.endswith("/audio/transcriptions"):
+                self._transcription(body)
+            elif path.endswith("/audio/speech"):
+                self._speech(json.loads(body or b"{}"))
+            else:
+                self._send_json({"error": {"message": f"Unknown endpoint {path}"}}, 404)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the request.
+            self.close_connection = True  # pylint: disable=attribute-defined-outside-init
+
+    def end_headers(self) -> None:
+        """Add the rate limit headers to every response."""
+        for name, value in self.rate_headers.items():
+            self.send_header(name, value)
+        super().end_headers()
+
+    def _send_json(self, payload: dict, status: int = 200) -> None:
+        """Send a complete JSON response."""
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type: str) -> None:
+        """Start a chunked streaming response."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes) -> None:
+        """Write one HTTP chunk and flush it to the client."""
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _chat(self, request: dict) -> None:
+        """Serve chat/completions, streamed or not."""
+        config = self.server.config
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get("model", "gpt-4o-mini")
+        tokens = list(_words(config.reply))
+
+        time.sleep(config.first_token_latency)
+
+        if not request.get("stream"):
+            time.sleep(len(tokens) / config.tokens_per_second)
+            self._send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": config.reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": len(tokens)
+                }
+            })
+            return
+
+        self._start_chunked("text/event-stream")
+        for index, token in enumerate(tokens):
+            delta = {"content": token}
+            if index == 0:
+                delta["role"] = "assistant"
+            self._write_event({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+            })
+            time.sleep(1.0 / config.tokens_per_second)
+        self._write_event({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, payload: dict) -> None:
+        """Write one server-sent event."""
+        self._write_chunk(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+
+    def _transcription(self, body: bytes) -> None:
+        """Serve audio/transcriptions in text or JSON format."""
+        config = self.server.config
+        time.sleep(config.transcription_latency)
+
+        if b'name="response_format"\r\n\r\ntext' in body:
+            data = config.transcript.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json({"text": config.transcript})
+
+    def _speech(self, request: dict) -> None:
+        """Serve audio/speech as a paced stream."""
+        config = self.server.config
+        response_format = request.get("response_format", "mp3")
+        # Roughly the speaking rate of the OpenAI voices.
+        seconds = max(0.5, len(request.get("input", "")) / 15.0)
+        audio = self.server.speech_audio(seconds)
+        if response_format == "wav":
+            audio = _wav_header(len(audio), config.sample_rate) + audio
+
+        time.sleep(config.speech_first_byte_latency)
+
+        content_type = "audio/pcm" if response_format == "pcm" else f"audio/{response_format}"
+        self._start_chunked(content_type)
+        step = config.speech_chunk_size
+        for offset in range(0, len(audio), step):
+            self._write_chunk(audio[offset:offset + step])
+            time.sleep(step / config.speech_bytes_per_second)
+        self._write_chunk(b"")
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    """HTTP server carrying the mock configuration."""
+
+    daemon_threads = True
+    # Many concurrent clients connect at once, the default backlog of 5 would
+    # delay some of them by a SYN retransmission.
+    request_queue_size = 128
+
+    def __init__(self, address, config: MockServerConfig) -> None:
+        super().__init__(address, _MockHandler)
+        self.config = config
+        self._tone_cache = {}
+        self._admitted = deque()
+        self._rate_lock = threading.Lock()
+
+    def admit(self):
+        """Count a request against the rate limit, returning whether it may
+        proceed and the rate limit headers to send."""
+        limit = self.config.requests_per_minute
+        if not limit:
+            return True, {}
+        with self._rate_lock:
+            now = time.monotonic()
+            while self._admitted and now - self._admitted[0] >= 60.0:
+                self._admitted.popleft()
+            admitted = len(self._admitted) < limit
+            if admitted:
+                self._admitted.append(now)
+            reset = 60.0 - (now - self._admitted[0]) if self._admitted else 0.0
+            headers = {
+                "x-ratelimit-limit-requests": str(limit),
+                "x-ratelimit-remaining-requests": str(limit - len(self._admitted)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }
+            if not admitted:
+                headers["retry-after-ms"] = str(int(reset * 1000) + 1)
+            return admitted, headers
+
+    def speech_audio(self, seconds: float) -> bytes:
+        """Return fake speech audio, rendered once per duration."""
+        key = round(seconds, 1)
+        if key not in self._tone_cache:
+            self._tone_cache[key] = _tone(key, self.config.sample_rate)
+        return self._tone_cache[key]
+
+
+class MockOpenAIServer:
+    """A local server speaking the subset of the OpenAI API Hermine uses."""
+
+    def __init__(
+        self,
+        config: Optional[MockServerConfig] = None,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ) -> None:
+        """
+        Initialize the mock server.
+
+        Args:
+            config: Latency and throughput settings
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+        """
+        self.config = config or MockServerConfig()
+        self._httpd = _MockHTTPServer((host, port), self.config)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL to give to the OpenAI client."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve requests in the calling thread until interrupted."""
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        """Stop serving and release the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the latency settings of MockServerConfig to a command line parser."""
+    parser.add_argument("--first-token-latency", type=float,
+                        default=MockServerConfig.first_token_latency)
+    parser.add_argument("--tokens-per-second", type=float,
+                        default=MockServerConfig.tokens_per_second)
+    parser.add_argument("--transcription-latency", type=float,
+                        default=MockServerConfig.transcription_latency)
+    parser.add_argument("--speech-first-byte-latency", type=float,
+                        default=MockServerConfig.speech_first_byte_latency)
+
+
+def config_from_args(args: argparse.Namespace) -> MockServerConfig:
+    """Build a MockServerConfig from arguments added by add_latency_arguments."""
+    return MockServerConfig(
+        transcription_latency=args.transcription_latency,
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        speech_first_byte_latency=args.speech_first_byte_latency
+    )
+
+
+def main() -> None:
+    """Run the mock server in the foreground."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_latency_arguments(parser)
+    parser.add_argument("--requests-per-minute", type=int,
+                        help="Answer 429 beyond this many requests per minute")
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    config.requests_per_minute = args.requests_per_minute
+    server = MockOpenAIServer(config, args.host, args.port)
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""
+The Hermine turn pipeline: speech-to-text, text generation with tools and
+text-to-speech, independent of any user interface.
+"""
+import json
+import os
+import sqlite3
+import threading
+import wave
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+from backends import BackendConfig, create_backend
+from tts import PCM_RATE
+from portal_dbus import DesktopPortal
+from image_pipeline import ImagePipeline, attach_images
+from intents import CONFIRMATIONS, FAILURES, ConfirmationCache, IntentMatch, IntentMatcher
+from journal import SessionJournal
+from tools import search_file_and_get_urls, create_files
+from tracing import TRACER, Turn, span, use_turn
+
+PROMPT = """
+            Vous êtes un assistant vocal pour le système Linux.
+            \\ Votre nom est Hermine. Vous avez une connaissance approfondie
+            \\ du système d'exploitation de l'utilisateur et pouvez fournir des
+            \\ explications précises et efficaces.
+        """
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "take_screenshot",
+            "description": "Take a screenshot of the current screen"
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "lock_session",
+            "description": "Lock the current session"
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_file_and_get_urls",
+            "description": "Search for files matching the pattern in the user's home directory",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filename_pattern": {
+                        "type": "string",
+                        "description": "Search pattern for filenames"
+                    }
+                },
+                "required": ["filename_pattern"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_files",
+            "description": "Create files with the given content",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {
+                                    "type": "string",
+                                    "description": "Name of the file"
+                                },
+                                "content": {
+                                    "type": "string",
+                                    "description": "Content of the file"
+                                }
+                            },
+                            "required": ["name", "content"]
+                        }
+                    },
+                    "path": {
+                        "type": "string",
+                        "description": "Directory path where files should be created"
+                    }
+                },
+                "required": ["files"]
+            }
+        }
+    }
+]
+
+
+# Messages kept after the system prompt; older turns are dropped so a session
+# running for days neither grows in memory nor outgrows the context window.
+# 0 keeps the whole history.
+HISTORY_LIMIT = int(os.environ.get("HERMINE_HISTORY_LIMIT", "60"))
+
+
+@dataclass
+class Conversation:
+    """Chat history of one client, with screenshots waiting to be sent."""
+    messages: List[dict] = field(
+        default_factory=lambda: [{"role": "system", "content": PROMPT}]
+    )
+    pending_images: list = field(default_factory=list)
+    lock: threading.RLock = field(default_factory=threading.RLock, repr=False)
+    max_messages: int = HISTORY_LIMIT
+    journal: Optional[SessionJournal] = field(default=None, repr=False)
+    session: str = "default"
+
+    @classmethod
+    def resume(cls, journal: Optional[SessionJournal], session: str) -> "Conversation":
+        """
+        Continue a session from the tail of the journal.
+
+        Args:
+            journal: Journal to read and append to, None keeps the history in memory only
+            session: Name of the conversation in the journal
+        """
+        conversation = cls(journal=journal, session=session)
+        if journal is not None:
+            try:
+                history = journal.tail(session, "message", conversation.max_messages or -1)
+            except sqlite3.Error as e:
+                print(f"Error resuming session {session} from the journal: {e}")
+                history = []
+            # Start at a question, not at the reply or tool result of a dropped one.
+            while history and history[0].get("role") != "user":
+                history.pop(0)
+            conversation.messages.extend(history)
+        return conversation
+
+    def add(self, message: dict) -> None:
+        """Append a message to the history and to the journal."""
+        with self.lock:
+            self.messages.append(message)
+            if self.journal is not None:
+                self.journal.append(self.session, "message", message)
+
+    def add_audio(self, role: str, path: Union[str, Path]) -> None:
+        """Reference a copy of the recording or spoken reply of the current turn in the journal."""
+        if self.journal is not None:
+            # Without a copy the file is overwritten by the next turn.
+            kept = self.journal.keep_audio(path)
+            if kept is not None:
+                self.journal.append(self.session, "audio", {"role": role, "path": kept})
+
+    def reset(self, purge: bool = False) -> None:
+        """
+        Forget everything but the system prompt.
+
+        Args:
+            purge: Also delete the session and its audio from the journal,
+                instead of only marking where it restarts
+        """
+        with self.lock:
+            del self.messages[1:]
+            self.pending_images.clear()
+            if self.journal is None:
+                return
+            if purge:
+                self.journal.purge(self.session)
+            else:
+                self.journal.append(self.session, "reset", {})
+
+    def trim(self) -> None:
+        """Drop the oldest turns beyond max_messages, keeping the system prompt."""
+        with self.lock:
+            excess = len(self.messages) - 1 - self.max_messages
+            if not self.max_messages or excess <= 0:
+                return
+            # Cut at a user message so no reply or tool result loses its question.
+            start = 1 + excess
+            while start < len(self.messages) and self.messages[start].get("role") != "user":
+                start += 1
+            del self.messages[1:start]
+
+
+@dataclass
+class TurnResult:
+    """Outcome of a complete turn."""
+    turn_id: str
+    transcript: str = ""
+    reply: str = ""
+    audio_path: Optional[str] = None
+
+
+class HerminePipeline:  # pylint: disable=too-many-instance-attributes
+    """Runs turns with long-lived engines shared by every conversation."""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: str = "gpt-4o-mini",
+        intents: Optional[IntentMatcher] = None,
+        backends: Optional[BackendConfig] = None
+    ) -> None:
+        """
+        Initialize the pipeline and its clients.
+
+        Args:
+            api_key: OpenAI API key. Defaults to environment variable.
+            base_url: Alternative API endpoint, e.g. a local mock server.
+            model: The chat model to use.
+            intents: Matcher for commands handled without the model,
+                defaults to the built-in grammar. Set HERMINE_FAST_PATH=0
+                to send everything to the model.
+            backends: Engines to use for each stage, read from the
+                configuration file and environment if omitted.
+        """
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        backends = backends or BackendConfig.from_environment()
+        shared = {"api_key": api_key, "base_url": base_url}
+        self.stt = create_backend("stt", backends, **shared)
+        self.llm = create_backend("llm", backends, model=model, **shared)
+        self.tts = create_backend("tts", backends, **shared)
+        self.portal = DesktopPortal()
+        self.images = ImagePipeline()
+        if os.environ.get("HERMINE_FAST_PATH", "1") == "0":
+            self.intents = None
+        else:
+            self.intents = intents or IntentMatcher(TOOLS)
+        # Tones from the fake engine must never be replayed by a real voice.
+        self.confirmations = ConfirmationCache(voice=_voice_identity(backends.tts, self.tts),
+                                               persist=backends.tts != "fake")
+
+    def transcribe(self, audio_path: Union[str, Path]) -> str:
+        """Transcribe a recording."""
+        return self.stt.transcribe(audio_path)
+
+    def respond(self, conversation: Conversation, text: str) -> str:
+        """
+        Add a user message to the conversation and generate the reply.
+
+        Args:
+            conversation: Conversation to continue
+            text: What the user said
+
+        Returns:
+            The assistant's reply, empty if it only used tools
+        """
+        intent = self.intents.match(text) if self.intents else None
+        if intent is not None:
+            return self.respond_locally(conversation, text, intent)
+
+        with conversation.lock:
+            conversation.add({"role": "user", "content": text})
+            pending, conversation.pending_images = conversation.pending_images, []
+
+            reply = self.llm.complete(
+                attach_images(conversation.messages, _collect_images(pending)),
+                tools=TOOLS
+            )
+
+            for tool_call in reply.tool_calls:
+                with span(f"tool.{tool_call.function.name}"):
+                    self.run_tool(conversation, tool_call)
+
+            response_text = reply.content
+            if response_text:
+                conversation.add({"role": "assistant", "content": response_text})
+            conversation.trim()
+            return response_text
+
+    def respond_locally(self, conversation: Conversation, text: str, intent: IntentMatch) -> str:
+        """
+        Handle a recognized command without calling the model.
+
+        The exchange is still recorded so later turns see it in the history.
+
+        Returns:
+            The spoken confirmation of the command, or why it failed
+        """
+        with conversation.lock:
+            conversation.add({"role": "user", "content": text})
+            with span("intent.fast_path", tool=intent.name,
+                      confidence=intent.confidence) as stats:
+                with span(f"tool.{intent.name}"):
+                    succeeded = self.run_tool(conversation, intent.as_tool_call())
+                stats["succeeded"] = succeeded
+            reply = intent.confirmation if succeeded \
+                else FAILURES.get(intent.name, "Je n'ai pas pu le faire.")
+            conversation.add({"role": "assistant", "content": reply})
+            conversation.trim()
+            return reply
+
+    def run_tool(self, conversation: Conversation, tool_call) -> bool:  # pylint: disable=too-many-branches
+        """
+        Execute a tool requested by the model and record its result
+
+        Returns:
+            Whether the tool did what was asked, e.g. False when no file matched
+        """
+        succeeded = False
+        if tool_call.function.name == "take_screenshot":
+            screenshot = self.portal.take_screenshot()
+            if isinstance(screenshot, Exception):
+                result_message = f"Screenshot failed: {screenshot}"
+            else:
+                succeeded = True
+                conversation.pending_images.append(self.images.prepare(screenshot))
+                result_message = (f"Screenshot saved to {screenshot}, "
+                                  "it will be attached to the next request")
+            conversation.add({
+                "role": "function",
+                "name": "take_screenshot",
+                "content": result_message
+            })
+        elif tool_call.function.name == "lock_session":
+            locked = self.portal.lock_session()
+            succeeded = locked is True
+            if not succeeded:
+                print(f"Error locking the session: {locked}")
+        elif tool_call.function.name == "search_file_and_get_urls":
+            args = json.loads(tool_call.function.arguments)
+            filename_pattern = args.get("filename_pattern")
+            print(f"Searching for files matching '{filename_pattern}'")
+            if filename_pattern:
+                results = search_file_and_get_urls(filename_pattern)
+                succeeded = bool(results)
+                if results:
+                    result_message = (f"Found files matching '{filename_pattern}':\n" +
+                                      "\n".join(results))
+                else:
+                    result_message = f"No files found matching '{filename_pattern}'"
+                conversation.add({
+                    "role": "function",
+                    "name": "search_file_and_get_urls",
+                    "content": result_message
+                })
+        elif tool_call.function.name == "create_files":
+            args = json.loads(tool_call.function.arguments)
+            files = args.get("files")
+            if files:
+                results = create_files(files)
+                succeeded = bool(results)
+                if results:
+                    result_message = ("Files created successfully:\n" +
+                                      "\n".join(results))
+                else:
+                    result_message = "Failed to create files"
+                conversation.add({
+                    "role": "function",
+                    "name": "create_files",
+                    "content": result_message
+                })
+        return succeeded
+
+    def speak_stream(self, text: str) -> Iterator[bytes]:
+        """Synthesize a reply as raw 16-bit mono PCM at PCM_RATE."""
+        if text in CONFIRMATIONS.values() or text in FAILURES.values():
+            return self.confirmations.stream(text, self._synthesize_pcm)
+        return self._synthesize_pcm(text)
+
+    def _synthesize_pcm(self, text: str) -> Iterator[bytes]:
+        """Request PCM speech from the TTS engine."""
+        return self.tts.stream(text)
+
+    def speak(self, text: str, output_path: Union[str, Path]) -> Path:
+        """Synthesize a reply to a WAV file."""
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # pylint: disable=no-member
+        with wave.open(str(output_path), "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(PCM_RATE)
+            for chunk in self.speak_stream(text):
+                wf.writeframes(chunk)
+        # pylint: enable=no-member
+        return output_path
+
+    def run_turn(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        conversation: Conversation,
+        audio_path: Optional[Union[str, Path]] = None,
+        text: Optional[str] = None,
+        output_path: Optional[Union[str, Path]] = None,
+        turn: Optional[Turn] = None
+    ) -> TurnResult:
+        """
+        Run a whole turn from a recording or from text.
+
+        Args:
+            conversation: Conversation to continue
+            audio_path: Recording to transcribe, ignored if text is given
+            text: Text to answer directly
+            output_path: Where to write the spoken reply as WAV, None skips speech
+            turn: Trace of the turn, kept open for the caller to finish; if
+                omitted, a new one is started and finished here
+
+        Returns:
+            TurnResult describing the turn
+        """
+        owned = turn is None
+        turn = turn or TRACER.start_turn()
+        result = TurnResult(turn_id=turn.turn_id)
+        try:
+            with use_turn(turn):
+                if text is None:
+                    if audio_path is None:
+                        raise ValueError("A turn needs either audio or text")
+                    text = self.transcribe(audio_path)
+                    conversation.add_audio("user", audio_path)
+                result.transcript = text
+                result.reply = self.respond(conversation, text)
+                if result.reply and output_path is not None:
+                    result.audio_path = str(self.speak(result.reply, output_path))
+                    conversation.add_audio("assistant", result.audio_path)
+        finally:
+            # A turn started here has no later stage, such as playback, to end it.
+            if owned:
+                turn.finish()
+        return result
+
+
+def _voice_identity(backend: str, engine) -> str:
+    """Name the engine, model, voice and sample rate a TTS engine speaks with."""
+    settings = {"backend": backend, "rate": PCM_RATE}
+    source = getattr(engine, "converter", engine)
+    for attribute in ("model", "voice", "speaker"):
+        if hasattr(source, attribute):
+            settings[attribute] = getattr(source, attribute)
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+def _collect_images(pending: list) -> list:
+    """Wait for screenshots queued by the previous turn"""
+    images = []
+    for future in pending:
+        try:
+            images.append(future.result())
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Error preparing image: {e}")
+    return images
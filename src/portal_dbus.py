@@ -1,29 +1,188 @@
 """
 This script demonstrates how to interact with the Desktop portal using D-Bus
 in Python.
+
+Proxies are bound lazily on first use, method calls run off the calling
+thread and portal requests are resolved through their
+``org.freedesktop.portal.Request::Response`` signal.
 """
+import itertools
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
 import pydbus
 from gi.repository import GLib
 
+PORTAL_BUS_NAME = "org.freedesktop.portal.Desktop"
+PORTAL_PATH = "/org/freedesktop/portal/desktop"
+SCREENSHOT_IFACE = "org.freedesktop.portal.Screenshot"
+REQUEST_IFACE = "org.freedesktop.portal.Request"
+SCREENSAVER_BUS_NAME = "org.gnome.ScreenSaver"
+SCREENSAVER_PATH = "/org/gnome/ScreenSaver"
+
+DEFAULT_TIMEOUT = 30.0
+# A service missing from the bus is looked up again after this many seconds,
+# as portals are often activated after Hermine starts.
+UNAVAILABLE_RETRY = 10.0
+
+
+class PortalError(RuntimeError):
+    """Raised when a portal interface is unavailable or a request fails."""
+
 
 class DesktopPortal:
     """
     Class for interacting with the Desktop portal
     """
 
-    def __init__(self):
-        self.bus = pydbus.SessionBus()
-        self.desktop_path = "/org/freedesktop/portal/desktop"
-        self.desktop_iface = "org.freedesktop.portal.Desktop"
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT) -> None:
+        """
+        Initialize the portal client without touching the bus.
+
+        Args:
+            timeout: Default number of seconds to wait for a portal response
+        """
+        self.timeout = timeout
+        self._bus = None
+        self._proxies: Dict[Tuple[str, str], Any] = {}
+        self._unavailable_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._tokens = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="portal")
+
+    @property
+    def bus(self) -> "pydbus.bus.Bus":
+        """Session bus connection, opened on first access."""
+        with self._lock:
+            if self._bus is None:
+                self._bus = pydbus.SessionBus()
+            return self._bus
+
+    def is_available(self, bus_name: str, path: str) -> bool:
+        """
+        Check whether a D-Bus object can be bound.
+
+        A failed lookup is remembered for UNAVAILABLE_RETRY seconds.
+
+        Args:
+            bus_name: Well-known bus name of the service
+            path: Object path on that service
+
+        Returns:
+            True if the object could be resolved
+        """
+        try:
+            self._proxy(bus_name, path)
+            return True
+        except PortalError:
+            return False
+
+    def _proxy(self, bus_name: str, path: str) -> Any:
+        """Return a cached proxy, binding it on first use."""
+        key = (bus_name, path)
+        if time.monotonic() < self._unavailable_until.get(bus_name, 0.0):
+            raise PortalError(f"{bus_name} is not available on the session bus")
+        proxy = self._proxies.get(key)
+        if proxy is not None:
+            return proxy
+
+        try:
+            proxy = self.bus.get(bus_name, path)
+        except GLib.Error as e:
+            self._unavailable_until[bus_name] = time.monotonic() + UNAVAILABLE_RETRY
+            raise PortalError(f"{bus_name} is not available on the session bus") from e
+
+        self._unavailable_until.pop(bus_name, None)
+        self._proxies[key] = proxy
+        return proxy
+
+    def _call_async(self, func: Callable, *args) -> Future:
+        """Run a blocking proxy call on the portal worker threads."""
+        return self._executor.submit(func, *args)
+
+    def _request_path(self, token: str) -> str:
+        """Compute the Request object path the portal will use for a token."""
+        sender = self.bus.con.get_unique_name().lstrip(":").replace(".", "_")
+        return f"{PORTAL_PATH}/request/{sender}/{token}"
+
+    def _watch_response(self, future: Future, request_path: str, timeout: float) -> None:
+        """Settle a future from a Request object's Response signal or a timeout."""
+        def on_response(_sender, _object, _iface, _signal, params):
+            response, results = params
+            if response == 0 and "uri" in results:
+                _resolve(future, value=_uri_to_path(results["uri"]))
+            else:
+                _resolve(future, error=PortalError(
+                    f"Portal request ended with response {response}"
+                ))
 
-        # Get the desktop portal object
-        self.desktop = self.bus.get(self.desktop_iface, self.desktop_path)
+        subscription = self.bus.subscribe(
+            iface=REQUEST_IFACE,
+            signal="Response",
+            object=request_path,
+            signal_fired=on_response
+        )
+        timer = threading.Timer(
+            timeout,
+            _resolve,
+            args=(future,),
+            kwargs={"error": TimeoutError("Portal did not respond in time")}
+        )
+        timer.daemon = True
+        timer.start()
 
-        # Get the interfaces
-        self.screenshot = self.desktop["org.freedesktop.portal.Screenshot"]
+        def cleanup(_):
+            timer.cancel()
+            subscription.unsubscribe()
 
-        # Get the screensaver interface
-        self.screensaver = self.bus.get("org.gnome.ScreenSaver", "/org/gnome/ScreenSaver")
+        future.add_done_callback(cleanup)
+
+    def take_screenshot_async(
+            self,
+            interactive=False,
+            capture_cursor=False,
+            parent_window="",
+            timeout: Optional[float] = None
+            ) -> Future:
+        """
+        Take a screenshot without blocking the caller.
+
+        The Response signal is subscribed to before the call is made so a
+        fast portal cannot answer before we listen.
+
+        Returns:
+            Future resolving to the local path of the captured image
+        """
+        future: Future = Future()
+        try:
+            desktop = self._proxy(PORTAL_BUS_NAME, PORTAL_PATH)
+            token = f"hermine{next(self._tokens)}"
+            request_path = self._request_path(token)
+        except PortalError as e:
+            future.set_exception(e)
+            return future
+
+        self._watch_response(future, request_path, timeout or self.timeout)
+
+        options = {
+            "handle_token": GLib.Variant('s', token),
+            "interactive": GLib.Variant('b', interactive),
+            "cursor": GLib.Variant('b', capture_cursor)
+            }
+        call = self._call_async(
+            desktop[SCREENSHOT_IFACE].Screenshot, parent_window, options
+        )
+
+        def on_called(call_future):
+            error = call_future.exception()
+            if error is not None:
+                _resolve(future, error=PortalError(f"Screenshot call failed: {error}"))
+
+        call.add_done_callback(on_called)
+        return future
 
     def take_screenshot(
             self,
@@ -31,25 +190,60 @@ class DesktopPortal:
             capture_cursor=False,
             parent_window=""
             ):
-        """Take a screenshot"""
+        """Take a screenshot and return the image path, or the error"""
         try:
-            options = {
-                "interactive": GLib.Variant('b', interactive),
-                "cursor": GLib.Variant('b', capture_cursor)
-                }
-            return self.screenshot.Screenshot(parent_window, options)
-        except GLib.Error as e:
+            return self.take_screenshot_async(
+                interactive, capture_cursor, parent_window
+            ).result()
+        except (PortalError, TimeoutError) as e:
             return e
 
+    def lock_session_async(self) -> Future:
+        """
+        Lock the screen without blocking the caller.
+
+        Returns:
+            Future resolving to True once the screensaver accepted the call
+        """
+        def lock():
+            try:
+                self._proxy(SCREENSAVER_BUS_NAME, SCREENSAVER_PATH).Lock()
+            except GLib.Error as e:
+                raise PortalError(f"Lock failed: {e}") from e
+            return True
+
+        return self._call_async(lock)
+
     def lock_session(self):
         """Lock the screen using GNOME Screensaver"""
         try:
-            self.screensaver.Lock()
-            return True
-        except GLib.Error as e:
+            return self.lock_session_async().result(self.timeout)
+        except (PortalError, TimeoutError) as e:
             return e
 
 
+def _resolve(future: Future, value: Any = None, error: Optional[BaseException] = None) -> None:
+    """Settle a future once, ignoring late signals and timers."""
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+    except InvalidStateError:
+        # Another thread settled it between the check and the set.
+        pass
+
+
+def _uri_to_path(uri: str) -> str:
+    """Convert a file:// URI returned by the portal to a local path."""
+    parsed = urlparse(uri)
+    if parsed.scheme == "file":
+        return unquote(parsed.path)
+    return uri
+
+
 if __name__ == "__main__":
     portal = DesktopPortal()
 
@@ -0,0 +1,274 @@
+"""
+On-demand profiling of a running Hermine.
+
+A capture samples the Python stacks of every thread (GTK main loop,
+recording, playback, workers) for a few seconds. Each sample is weighted
+by the CPU time the thread used since the previous one, so blocked threads
+cost nothing. Allocations are traced with tracemalloc over the same window.
+A capture writes, in its own directory:
+
+    cpu.pstats         python3 -m pstats cpu.pstats, snakeviz, ...
+    cpu.collapsed      flamegraph.pl, speedscope, inferno (microseconds of CPU)
+    memory.tracemalloc tracemalloc.Snapshot.load()
+    memory-diff.txt    largest allocation growths during the capture
+
+Captures are started from the menu, with SIGUSR1 or with the daemon's
+"profile" command. Allocations are only traced during captures; start
+Hermine with PYTHONTRACEMALLOC=16 to trace them all along and also diff
+against the previous capture.
+"""
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+REPORT_DIR = Path(os.environ.get("HERMINE_PROFILE_DIR",
+                                  str(Path.home() / ".cache" / "hermine" / "profiles")))
+
+# Longest capture; the profiler thread and tracemalloc slow the process down.
+MAX_CAPTURE_SECONDS = 300.0
+MIN_CAPTURE_SECONDS = 1.0
+
+FrameKey = Tuple[str, int, str]
+
+
+def _thread_clock(ident: int) -> Optional[int]:
+    """CPU clock of a thread, None where the platform has none."""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        """
+        Initialize the profiler.
+
+        Args:
+            interval: Seconds between samples
+        """
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._cpu: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start sampling."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="hermine-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampler to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        """Sampling loop."""
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident == own:
+                    continue
+                weight = self._cpu_since_last(ident)
+                if weight <= 0:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += weight
+            self.samples += 1
+
+    def _cpu_since_last(self, ident: int) -> float:
+        """CPU seconds a thread used since the previous sample."""
+        clock = _thread_clock(ident)
+        if clock is None:
+            # No per-thread clock: fall back to wall-clock sampling.
+            return self.interval
+        try:
+            now = time.clock_gettime(clock)
+        except OSError:
+            return 0.0
+        previous = self._cpu.get(ident)
+        self._cpu[ident] = now
+        return 0.0 if previous is None else now - previous
+
+    def write_collapsed(self, path: Path) -> None:
+        """Write the stacks in the collapsed format of flamegraph.pl."""
+        lines = []
+        for (thread, stack), seconds in self.stacks.most_common():
+            frames = ";".join(f"{name} ({os.path.basename(filename)}:{line})"
+                              for filename, line, name in stack)
+            lines.append(f"{thread};{frames} {max(1, round(seconds * 1e6))}")
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def write_pstats(self, path: Path) -> None:
+        """Write the samples as a pstats file, with sampled times as costs."""
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        hits: Counter = Counter()
+        callers: Dict[FrameKey, Counter] = defaultdict(Counter)
+        for (_thread, stack), seconds in self.stacks.items():
+            if not stack:
+                continue
+            own[stack[-1]] += seconds
+            for key in set(stack):
+                cumulative[key] += seconds
+                hits[key] += 1
+            for caller, callee in zip(stack, stack[1:]):
+                callers[callee][caller] += seconds
+
+        stats = {
+            key: (hits[key], hits[key], own[key], cumulative[key],
+                  {caller: (1, 1, seconds, seconds) for caller, seconds in callers[key].items()})
+            for key in cumulative
+        }
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+
+class Profiling:
+    """Runs one capture at a time and writes its report."""
+
+    def __init__(self, report_dir: Path = REPORT_DIR, trace_frames: int = 16) -> None:
+        """
+        Initialize the facility.
+
+        Args:
+            report_dir: Directory receiving one subdirectory per capture
+            trace_frames: Stack depth recorded for each allocation
+        """
+        self.report_dir = report_dir
+        self.trace_frames = trace_frames
+        self._busy = threading.Lock()
+        self._last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def running(self) -> bool:
+        """Whether a capture is in progress."""
+        return self._busy.locked()
+
+    def capture(self, seconds: float = 10.0) -> Optional[Path]:
+        """
+        Profile CPU and allocations for a while.
+
+        Args:
+            seconds: Length of the capture, clamped to 1-300 seconds
+
+        Returns:
+            Directory of the report, None if a capture was already running
+        """
+        seconds = min(max(seconds, MIN_CAPTURE_SECONDS), MAX_CAPTURE_SECONDS)
+        if not self._busy.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return None
+        try:
+            return self._capture(seconds)
+        finally:
+            self._busy.release()
+
+    def capture_async(
+        self,
+        seconds: float = 10.0,
+        on_done: Optional[Callable[[Optional[Path]], None]] = None
+    ) -> bool:
+        """
+        Run a capture in the background.
+
+        Args:
+            seconds: Length of the capture
+            on_done: Called with the report directory from the capture thread
+
+        Returns:
+            False if a capture was already running
+        """
+        if self.running:
+            return False
+
+        def run() -> None:
+            report = self.capture(seconds)
+            if report is not None:
+                print(f"Profile written to {report}")
+            if on_done is not None:
+                on_done(report)
+
+        threading.Thread(target=run, name="hermine-profile", daemon=True).start()
+        return True
+
+    def _capture(self, seconds: float) -> Path:
+        """Capture and write a report."""
+        report = self.report_dir / datetime.now().strftime("profile-%Y%m%d-%H%M%S")
+        report.mkdir(parents=True, exist_ok=True)
+
+        # Only trace allocations during captures, unless already enabled.
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.trace_frames)
+        before = tracemalloc.take_snapshot()
+        profiler = SamplingProfiler()
+        profiler.start()
+        time.sleep(seconds)
+        profiler.stop()
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        profiler.write_pstats(report / "cpu.pstats")
+        profiler.write_collapsed(report / "cpu.collapsed")
+        after.dump(str(report / "memory.tracemalloc"))
+        self._write_memory_diff(
+            report / "memory-diff.txt", before, after,
+            f"Traced memory after {seconds:.0f} s: {current / 1e6:.1f} MB "
+            f"(peak {peak / 1e6:.1f} MB)"
+        )
+        self._last_snapshot = None if started_tracing else after
+        return report
+
+    def _write_memory_diff(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        path: Path,
+        before: tracemalloc.Snapshot,
+        after: tracemalloc.Snapshot,
+        header: str,
+        limit: int = 40
+    ) -> None:
+        """Write the largest allocation growths as text."""
+        # The profiler's own samples and snapshots would dominate the diff.
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__, all_frames=True),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        sections = [("During the capture", before)]
+        if self._last_snapshot is not None:
+            sections.append(("Since the previous capture", self._last_snapshot))
+
+        lines = [header]
+        for title, reference in sections:
+            lines += ["", f"{title}, largest growths by line:"]
+            diff = after.filter_traces(ignore).compare_to(reference.filter_traces(ignore), "lineno")
+            lines += [str(stat) for stat in diff[:limit]]
+            lines += ["", f"{title}, largest growth by stack:"]
+            stacks = after.filter_traces(ignore).compare_to(
+                reference.filter_traces(ignore), "traceback")
+            if stacks:
+                lines.append(str(stacks[0]))
+                lines += stacks[0].traceback.format()
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+PROFILING = Profiling()
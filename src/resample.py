@@ -0,0 +1,169 @@
+"""
+Sample rate and channel conversion of captured audio.
+
+Microphones are opened at their native format and converted here to the
+16 kHz mono expected by speech recognition, instead of relying on the slow
+generic conversion of PortAudio/ALSA, or on the device accepting 16 kHz at
+all. Channels are averaged, then a polyphase FIR filter resamples by the
+rational ratio of the two rates, one block of samples at a time.
+"""
+import argparse
+import math
+import time
+from fractions import Fraction
+
+import numpy as np
+
+
+class Resampler:
+    """Streaming polyphase resampler for mono float signals."""
+
+    def __init__(self, source_rate: int, target_rate: int, taps: int = 32) -> None:
+        """
+        Design the filter.
+
+        Args:
+            source_rate: Rate of the input samples
+            target_rate: Rate of the output samples
+            taps: Filter length per phase, longer is sharper but slower
+        """
+        ratio = Fraction(target_rate, source_rate)
+        self.up, self.down = ratio.numerator, ratio.denominator
+        self.taps = taps
+
+        # Windowed-sinc lowpass at the upsampled rate, cutting off slightly
+        # below the lower of the two Nyquist frequencies.
+        length = taps * self.up
+        cutoff = 0.95 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2.0
+        h = cutoff * np.sinc(cutoff * n) * np.kaiser(length, 8.0)
+        h *= self.up / h.sum()
+        # phases[p, k] multiplies the input sample k steps before the output.
+        self.phases = h.reshape(taps, self.up).T.astype(np.float32)
+
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._consumed = 0          # input samples received so far
+        self._next = 0              # upsampled time of the next output
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resample a block, continuing from the previous one."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.identity:
+            return samples
+        x = np.concatenate((self._history, samples))
+        start = self._consumed - len(self._history)
+        self._consumed += len(samples)
+
+        times = np.arange(self._next, self._consumed * self.up, self.down)
+        if len(times):
+            self._next = int(times[-1]) + self.down
+        self._history = x[len(x) - (self.taps - 1):]
+
+        bases = times // self.up - start
+        indices = bases[:, None] - np.arange(self.taps)[None, :]
+        return np.einsum("ij,ij->i", x[indices], self.phases[times % self.up])
+
+    @property
+    def identity(self) -> bool:
+        """Whether the rates are equal and samples pass through."""
+        return self.up == self.down == 1
+
+    @property
+    def delay(self) -> float:
+        """Group delay of the filter, in output samples."""
+        return (self.taps * self.up - 1) / (2.0 * self.down)
+
+    def flush(self) -> np.ndarray:
+        """Output what is still held back by the filter delay."""
+        if self.identity:
+            return np.zeros(0, dtype=np.float32)
+        return self.process(np.zeros(self.taps // 2, dtype=np.float32))
+
+
+class FormatConverter:
+    """Converts interleaved 16-bit PCM to mono at another rate."""
+
+    def __init__(self, source_rate: int, source_channels: int, target_rate: int,
+                 taps: int = 32) -> None:
+        """
+        Initialize the converter.
+
+        Args:
+            source_rate: Rate of the captured audio
+            source_channels: Channels of the captured audio
+            target_rate: Rate of the converted audio
+            taps: Filter length per phase of the resampler
+        """
+        self.source_rate = source_rate
+        self.source_channels = source_channels
+        self.target_rate = target_rate
+        self.resampler = Resampler(source_rate, target_rate, taps)
+
+    def convert(self, data: bytes) -> bytes:
+        """Convert a block of captured audio."""
+        samples = np.frombuffer(data, dtype=np.int16)
+        if self.source_channels > 1:
+            usable = len(samples) - len(samples) % self.source_channels
+            samples = samples[:usable].reshape(-1, self.source_channels).mean(axis=1)
+        return _to_pcm(self.resampler.process(samples))
+
+    def flush(self) -> bytes:
+        """Convert what is still held back by the resampler."""
+        return _to_pcm(self.resampler.flush())
+
+
+def _to_pcm(samples: np.ndarray) -> bytes:
+    """Round float samples to clipped 16-bit PCM."""
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
+
+
+def _convert_all(pcm: bytes, converter: FormatConverter, block_bytes: int):
+    """Convert a recording block by block, returning samples and CPU seconds."""
+    start = time.process_time()
+    out = b"".join(converter.convert(pcm[i:i + block_bytes])
+                   for i in range(0, len(pcm), block_bytes)) + converter.flush()
+    return np.frombuffer(out, dtype=np.int16).astype(np.float64), time.process_time() - start
+
+
+def benchmark(seconds: float = 60.0, block: int = 1024) -> None:
+    """Measure the CPU cost and quality of common capture conversions."""
+    print(f"{'conversion':<26}{'% of a core':>12}{'1 kHz SNR dB':>14}{'alias dB':>10}")
+    for rate, channels in ((48000, 2), (44100, 2), (48000, 1), (32000, 1), (8000, 1)):
+        t = np.arange(int(seconds * rate)) / rate
+
+        def capture(frequency, channels=channels, t=t):
+            signal = 8000 * np.sin(2 * math.pi * frequency * t)
+            return np.repeat(signal[:, None], channels, axis=1).astype(np.int16).tobytes()
+
+        converter = FormatConverter(rate, channels, 16000)
+        out, cpu = _convert_all(capture(1000), converter, block * channels * 2)
+        # Compare with the ideal tone, shifted by the filter delay, away from the edges.
+        reference = 8000 * np.sin(2 * math.pi * 1000 / 16000
+                                  * (np.arange(len(out)) - converter.resampler.delay))
+        core = slice(16000, len(out) - 16000)
+        snr = 10 * np.log10(np.sum(reference[core] ** 2)
+                            / np.sum((out[core] - reference[core]) ** 2))
+
+        alias = math.nan
+        if rate > 16000:
+            # A tone above the 8 kHz output Nyquist frequency must be filtered out.
+            aliased, _ = _convert_all(capture(min(11000, 0.45 * rate)),
+                                      FormatConverter(rate, channels, 16000),
+                                      block * channels * 2)
+            alias = 10 * np.log10(np.mean(aliased[core] ** 2) / 8000 ** 2 * 2 + 1e-12)
+
+        label = f"{rate} Hz x{channels} -> 16 kHz"
+        print(f"{label:<26}{100 * cpu / seconds:>12.2f}{snr:>14.1f}{alias:>10.1f}")
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["benchmark"])
+    parser.add_argument("--seconds", type=float, default=60.0)
+    args = parser.parse_args()
+    benchmark(args.seconds)
+
+
+if __name__ == "__main__":
+    main()
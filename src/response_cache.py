@@ -0,0 +1,170 @@
+"""
+Response cache for text generation.
+
+Replies are stored under a hash of the model, the request options and the
+normalized message list, so a question asked again in the same context is
+answered without a request. Rephrasings are not matched: that would need a
+semantic embedder, and the local hashed n-grams score a paraphrase no higher
+than a different question with shared wording.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+# Turns involving these roles depend on the state of the machine.
+TOOL_ROLES = ("tool", "function")
+
+
+@dataclass
+class CacheConfig:
+    """Configuration for the response cache."""
+    ttl: float = 3600.0
+    max_entries: int = 256
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counters."""
+    hits: int = 0
+    misses: int = 0
+    skipped: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class _Entry:
+    """A cached reply."""
+    response: str
+    created: float
+
+
+def _normalize(messages: List[Dict[str, Any]]) -> List[List[str]]:
+    """Reduce messages to role and whitespace-collapsed, casefolded text."""
+    return [
+        [message.get("role", ""), " ".join(str(message.get("content") or "").split()).casefold()]
+        for message in messages
+    ]
+
+
+def _digest(*parts: Any) -> str:
+    """Stable hash of JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Size and age bounded cache of chat completion replies."""
+
+    def __init__(self, config: Optional[CacheConfig] = None) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            config: CacheConfig object with cache parameters
+        """
+        self.config = config or CacheConfig()
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(messages: List[Dict[str, Any]]) -> bool:
+        """Whether a request may be answered from or stored in the cache."""
+        return bool(messages) and messages[-1].get("role") == "user" and not any(
+            message.get("role") in TOOL_ROLES or message.get("tool_calls")
+            for message in messages
+        )
+
+    @staticmethod
+    def _key(model: str, messages: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+        """Key of the request."""
+        return _digest(model, options, _normalize(messages))
+
+    def get(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        options: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        Look up the reply to a request.
+
+        Args:
+            model: Chat model of the request
+            messages: Messages in the chat completions format
+            options: Other request parameters that affect the reply
+
+        Returns:
+            The cached reply, or None on a miss
+        """
+        if not self.cacheable(messages):
+            with self._lock:
+                self.stats.skipped += 1
+            return None
+        key = self._key(model, messages, options or {})
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry.response
+            self.stats.misses += 1
+            return None
+
+    def put(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        response: str,
+        options: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Store the reply to a request.
+
+        Args:
+            model: Chat model of the request
+            messages: Messages in the chat completions format
+            response: Reply to store
+            options: Other request parameters that affect the reply
+        """
+        if not response or not self.cacheable(messages):
+            return
+        key = self._key(model, messages, options or {})
+
+        with self._lock:
+            self._entries[key] = _Entry(response, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.config.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def _expire(self, now: float) -> None:
+        """Drop entries older than the TTL; the lock must be held."""
+        expired = [key for key, entry in self._entries.items()
+                   if now - entry.created > self.config.ttl]
+        for key in expired:
+            del self._entries[key]
+        self.stats.evictions += len(expired)
+
+    def clear(self) -> None:
+        """Forget every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,414 @@
+"""
+Long-session soak test for memory and resource growth.
+
+Drives thousands of turns through the Hermine pipeline with the fake engines
+and records them in a scratch journal. The turns rotate between a recording
+file, a recording made by the VoiceRecorder on its persistent capture engine,
+a reply streamed through the PlaybackEngine and a command answered by the
+intent matcher from the confirmation cache. The microphone and sound card are
+replaced by null devices running faster than real time, and the portal by one
+that does nothing, so no network, audio device or desktop session is
+involved. The process is sampled every few turns: resident memory, open file
+descriptors, threads, live Python objects and allocated memory blocks. After
+a warmup, the growth per turn of each measure is estimated with a
+least-squares fit and the run fails when one exceeds its budget. The SQLite
+page cache of the journal fills up over the first few thousand turns, so
+long runs give the most reliable memory figures.
+
+    python3 soak.py --turns 5000
+"""
+import argparse
+import functools
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from unittest import mock
+
+import pyaudio
+import sounddevice as sd
+
+from audio_output import PlaybackConfig, PlaybackEngine
+from backends import BackendConfig
+from benchmark import synthesize_fixture
+from intents import ConfirmationCache
+from journal import SessionJournal
+from pipeline import Conversation, HerminePipeline
+from tracing import Tracer
+from voice_recorder import RecorderConfig, VoiceRecorder
+
+MEASURES = ("rss_bytes", "open_fds", "threads", "objects", "allocated_blocks")
+# Paths through the pipeline, one turn each in turn.
+TURN_KINDS = ("file", "recording", "playback", "intent")
+# Matched by the intent matcher, and harmless with the null portal.
+INTENT_COMMAND = "Verrouille l'écran"
+# How much faster than real time the null devices run.
+SPEEDUP = 50.0
+PLAYBACK_TIMEOUT = 10.0
+
+
+@dataclass
+class SoakConfig:
+    """Configuration of a soak run."""
+    turns: int = 2000
+    warmup: int = 200
+    sample_every: int = 50
+    # Largest tolerated growth per turn of each measure.
+    max_growth: Dict[str, float] = field(default_factory=lambda: {
+        "rss_bytes": 2048.0,
+        "open_fds": 0.01,
+        "threads": 0.01,
+        "objects": 1.0,
+        "allocated_blocks": 1.0,
+    })
+
+
+@dataclass
+class ResourceSample:
+    """Resources held by the process after a number of turns."""
+    turn: int
+    elapsed: float
+    rss_bytes: int
+    open_fds: int
+    threads: int
+    objects: int
+    allocated_blocks: int
+
+
+class _NullDevice:
+    """Calls an audio callback from a thread at a multiple of real time."""
+
+    def __init__(self, callback: Callable[[], None], period: float, name: str) -> None:
+        self._callback = callback
+        self._period = period / SPEEDUP
+        self._name = name
+        self._running = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start calling the callback."""
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop calling the callback."""
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while self._running.is_set():
+            self._callback()
+            time.sleep(self._period)
+
+
+class _NullOutputStream(_NullDevice):
+    """Stands in for sounddevice.RawOutputStream and discards the audio."""
+
+    def __init__(self, samplerate: int, blocksize: int, callback, **_options) -> None:
+        status = sd.CallbackFlags()
+        buffer = bytearray(blocksize * 2)
+        super().__init__(lambda: callback(buffer, blocksize, None, status),
+                         blocksize / samplerate, "null-output")
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+class _FixtureInputStream(_NullDevice):
+    """Stands in for a pyaudio callback stream, looping speech and silence."""
+
+    def __init__(self, pcm: bytes, frames: int, rate: int, callback) -> None:
+        self._pcm = pcm
+        self._position = 0
+        self._size = frames * 2
+        self._stream_callback = callback
+        super().__init__(self._deliver, frames / rate, "null-input")
+
+    def _deliver(self) -> None:
+        end = self._position + self._size
+        chunk = (self._pcm + self._pcm)[self._position:end] if end > len(self._pcm) \
+            else self._pcm[self._position:end]
+        self._position = end % len(self._pcm)
+        self._stream_callback(chunk, self._size // 2, None, 0)
+
+    def start_stream(self) -> None:
+        """Start delivering audio."""
+        self.start()
+
+    def stop_stream(self) -> None:
+        """Stop delivering audio."""
+        self.stop()
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+class _FixtureAudio:
+    """Stands in for pyaudio.PyAudio with a microphone repeating a fixture."""
+
+    def __init__(self, pcm: bytes) -> None:
+        self._pcm = pcm
+
+    @staticmethod
+    def get_sample_size(_sample_format: int) -> int:
+        """Only 16-bit audio is produced."""
+        return 2
+
+    def open(self, rate: int, frames_per_buffer: int, stream_callback, **_options):
+        """Open the fixture as an input stream in callback mode."""
+        return _FixtureInputStream(self._pcm, frames_per_buffer, rate, stream_callback)
+
+    def terminate(self) -> None:
+        """Nothing to release."""
+
+
+class _NullPortal:
+    """Desktop portal whose requests succeed without doing anything."""
+
+    @staticmethod
+    def lock_session() -> bool:
+        """Pretend to lock the session."""
+        return True
+
+    @staticmethod
+    def take_screenshot() -> Exception:
+        """No screen to capture."""
+        return OSError("No screen in the soak test")
+
+
+def _speech_and_silence(fixture: Path, silence: float = 1.0) -> bytes:
+    """The fixture's samples followed by silence, for the recorder to stop on."""
+    # pylint: disable=no-member
+    with wave.open(str(fixture), "rb") as wf:
+        pcm = wf.readframes(wf.getnframes())
+        rate = wf.getframerate()
+    # pylint: enable=no-member
+    return pcm + bytes(int(silence * rate) * 2)
+
+
+def sample_resources(turn: int, elapsed: float) -> ResourceSample:
+    """Measure the process, after a full garbage collection."""
+    gc.collect()
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        rss = 0
+    try:
+        fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        fds = 0
+    return ResourceSample(
+        turn=turn,
+        elapsed=elapsed,
+        rss_bytes=rss,
+        open_fds=fds,
+        threads=threading.active_count(),
+        objects=len(gc.get_objects()),
+        # Also counts what the collector does not track, such as dicts and
+        # tuples holding only strings and numbers.
+        allocated_blocks=sys.getallocatedblocks()
+    )
+
+
+def growth_per_turn(samples: List[ResourceSample], measure: str) -> float:
+    """Least-squares slope of a measure against the turn number."""
+    if len(samples) < 2:
+        return 0.0
+    turns = [sample.turn for sample in samples]
+    values = [getattr(sample, measure) for sample in samples]
+    mean_turn = sum(turns) / len(turns)
+    mean_value = sum(values) / len(values)
+    variance = sum((turn - mean_turn) ** 2 for turn in turns)
+    if not variance:
+        return 0.0
+    covariance = sum((turn - mean_turn) * (value - mean_value)
+                     for turn, value in zip(turns, values))
+    return covariance / variance
+
+
+def _object_types() -> Counter:
+    """Live objects tracked by the garbage collector, by type name."""
+    gc.collect()
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class SoakTest:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Runs turns back to back on one long-lived pipeline and conversation."""
+
+    def __init__(self, config: Optional[SoakConfig] = None,
+                 backends: Optional[BackendConfig] = None) -> None:
+        """
+        Initialize the pipeline under test.
+
+        Args:
+            config: SoakConfig object with run parameters
+            backends: Engines to drive, the fake ones without latency by default
+        """
+        self.config = config or SoakConfig()
+        self.pipeline = HerminePipeline(
+            api_key="soak",
+            backends=backends or BackendConfig(stt="fake", tts="fake", llm="fake")
+        )
+        self.pipeline.portal = _NullPortal()
+        self.conversation = Conversation()
+        self.samples: List[ResourceSample] = []
+        self.growing_types: List[tuple] = []
+        self.turn_kinds: Counter = Counter()
+        self._recorder: Optional[VoiceRecorder] = None
+        self._player: Optional[PlaybackEngine] = None
+
+    def run(self, scratch: Path) -> Dict[str, float]:
+        """
+        Run the configured turns.
+
+        Args:
+            scratch: Directory for the recording, replies, traces and journal
+
+        Returns:
+            Growth per turn of every measure after the warmup
+        """
+        fixture = synthesize_fixture(scratch / "recording.wav")
+        # A tracer of its own, so every span is exported without touching
+        # the user's trace files.
+        tracer = Tracer(scratch / "traces.jsonl", scratch / "metrics.prom")
+        journal = SessionJournal(scratch / "journal.sqlite3")
+        self.conversation = Conversation.resume(journal, "soak")
+        # Stored on disk like the real cache, but in the scratch directory.
+        self.pipeline.confirmations = ConfirmationCache(scratch / "confirmations",
+                                                        voice="soak")
+
+        with mock.patch.object(pyaudio, "PyAudio",
+                               functools.partial(_FixtureAudio, _speech_and_silence(fixture))), \
+                mock.patch.object(sd, "RawOutputStream", _NullOutputStream):
+            self._recorder = VoiceRecorder(RecorderConfig(
+                output_file=str(scratch / "recorded.wav"),
+                silence_timeout=0.2,
+                persistent=True,
+                native_format=False
+            ))
+            self._player = PlaybackEngine(PlaybackConfig())
+            try:
+                return self._run_turns(scratch, fixture, tracer)
+            finally:
+                self._player.close()
+                self._recorder.capture.terminate()
+                journal.close()
+
+    def _run_turns(self, scratch: Path, fixture: Path, tracer: Tracer) -> Dict[str, float]:
+        """Run the turns, rotating between the paths through the pipeline."""
+        output = scratch / "reply.wav"
+        start = time.perf_counter()
+        baseline_types: Counter = Counter()
+        for turn in range(1, self.config.turns + 1):
+            kind = TURN_KINDS[turn % len(TURN_KINDS)]
+            self.turn_kinds[kind] += 1
+            traced = tracer.start_turn()
+            try:
+                if kind == "file":
+                    self.pipeline.run_turn(self.conversation, audio_path=fixture,
+                                           output_path=output, turn=traced)
+                elif kind == "recording":
+                    recording = self._recorder.record_until_silence()
+                    self.pipeline.run_turn(self.conversation, audio_path=recording,
+                                           output_path=output, turn=traced)
+                elif kind == "playback":
+                    result = self.pipeline.run_turn(self.conversation, audio_path=fixture,
+                                                    turn=traced)
+                    self._play(self.pipeline.speak_stream(result.reply))
+                else:
+                    result = self.pipeline.run_turn(self.conversation, text=INTENT_COMMAND,
+                                                    turn=traced)
+                    self._play(self.pipeline.speak_stream(result.reply))
+            finally:
+                traced.finish()
+            if turn == self.config.warmup:
+                baseline_types = _object_types()
+            if turn >= self.config.warmup and turn % self.config.sample_every == 0:
+                sample = sample_resources(turn, time.perf_counter() - start)
+                self.samples.append(sample)
+                print(f"turn {turn:>6}  rss {sample.rss_bytes / 1e6:8.1f} MB  "
+                      f"fds {sample.open_fds:>4}  threads {sample.threads:>3}  "
+                      f"objects {sample.objects:>8}  blocks {sample.allocated_blocks:>8}")
+
+        self.growing_types = (_object_types() - baseline_types).most_common(10)
+        return {measure: growth_per_turn(self.samples, measure) for measure in MEASURES}
+
+    def _play(self, chunks) -> None:
+        """
+        Play a clip on the null output and wait until it is fed entirely.
+
+        Raises:
+            RuntimeError: If the clip does not play within PLAYBACK_TIMEOUT
+        """
+        played = self._player.clips_played + 1
+        started = threading.Event()
+        self._player.play(chunks, on_start=started.set)
+        deadline = time.monotonic() + PLAYBACK_TIMEOUT
+        while self._player.clips_played < played or not started.is_set():
+            if time.monotonic() > deadline:
+                raise RuntimeError("Playback stalled on the null output device")
+            started.wait(0.005)
+
+
+def main() -> int:
+    """Run the soak test and return a non-zero status on growth."""
+    defaults = SoakConfig()
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=defaults.turns)
+    parser.add_argument("--warmup", type=int, default=defaults.warmup,
+                        help="Turns run before measuring, while caches fill up")
+    parser.add_argument("--sample-every", type=int, default=defaults.sample_every)
+    for measure in MEASURES:
+        parser.add_argument(f"--max-{measure.replace('_', '-')}-per-turn", type=float,
+                            dest=measure, default=defaults.max_growth[measure])
+    parser.add_argument("--json", help="Write the samples and growth rates to this file")
+    args = parser.parse_args()
+
+    config = SoakConfig(
+        turns=args.turns,
+        warmup=min(args.warmup, args.turns),
+        sample_every=args.sample_every,
+        max_growth={measure: getattr(args, measure) for measure in MEASURES}
+    )
+    soak = SoakTest(config)
+    with tempfile.TemporaryDirectory() as scratch:
+        growth = soak.run(Path(scratch))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "growth_per_turn": growth,
+            "turn_kinds": dict(soak.turn_kinds),
+            "samples": [asdict(sample) for sample in soak.samples],
+        }, indent=2), encoding="utf-8")
+
+    print("turns    " + "  ".join(f"{kind} {count}" for kind, count in soak.turn_kinds.items()))
+    print(f"{'measure':<18}{'per turn':>14}{'budget':>14}")
+    failed = False
+    for measure in MEASURES:
+        budget = config.max_growth[measure]
+        print(f"{measure:<18}{growth[measure]:>14.4f}{budget:>14.4f}")
+        if growth[measure] > budget:
+            failed = True
+    if failed:
+        print("Resources grow with the number of turns. Types with the most new objects:")
+        for name, count in soak.growing_types:
+            print(f"  {name:<30}{count:>8}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,43 @@
 """
 Speech-to-text module using OpenAI's Whisper model.
 """
-from typing import Optional
+import asyncio
+from typing import Iterable, List, Optional, Union
 from pathlib import Path
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from async_clients import close_async_clients, shared_async_client
+from batch import BatchConfig, BatchRunner
+from tracing import span
 
-class AudioTranscriber: # pylint: disable=too-few-public-methods
+
+class AudioTranscriber:
     """A class to handle audio transcription using OpenAI's API."""
 
-    def __init__(self, api_key: Optional[str] = None, model: str = "whisper-1"):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "whisper-1",
+        base_url: Optional[str] = None
+    ):
         """
         Initialize the AudioTranscriber.
 
         Args:
             api_key: OpenAI API key. If None, uses OPENAI_API_KEY environment variable.
             model: The transcription model to use.
+            base_url: Alternative API endpoint, e.g. a local mock server.
         """
         self.api_key = api_key
         self.model = model
-        self.client = OpenAI(api_key=api_key)
+        self.base_url = base_url
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Client shared by the async methods of the running event loop."""
+        return shared_async_client(self.api_key, self.base_url)
 
     def transcribe_file(self, file_path: str) -> str:
         """
@@ -41,16 +58,105 @@ class AudioTranscriber: # pylint: disable=too-few-public-methods
             raise FileNotFoundError(f"Audio file not found: {file_path}")
 
         try:
-            with open(file_path, "rb") as audio_file:
+            # Upload and recognition happen in the same request.
+            with span("stt", bytes=file_path.stat().st_size) as stats, \
+                    open(file_path, "rb") as audio_file:
                 transcription = self.client.audio.transcriptions.create(
                     model=self.model,
                     file=audio_file,
                     response_format="text"
                 )
+                stats["chars"] = len(transcription)
                 return transcription
         except Exception as e:
             raise ValueError(f"Transcription error: {str(e)}") from e
 
+    async def transcribe_file_async(self, file_path: str) -> str:
+        """
+        Transcribe an audio file to text without blocking the event loop.
+
+        Cancelling the calling task aborts the request.
+
+        Args:
+            file_path: Path to the audio file.
+
+        Returns:
+            Transcription text.
+
+        Raises:
+            FileNotFoundError: If the audio file doesn't exist.
+            ValueError: For API or processing errors.
+        """
+        file_path = Path(file_path)
+        if not file_path.exists():
+            raise FileNotFoundError(f"Audio file not found: {file_path}")
+
+        try:
+            with span("stt", bytes=file_path.stat().st_size) as stats:
+                # Read off the event loop, recordings can be large.
+                audio = await asyncio.to_thread(file_path.read_bytes)
+                transcription = await self.async_client.audio.transcriptions.create(
+                    model=self.model,
+                    file=(file_path.name, audio),
+                    response_format="text"
+                )
+                stats["chars"] = len(transcription)
+                return transcription
+        except Exception as e:
+            raise ValueError(f"Transcription error: {str(e)}") from e
+
+    def transcribe_batch(
+        self,
+        file_paths: Iterable[Union[str, Path]],
+        config: Optional[BatchConfig] = None,
+        checkpoint: Optional[Union[str, Path]] = None
+    ) -> List[Optional[str]]:
+        """
+        Transcribe many audio files concurrently.
+
+        Blocks until the whole batch is done; use transcribe_batch_async
+        from within an event loop.
+
+        Args:
+            file_paths: Audio files to transcribe.
+            config: Concurrency, retry and initial rate limit settings.
+            checkpoint: File recording finished transcriptions, so that
+                running the same batch again resumes where it stopped.
+
+        Returns:
+            Transcriptions in input order, None for files that failed.
+        """
+        async def run() -> List[Optional[str]]:
+            try:
+                return await self.transcribe_batch_async(file_paths, config, checkpoint)
+            finally:
+                await close_async_clients()
+
+        return asyncio.run(run())
+
+    async def transcribe_batch_async(
+        self,
+        file_paths: Iterable[Union[str, Path]],
+        config: Optional[BatchConfig] = None,
+        checkpoint: Optional[Union[str, Path]] = None
+    ) -> List[Optional[str]]:
+        """Async version of transcribe_batch."""
+        # Retries are paced by the batch runner instead of the client.
+        client = self.async_client.with_options(max_retries=0)
+
+        async def worker(file_path):
+            file_path = Path(file_path)
+            audio = await asyncio.to_thread(file_path.read_bytes)
+            raw = await client.audio.transcriptions.with_raw_response.create(
+                model=self.model,
+                file=(file_path.name, audio),
+                response_format="text"
+            )
+            return raw.parse(), raw.headers, None
+
+        items = [str(file_path) for file_path in file_paths]
+        return await BatchRunner(config).run(items, worker, checkpoint=checkpoint)
+
 
 def main() -> None:
     """Main function to demonstrate the AudioTranscriber class."""
@@ -1,13 +1,20 @@
 """
 Text Generator Module using OpenAI API.
 """
+import asyncio
 import os
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Union
 
 import openai
-from openai import OpenAI
-from openai.types.chat import ChatCompletion
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+
+from async_clients import close_async_clients, shared_async_client
+from batch import BatchConfig, BatchRunner
+from response_cache import ResponseCache
+from tracing import mark, span
 
 
 @dataclass
@@ -22,21 +29,51 @@ class Message:
         return {"role": self.role, "content": self.content}
 
 
+def _format(messages: Iterable[Union[Message, dict]]) -> List[dict]:
+    """Messages in the chat completions format; dicts, e.g. tool results, pass as they are."""
+    return [message.to_dict() if isinstance(message, Message) else message
+            for message in messages]
+
+
 class TextGenerator:
     """Class for generating text using OpenAI's API."""
 
-    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o-mini"):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "gpt-4o-mini",
+        base_url: Optional[str] = None,
+        cache: Optional[ResponseCache] = None
+    ):
         """Initialize the TextGenerator with OpenAI client.
 
         Args:
             api_key: OpenAI API key. Defaults to environment variable.
             model: The model to use for text generation.
+            base_url: Alternative API endpoint, e.g. a local mock server.
+            cache: Answers repeated questions locally when given.
         """
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=self.api_key)
+        self.base_url = base_url
+        self.client = OpenAI(api_key=self.api_key, base_url=base_url)
         self.model = model
+        self.cache = cache
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Client shared by the async methods of the running event loop."""
+        return shared_async_client(self.api_key, self.base_url)
+
+    def _cached(self, messages: List[Dict[str, str]], options: dict) -> Optional[str]:
+        """Look up a reply in the cache, if there is one."""
+        if self.cache is None:
+            return None
+        with span("llm.cache") as stats:
+            response = self.cache.get(self.model, messages, options)
+            stats["hit"] = response is not None
+        return response
 
-    def generate(self, messages: List[Message], **kwargs) -> Optional[str]:
+    def generate(self, messages: List[Union[Message, dict]], **kwargs) -> Optional[str]:
         """Generate text based on the provided messages.
 
         Args:
@@ -46,18 +83,143 @@ class TextGenerator:
         Returns:
             The generated text or None if an error occurred.
         """
+        reply = self.complete(messages, **kwargs)
+        return reply.content if reply is not None else None
+
+    def complete(
+        self,
+        messages: List[Union[Message, dict]],
+        **kwargs
+    ) -> Optional[ChatCompletionMessage]:
+        """Generate a reply message, with the tool calls the model requested.
+
+        Args:
+            messages: List of messages for context generation, dicts in the
+                chat completions format for tool calls, results and images.
+            **kwargs: Additional parameters to pass to the OpenAI API, such as tools.
+
+        Returns:
+            The reply message, or None if an error occurred or there was no choice.
+        """
         try:
-            formatted_messages = [message.to_dict() for message in messages]
+            formatted_messages = _format(messages)
+            cached = self._cached(formatted_messages, kwargs)
+            if cached is not None:
+                return ChatCompletionMessage(role="assistant", content=cached)
 
-            completion: ChatCompletion = self.client.chat.completions.create(
-                model=self.model,
-                messages=formatted_messages,
-                **kwargs
-            )
+            with span("llm.completion") as stats:
+                completion: ChatCompletion = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=formatted_messages,
+                    **kwargs
+                )
+                if completion.usage:
+                    stats["prompt_tokens"] = completion.usage.prompt_tokens
+                    stats["completion_tokens"] = completion.usage.completion_tokens
 
-            if completion.choices:
-                return completion.choices[0].message.content
+            if not completion.choices:
+                return None
+            reply = completion.choices[0].message
+            # Tool calls act on the machine, their outcome must not be replayed.
+            if self.cache is not None and not reply.tool_calls:
+                self.cache.put(self.model, formatted_messages, reply.content, kwargs)
+            return reply
+        except (
+            openai.APIError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.AuthenticationError,
+            ValueError
+            ) as error:
+            print(f"Error generating text: {error}")
             return None
+
+    def stream(self, messages: List[Union[Message, dict]], **kwargs) -> Iterator[str]:
+        """Generate text and yield it as the tokens arrive.
+
+        Args:
+            messages: List of messages for context generation.
+            **kwargs: Additional parameters to pass to the OpenAI API.
+
+        Yields:
+            Fragments of the generated text. Nothing is yielded if an error occurred.
+        """
+        try:
+            formatted_messages = _format(messages)
+            cached = self._cached(formatted_messages, kwargs)
+            if cached is not None:
+                mark("llm.first_token")
+                yield cached
+                return
+
+            with span("llm.completion") as stats:
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=formatted_messages,
+                    stream=True,
+                    **kwargs
+                )
+
+                stats["completion_tokens"] = 0
+                fragments = []
+                used_tools = False
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    used_tools = used_tools or bool(delta.tool_calls)
+                    if delta.content:
+                        if not stats["completion_tokens"]:
+                            mark("llm.first_token")
+                        stats["completion_tokens"] += 1
+                        fragments.append(delta.content)
+                        yield delta.content
+
+            if self.cache is not None and not used_tools:
+                self.cache.put(self.model, formatted_messages, "".join(fragments), kwargs)
+        except (
+            openai.APIError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.AuthenticationError,
+            ValueError
+            ) as error:
+            print(f"Error generating text: {error}")
+
+    async def generate_async(self, messages: List[Message], **kwargs) -> Optional[str]:
+        """Generate text without blocking the event loop.
+
+        Cancelling the calling task aborts the request.
+
+        Args:
+            messages: List of messages for context generation.
+            **kwargs: Additional parameters to pass to the OpenAI API.
+
+        Returns:
+            The generated text or None if an error occurred.
+        """
+        try:
+            formatted_messages = _format(messages)
+            cached = self._cached(formatted_messages, kwargs)
+            if cached is not None:
+                return cached
+
+            with span("llm.completion") as stats:
+                completion: ChatCompletion = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=formatted_messages,
+                    **kwargs
+                )
+                if completion.usage:
+                    stats["prompt_tokens"] = completion.usage.prompt_tokens
+                    stats["completion_tokens"] = completion.usage.completion_tokens
+
+            if not completion.choices:
+                return None
+            reply = completion.choices[0].message
+            if self.cache is not None and not reply.tool_calls:
+                self.cache.put(self.model, formatted_messages, reply.content, kwargs)
+            return reply.content
         except (
             openai.APIError,
             openai.APIConnectionError,
@@ -68,6 +230,123 @@ class TextGenerator:
             print(f"Error generating text: {error}")
             return None
 
+    async def stream_async(self, messages: List[Message], **kwargs) -> AsyncIterator[str]:
+        """Generate text and yield it as the tokens arrive, without blocking the event loop.
+
+        Closing the iterator or cancelling the consuming task closes the connection.
+
+        Args:
+            messages: List of messages for context generation.
+            **kwargs: Additional parameters to pass to the OpenAI API.
+
+        Yields:
+            Fragments of the generated text. Nothing is yielded if an error occurred.
+        """
+        try:
+            formatted_messages = _format(messages)
+            cached = self._cached(formatted_messages, kwargs)
+            if cached is not None:
+                mark("llm.first_token")
+                yield cached
+                return
+
+            with span("llm.completion") as stats:
+                stream = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=formatted_messages,
+                    stream=True,
+                    **kwargs
+                )
+
+                stats["completion_tokens"] = 0
+                fragments = []
+                used_tools = False
+                async with stream:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        used_tools = used_tools or bool(delta.tool_calls)
+                        if delta.content:
+                            if not stats["completion_tokens"]:
+                                mark("llm.first_token")
+                            stats["completion_tokens"] += 1
+                            fragments.append(delta.content)
+                            yield delta.content
+
+            if self.cache is not None and not used_tools:
+                self.cache.put(self.model, formatted_messages, "".join(fragments), kwargs)
+        except (
+            openai.APIError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.AuthenticationError,
+            ValueError
+            ) as error:
+            print(f"Error generating text: {error}")
+
+    def generate_batch(
+        self,
+        conversations: Iterable[List[Message]],
+        config: Optional[BatchConfig] = None,
+        checkpoint: Optional[Union[str, Path]] = None,
+        **kwargs
+    ) -> List[Optional[str]]:
+        """Generate replies to many conversations concurrently.
+
+        Blocks until the whole batch is done; use generate_batch_async from
+        within an event loop.
+
+        Args:
+            conversations: Message lists to answer.
+            config: Concurrency, retry and initial rate limit settings.
+            checkpoint: File recording finished replies, so that running
+                the same batch again resumes where it stopped.
+            **kwargs: Additional parameters to pass to the OpenAI API.
+
+        Returns:
+            The replies in input order, None for the ones that failed.
+        """
+        async def run() -> List[Optional[str]]:
+            try:
+                return await self.generate_batch_async(conversations, config, checkpoint,
+                                                       **kwargs)
+            finally:
+                await close_async_clients()
+
+        return asyncio.run(run())
+
+    async def generate_batch_async(
+        self,
+        conversations: Iterable[List[Message]],
+        config: Optional[BatchConfig] = None,
+        checkpoint: Optional[Union[str, Path]] = None,
+        **kwargs
+    ) -> List[Optional[str]]:
+        """Async version of generate_batch."""
+        # Retries are paced by the batch runner instead of the client.
+        client = self.async_client.with_options(max_retries=0)
+
+        async def worker(messages):
+            raw = await client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                **kwargs
+            )
+            completion = raw.parse()
+            content = completion.choices[0].message.content if completion.choices else None
+            used = completion.usage.total_tokens if completion.usage else None
+            return content, raw.headers, used
+
+        def estimate(messages) -> float:
+            # About four characters per token, plus the expected reply.
+            prompt = sum(len(str(message["content"])) for message in messages) / 4
+            return prompt + kwargs.get("max_tokens", 256)
+
+        items = [[message.to_dict() for message in conversation]
+                 for conversation in conversations]
+        return await BatchRunner(config).run(items, worker, estimate, checkpoint)
+
     def get_model(self) -> str:
         """Get the current model being used.
         
@@ -0,0 +1,293 @@
+"""
+Per-turn latency tracing.
+
+Every turn gets an ID and each pipeline stage records a span with its timing
+and byte/token counts. Spans are appended to a JSONL file, rotated by size,
+and aggregated into Prometheus text metrics, written to a file and optionally
+served over HTTP.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+DEFAULT_TRACE_DIR = Path.home() / ".cache" / "hermine"
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNTED_ATTRIBUTES = ("bytes", "tokens", "prompt_tokens", "completion_tokens", "underruns")
+# The trace file is rotated at this size, keeping this many older files.
+TRACE_MAX_BYTES = int(os.environ.get("HERMINE_TRACE_MAX_BYTES", str(16 * 1024 * 1024)))
+TRACE_BACKUPS = 3
+
+_CURRENT_TURN: contextvars.ContextVar = contextvars.ContextVar("hermine_turn", default=None)
+
+
+@dataclass
+class Span:
+    """A timed pipeline stage within a turn."""
+    turn_id: str
+    name: str
+    start: float
+    duration: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+class Turn:
+    """A single user interaction, from capture to playback."""
+
+    def __init__(self, tracer: "Tracer", turn_id: Optional[str] = None) -> None:
+        """
+        Initialize the turn.
+
+        Args:
+            tracer: Tracer receiving the spans
+            turn_id: Identifier of the turn, generated if omitted
+        """
+        self.tracer = tracer
+        self.turn_id = turn_id or uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self.finished = False
+
+    def elapsed(self) -> float:
+        """Seconds since the turn started."""
+        return time.perf_counter() - self._start
+
+    def record(self, name: str, start: float, duration: float, **attributes) -> Span:
+        """Record a span measured by the caller (perf_counter based start)."""
+        recorded = Span(
+            turn_id=self.turn_id,
+            name=name,
+            start=self.started_at + (start - self._start),
+            duration=duration,
+            attributes=attributes
+        )
+        with self._lock:
+            self.spans.append(recorded)
+        self.tracer.export(recorded)
+        return recorded
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Dict[str, Any]]:
+        """Time a block; the yielded dict can be filled with counts."""
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, start, time.perf_counter() - start, **attributes)
+
+    def mark(self, name: str, **attributes) -> Span:
+        """Record a milestone measured from the start of the turn."""
+        return self.record(name, self._start, self.elapsed(), **attributes)
+
+    def finish(self) -> None:
+        """Close the turn and refresh the exported metrics."""
+        if self.finished:
+            return
+        self.finished = True
+        self.record("turn", self._start, self.elapsed())
+        self.tracer.write_metrics()
+
+
+class Tracer:  # pylint: disable=too-many-instance-attributes
+    """Collects spans and exports them to JSONL and Prometheus text."""
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        trace_file: Optional[Path] = None,
+        metrics_file: Optional[Path] = None,
+        max_bytes: int = TRACE_MAX_BYTES,
+        backups: int = TRACE_BACKUPS
+    ) -> None:
+        """
+        Initialize the tracer.
+
+        Args:
+            trace_file: JSONL file spans are appended to, None disables it
+            metrics_file: Prometheus text file refreshed after each turn
+            max_bytes: Size at which the trace file is rotated, 0 never rotates
+            backups: Rotated files kept as trace_file.1 (newest) to trace_file.N
+        """
+        self.trace_file = trace_file
+        self.metrics_file = metrics_file
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._trace_size: Optional[int] = None
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+        self._counters: Dict[tuple, float] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @classmethod
+    def from_environment(cls) -> "Tracer":
+        """Build a tracer from HERMINE_TRACE_DIR, an empty value disables export."""
+        directory = os.environ.get("HERMINE_TRACE_DIR", str(DEFAULT_TRACE_DIR))
+        if not directory:
+            return cls()
+        directory = Path(directory)
+        return cls(directory / "traces.jsonl", directory / "metrics.prom")
+
+    def start_turn(self, turn_id: Optional[str] = None) -> Turn:
+        """Start tracing a new turn."""
+        return Turn(self, turn_id)
+
+    def export(self, recorded: Span) -> None:
+        """Aggregate a span and append it to the trace file."""
+        with self._lock:
+            buckets = self._histograms.setdefault(recorded.name, [0] * (len(BUCKETS) + 1))
+            for index, bound in enumerate(BUCKETS):
+                if recorded.duration <= bound:
+                    buckets[index] += 1
+            buckets[-1] += 1
+            self._sums[recorded.name] = self._sums.get(recorded.name, 0.0) + recorded.duration
+            for key in COUNTED_ATTRIBUTES:
+                value = recorded.attributes.get(key)
+                if isinstance(value, (int, float)):
+                    counter = (recorded.name, key)
+                    self._counters[counter] = self._counters.get(counter, 0) + value
+
+            if self.trace_file is not None:
+                line = json.dumps(asdict(recorded), default=str) + "\n"
+                try:
+                    self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+                    self._rotate_if_full(len(line))
+                    with open(self.trace_file, "a", encoding="utf-8") as f:
+                        f.write(line)
+                    self._trace_size += len(line)
+                except OSError as e:
+                    self._trace_size = None
+                    print(f"Error writing trace: {e}")
+
+    def _rotate_if_full(self, incoming: int) -> None:
+        """Shift trace_file to trace_file.1 and so on when it would exceed max_bytes."""
+        if self._trace_size is None:
+            try:
+                self._trace_size = self.trace_file.stat().st_size
+            except FileNotFoundError:
+                self._trace_size = 0
+        if not self.max_bytes or self._trace_size + incoming <= self.max_bytes \
+                or not self._trace_size:
+            return
+        for index in range(self.backups, 0, -1):
+            source = self.trace_file.with_name(
+                f"{self.trace_file.name}.{index - 1}" if index > 1 else self.trace_file.name)
+            if source.exists():
+                os.replace(source, self.trace_file.with_name(f"{self.trace_file.name}.{index}"))
+        if not self.backups:
+            self.trace_file.unlink(missing_ok=True)
+        self._trace_size = 0
+
+    def prometheus_text(self) -> str:
+        """Render the aggregated metrics in the Prometheus text format."""
+        lines = [
+            "# HELP hermine_stage_duration_seconds Duration of Hermine pipeline stages.",
+            "# TYPE hermine_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, buckets in sorted(self._histograms.items()):
+                for bound, count in zip(BUCKETS, buckets):
+                    lines.append(
+                        f'hermine_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                        f"{count}"
+                    )
+                lines.append(
+                    f'hermine_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} '
+                    f"{buckets[-1]}"
+                )
+                lines.append(
+                    f'hermine_stage_duration_seconds_sum{{stage="{stage}"}} {self._sums[stage]}'
+                )
+                lines.append(
+                    f'hermine_stage_duration_seconds_count{{stage="{stage}"}} {buckets[-1]}'
+                )
+            lines.append(
+                "# HELP hermine_stage_units_total Bytes, tokens and underruns counted per stage."
+            )
+            lines.append("# TYPE hermine_stage_units_total counter")
+            for (stage, unit), value in sorted(self._counters.items()):
+                lines.append(
+                    f'hermine_stage_units_total{{stage="{stage}",unit="{unit}"}} {value}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self) -> None:
+        """Atomically rewrite the metrics file."""
+        if self.metrics_file is None:
+            return
+        try:
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.metrics_file.with_suffix(".tmp")
+            tmp_file.write_text(self.prometheus_text(), encoding="utf-8")
+            os.replace(tmp_file, self.metrics_file)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+    def serve_metrics(self, port: int, host: str = "127.0.0.1") -> None:
+        """Serve the metrics on http://host:port/metrics in a background thread."""
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """Serves the Prometheus text endpoint."""
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                """Silence request logging."""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Return the current metrics."""
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                data = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+
+def current_turn() -> Optional[Turn]:
+    """The turn active in this context, if any."""
+    return _CURRENT_TURN.get()
+
+
+@contextmanager
+def use_turn(turn: Optional[Turn]) -> Iterator[Optional[Turn]]:
+    """Make a turn current for the spans recorded in this context."""
+    token = _CURRENT_TURN.set(turn)
+    try:
+        yield turn
+    finally:
+        _CURRENT_TURN.reset(token)
+
+
+def span(name: str, **attributes) -> ContextManager[Dict[str, Any]]:
+    """Time a block within the current turn; a no-op outside of one."""
+    turn = current_turn()
+    if turn is None:
+        return nullcontext(attributes)
+    return turn.span(name, **attributes)
+
+
+def mark(name: str, **attributes) -> None:
+    """Record a milestone of the current turn, if any."""
+    turn = current_turn()
+    if turn is not None:
+        turn.mark(name, **attributes)
+
+
+TRACER = Tracer.from_environment()
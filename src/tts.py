@@ -1,11 +1,18 @@
 """
 Module for text-to-speech conversion using OpenAI's API.
 """
+import asyncio
 from pathlib import Path
-from typing import Optional, Union
+from typing import AsyncIterator, Iterator, Optional, Union
 
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from async_clients import shared_async_client
+from tracing import mark, span
+
+# Format of OpenAI's response_format="pcm": 24 kHz, 16-bit signed, mono.
+PCM_RATE = 24000
 
 
 class TextToSpeechConverter:
@@ -15,7 +22,8 @@ class TextToSpeechConverter:
         self,
         model: str = "tts-1-hd",
         voice: str = "sage",
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None
     ) -> None:
         """
         Initialize the TTS converter.
@@ -24,10 +32,18 @@ class TextToSpeechConverter:
             model: The TTS model to use
             voice: The voice type for speech synthesis
             api_key: Optional API key (uses environment variable if not provided)
+            base_url: Optional alternative API endpoint, e.g. a local mock server
         """
         self.model = model
         self.voice = voice
-        self.client = OpenAI(api_key=api_key)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Client shared by the async methods of the running event loop."""
+        return shared_async_client(self.api_key, self.base_url)
 
     def generate_speech(
         self,
@@ -58,14 +74,127 @@ class TextToSpeechConverter:
         # Create parent directories if needed
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
+        with open(output_path, "wb") as f:
+            for chunk in self.stream_speech(text):
+                f.write(chunk)
+        return output_path
+
+    def stream_speech(
+        self,
+        text: str,
+        response_format: str = "mp3",
+        chunk_size: int = 4096
+    ) -> Iterator[bytes]:
+        """
+        Convert text to speech and yield the audio as it arrives.
+
+        Args:
+            text: Text to convert to speech
+            response_format: Audio format requested from the API
+            chunk_size: Size of the yielded chunks in bytes
+
+        Yields:
+            Chunks of encoded audio
+
+        Raises:
+            ValueError: If text is empty
+            RuntimeError: If speech generation fails
+        """
+        if not text:
+            raise ValueError("Input text cannot be empty")
+
+        try:
+            with span("tts", chars=len(text)) as stats, \
+                    self.client.audio.speech.with_streaming_response.create(
+                        model=self.model,
+                        voice=self.voice,
+                        input=text,
+                        response_format=response_format,
+                    ) as response:
+                stats["bytes"] = 0
+                for chunk in response.iter_bytes(chunk_size):
+                    if not stats["bytes"]:
+                        mark("tts.first_byte")
+                    stats["bytes"] += len(chunk)
+                    yield chunk
+        except Exception as e:
+            raise RuntimeError(f"Speech generation error: {str(e)}") from e
+
+    async def generate_speech_async(
+        self,
+        text: str,
+        output_path: Union[str, Path]
+    ) -> Path:
+        """
+        Convert text to speech and save to file without blocking the event loop.
+
+        Args:
+            text: Text to convert to speech
+            output_path: Path to save the audio file
+
+        Returns:
+            Path object pointing to the saved file
+
+        Raises:
+            ValueError: If text is empty
+            RuntimeError: If speech generation fails
+        """
+        if not text:
+            raise ValueError("Input text cannot be empty")
+
+        output_path = Path(output_path)
+        await asyncio.to_thread(output_path.parent.mkdir, parents=True, exist_ok=True)
+
+        # Disk writes go off the event loop, they can stall on a slow or busy disk.
+        f = await asyncio.to_thread(open, output_path, "wb")
+        try:
+            async for chunk in self.stream_speech_async(text):
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        return output_path
+
+    async def stream_speech_async(
+        self,
+        text: str,
+        response_format: str = "mp3",
+        chunk_size: int = 4096
+    ) -> AsyncIterator[bytes]:
+        """
+        Convert text to speech and yield the audio as it arrives.
+
+        Cancelling the consuming task, or closing the iterator, closes the
+        connection.
+
+        Args:
+            text: Text to convert to speech
+            response_format: Audio format requested from the API
+            chunk_size: Size of the yielded chunks in bytes
+
+        Yields:
+            Chunks of encoded audio
+
+        Raises:
+            ValueError: If text is empty
+            RuntimeError: If speech generation fails
+        """
+        if not text:
+            raise ValueError("Input text cannot be empty")
+
         try:
-            with self.client.audio.speech.with_streaming_response.create(
-                model=self.model,
-                voice=self.voice,
-                input=text,
-            ) as response:
-                response.stream_to_file(str(output_path))
-            return output_path
+            with span("tts", chars=len(text)) as stats:
+                async with self.async_client.audio.speech.with_streaming_response.create(
+                        model=self.model,
+                        voice=self.voice,
+                        input=text,
+                        response_format=response_format,
+                ) as response:
+                    stats["bytes"] = 0
+                    async for chunk in response.iter_bytes(chunk_size):
+                        if not stats["bytes"]:
+                            mark("tts.first_byte")
+                        stats["bytes"] += len(chunk)
+                        yield chunk
         except Exception as e:
             raise RuntimeError(f"Speech generation error: {str(e)}") from e
 
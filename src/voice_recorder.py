@@ -9,9 +9,13 @@ from dataclasses import dataclass
 import pyaudio
 import numpy as np
 
+from tracing import span
+from capture import CaptureConfig, CaptureEngine, open_converter
+from resample import FormatConverter
+
 
 @dataclass
-class RecorderConfig:
+class RecorderConfig:  # pylint: disable=too-many-instance-attributes
     """Configuration for voice recorder."""
     channels: int = 1
     rate: int = 16000
@@ -20,6 +24,37 @@ class RecorderConfig:
     threshold: float = 0.01
     silence_timeout: float = 2.0
     output_file: str = "recording.wav"
+    persistent: bool = False
+    preroll: float = 0.3
+    native_format: bool = True
+
+
+class _ConvertedStream:
+    """Blocking input stream opened at the device format, read in the recorder format."""
+
+    def __init__(self, stream, converter: FormatConverter) -> None:
+        self.stream = stream
+        self.converter = converter
+        self._ratio = converter.source_rate / converter.target_rate
+        self._owed = 0.0
+
+    def read(self, num_frames: int, exception_on_overflow: bool = False) -> bytes:
+        """Read about num_frames frames, converted."""
+        # Carry the fractional part so the average rate stays exact.
+        self._owed += num_frames * self._ratio
+        frames = int(self._owed)
+        self._owed -= frames
+        return self.converter.convert(
+            self.stream.read(frames, exception_on_overflow=exception_on_overflow)
+        )
+
+    def stop_stream(self) -> None:
+        """Stop the underlying stream."""
+        self.stream.stop_stream()
+
+    def close(self) -> None:
+        """Close the underlying stream."""
+        self.stream.close()
 
 
 class VoiceRecorder:
@@ -35,6 +70,52 @@ class VoiceRecorder:
         self.config = config
         self.audio = pyaudio.PyAudio()
         self._stop_recording = threading.Event()
+        self.capture = None
+        if config.persistent:
+            self.ensure_capture()
+
+    def ensure_capture(self) -> CaptureEngine:
+        """Switch to a persistent capture engine if not already using one."""
+        if self.capture is None:
+            self.capture = CaptureEngine(CaptureConfig(
+                channels=self.config.channels,
+                rate=self.config.rate,
+                format=self.config.format,
+                preroll=self.config.preroll,
+                native_format=self.config.native_format
+            ), self.audio)
+        self.capture.start()
+        return self.capture
+
+    def release_capture(self) -> None:
+        """Close a capture engine opened on demand; a configured persistent one stays."""
+        if self.capture is not None and not self.config.persistent:
+            self.capture.stop()
+            self.capture = None
+
+    def _open_stream(self):
+        """
+        Open a source of audio chunks.
+
+        With a persistent capture engine this is a reader that starts with
+        the pre-roll; otherwise a new blocking input stream, opened at the
+        native format of the device and converted to the configured one.
+        """
+        if self.capture is not None:
+            return self.capture.reader()
+        rate, channels, converter = self.config.rate, self.config.channels, None
+        if self.config.native_format:
+            rate, channels, converter = open_converter(
+                self.audio, self.config.rate, self.config.channels, self.config.format
+            )
+        stream = self.audio.open(
+            format=self.config.format,
+            channels=channels,
+            rate=rate,
+            input=True,
+            frames_per_buffer=self.config.chunk * rate // self.config.rate
+        )
+        return stream if converter is None else _ConvertedStream(stream, converter)
 
     def record_until_silence(self) -> str:
         """
@@ -44,49 +125,49 @@ class VoiceRecorder:
             Path to the recorded audio file.
         """
         frames = []
+        self._stop_recording.clear()
 
-        stream = self.audio.open(
-            format=self.config.format,
-            channels=self.config.channels,
-            rate=self.config.rate,
-            input=True,
-            frames_per_buffer=self.config.chunk
-        )
-
-        silence_counter = 0
-        is_speaking = False
+        stream = self._open_stream()
 
         print("Recording started - waiting for voice...")
 
         try:
-            while not self._stop_recording.is_set():
-                data = stream.read(self.config.chunk, exception_on_overflow=False)
-                frames.append(data)
-
-                audio_data = np.frombuffer(data, dtype=np.int16)
-                volume = np.abs(audio_data).mean() / 32768.0
-
-                if volume > self.config.threshold:
-                    silence_counter = 0
-                    if not is_speaking:
-                        is_speaking = True
-                        print("Voice detected - recording...")
-                else:
-                    if is_speaking:
-                        silence_counter += 1
-                        # Calculate silence threshold in frames
-                        silence_threshold = int(
-                            self.config.silence_timeout * self.config.rate / self.config.chunk
-                        )
-                        if silence_counter > silence_threshold:
-                            break
-
+            with span("capture") as stats:
+                self._read_until_silence(stream, frames)
+                stats["bytes"] = sum(len(frame) for frame in frames)
         finally:
             stream.stop_stream()
             stream.close()
 
         return self._save_recording(frames)
 
+    def _read_until_silence(self, stream, frames) -> None:
+        """Read chunks into frames until the speaker goes quiet."""
+        silence_counter = 0
+        is_speaking = False
+
+        while not self._stop_recording.is_set():
+            data = stream.read(self.config.chunk, exception_on_overflow=False)
+            frames.append(data)
+
+            audio_data = np.frombuffer(data, dtype=np.int16)
+            volume = np.abs(audio_data).mean() / 32768.0
+
+            if volume > self.config.threshold:
+                silence_counter = 0
+                if not is_speaking:
+                    is_speaking = True
+                    print("Voice detected - recording...")
+            else:
+                if is_speaking:
+                    silence_counter += 1
+                    # Calculate silence threshold in frames
+                    silence_threshold = int(
+                        self.config.silence_timeout * self.config.rate / self.config.chunk
+                    )
+                    if silence_counter > silence_threshold:
+                        break
+
     def record_continuously(self) -> str:
         """
         Record audio continuously until explicitly stopped.
@@ -97,20 +178,16 @@ class VoiceRecorder:
         frames = []
         self._stop_recording.clear()
 
-        stream = self.audio.open(
-            format=self.config.format,
-            channels=self.config.channels,
-            rate=self.config.rate,
-            input=True,
-            frames_per_buffer=self.config.chunk
-        )
+        stream = self._open_stream()
 
         print("Recording started...")
 
         try:
-            while not self._stop_recording.is_set():
-                data = stream.read(self.config.chunk, exception_on_overflow=False)
-                frames.append(data)
+            with span("capture") as stats:
+                while not self._stop_recording.is_set():
+                    data = stream.read(self.config.chunk, exception_on_overflow=False)
+                    frames.append(data)
+                stats["bytes"] = sum(len(frame) for frame in frames)
 
         finally:
             stream.stop_stream()
@@ -127,11 +204,13 @@ class VoiceRecorder:
         output_path = Path(self.config.output_file)
 
         # pylint: disable=no-member
-        with wave.open(str(output_path), 'wb') as wf:
+        with span("encode") as stats, wave.open(str(output_path), 'wb') as wf:
             wf.setnchannels(self.config.channels)
             wf.setsampwidth(self.audio.get_sample_size(self.config.format))
             wf.setframerate(self.config.rate)
-            wf.writeframes(b''.join(frames))
+            data = b''.join(frames)
+            wf.writeframes(data)
+            stats["bytes"] = len(data)
         # pylint: enable=no-member
 
         print(f"Recording saved to {output_path}")
@@ -139,4 +218,6 @@ class VoiceRecorder:
 
     def __del__(self) -> None:
         """Clean up resources."""
+        if self.capture is not None:
+            self.capture.stop()
         self.audio.terminate()
@@ -0,0 +1,148 @@
+"""Concurrent and cancellable requests of the async API wrappers."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import mock_openai_server
+import tts
+from async_clients import close_async_clients
+from mock_openai_server import MockOpenAIServer, MockServerConfig
+from text_generator import Message, TextGenerator
+
+QUESTION = [Message(role="user", content="Quelle est la version du noyau ?")]
+
+
+@pytest.fixture(name="requests")
+def fixture_requests(monkeypatch):
+    """Chat requests the mock server is handling, finished and aborted."""
+    state = {"now": 0, "peak": 0, "finished": 0, "aborted": 0}
+    lock = threading.Lock()
+    # pylint: disable=protected-access
+    chat = mock_openai_server._MockHandler._chat
+
+    def counted(handler, request):
+        with lock:
+            state["now"] += 1
+            state["peak"] = max(state["peak"], state["now"])
+        try:
+            chat(handler, request)
+            state["finished"] += 1
+        except (BrokenPipeError, ConnectionResetError):
+            state["aborted"] += 1
+            raise
+        finally:
+            with lock:
+                state["now"] -= 1
+
+    monkeypatch.setattr(mock_openai_server._MockHandler, "_chat", counted)
+    return state
+
+
+def test_requests_are_in_flight_together_on_one_thread(requests):
+    """N completions overlap without a thread per request on the client."""
+    count = 16
+    config = MockServerConfig(first_token_latency=0.5, tokens_per_second=1000.0)
+
+    async def run(generator):
+        try:
+            return await asyncio.gather(*(generator.generate_async(QUESTION)
+                                          for _ in range(count)))
+        finally:
+            await close_async_clients()
+
+    with MockOpenAIServer(config) as server:
+        generator = TextGenerator(api_key="sk-test", base_url=server.base_url)
+        before = {thread.ident for thread in threading.enumerate()}
+        start = time.perf_counter()
+        replies = asyncio.run(run(generator))
+        elapsed = time.perf_counter() - start
+        # The server handles each request on its own thread.
+        started = [thread for thread in threading.enumerate()
+                   if thread.ident not in before and "process_request" not in thread.name]
+
+    assert replies == [config.reply] * count
+    assert requests["peak"] == count
+    assert elapsed < count * config.first_token_latency / 4
+    assert not started
+
+
+def test_cancelling_a_stream_aborts_the_request(requests):
+    """The connection is closed, the server stops generating."""
+    config = MockServerConfig(first_token_latency=0.0, tokens_per_second=5.0)
+
+    async def first_fragment_then_cancel(generator):
+        fragments = []
+
+        async def consume():
+            async for fragment in generator.stream_async(QUESTION):
+                fragments.append(fragment)
+
+        task = asyncio.create_task(consume())
+        while not fragments:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await close_async_clients()
+        return fragments
+
+    with MockOpenAIServer(config) as server:
+        generator = TextGenerator(api_key="sk-test", base_url=server.base_url)
+        start = time.perf_counter()
+        fragments = asyncio.run(first_fragment_then_cancel(generator))
+        while not requests["aborted"] and time.perf_counter() - start < 3.0:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+    assert fragments and "".join(fragments) != config.reply
+    assert (requests["aborted"], requests["finished"]) == (1, 0)
+    # The whole reply takes about 3.4 s at this rate.
+    assert elapsed < 2.0
+
+
+def test_speech_is_written_off_the_event_loop(tmp_path, monkeypatch):
+    """Opening, writing and closing the file never run on the loop thread."""
+    config = MockServerConfig(speech_first_byte_latency=0.0,
+                              speech_bytes_per_second=2_000_000.0)
+    threads = set()
+
+    class RecordingFile:
+        """A file recording the threads it is used from."""
+
+        def __init__(self, path, mode):
+            threads.add(threading.get_ident())
+            self.file = open(path, mode)  # pylint: disable=consider-using-with,unspecified-encoding
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            self.close()
+
+        def write(self, data):
+            """Write and record the thread."""
+            threads.add(threading.get_ident())
+            return self.file.write(data)
+
+        def close(self):
+            """Close and record the thread."""
+            threads.add(threading.get_ident())
+            self.file.close()
+
+    monkeypatch.setattr(tts, "open", RecordingFile, raising=False)
+
+    async def run(converter):
+        try:
+            return await converter.generate_speech_async("Bonjour " * 10,
+                                                         tmp_path / "a" / "r.mp3")
+        finally:
+            await close_async_clients()
+
+    with MockOpenAIServer(config) as server:
+        converter = tts.TextToSpeechConverter(api_key="sk-test", base_url=server.base_url)
+        path = asyncio.run(run(converter))
+
+    assert path.stat().st_size > 0
+    assert threads and threading.get_ident() not in threads
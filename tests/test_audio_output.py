@@ -0,0 +1,99 @@
+"""Playback engine underrun accounting and start callbacks."""
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+import audio_output
+from audio_output import PlaybackConfig, PlaybackEngine
+
+RATE = 24000
+BLOCK = 480
+
+
+class _Device:
+    """Stands in for sounddevice.RawOutputStream, pulling blocks at real time."""
+
+    def __init__(self, callback, **_options) -> None:
+        self._callback = callback
+        self._running = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        """Start pulling blocks."""
+        self._running.set()
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop pulling blocks."""
+        self._running.clear()
+        self._thread.join()
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+    def _run(self) -> None:
+        status = sd.CallbackFlags()
+        buffer = bytearray(BLOCK * 2)
+        while self._running.is_set():
+            self._callback(buffer, BLOCK, None, status)
+            time.sleep(BLOCK / RATE)
+
+
+def _tone(seconds: float) -> bytes:
+    samples = 3000 * np.sin(2 * np.pi * 220 * np.arange(int(seconds * RATE)) / RATE)
+    return samples.astype(np.int16).tobytes()
+
+
+def _play(monkeypatch, chunks) -> PlaybackEngine:
+    """Play one clip on the fake device and wait until it is fed and heard."""
+    monkeypatch.setattr(audio_output.sd, "RawOutputStream", _Device)
+    engine = PlaybackEngine(PlaybackConfig(rate=RATE, blocksize=BLOCK))
+    started = threading.Event()
+    try:
+        engine.play(chunks, on_start=started.set)
+        deadline = time.monotonic() + 10
+        while engine.clips_played < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert started.wait(5)
+    finally:
+        engine.close()
+    return engine
+
+
+def test_first_chunk_latency_is_not_an_underrun(monkeypatch):
+    """Waiting for the speech engine's first byte leaves the device idle, not starved."""
+    def delayed():
+        time.sleep(0.4)
+        pcm = _tone(0.5)
+        for offset in range(0, len(pcm), 4800):
+            yield pcm[offset:offset + 4800]
+
+    assert _play(monkeypatch, delayed()).underruns == 0
+
+
+def test_starving_clip_counts_underruns(monkeypatch):
+    """A clip whose chunks arrive slower than real time underruns."""
+    def slow():
+        pcm = _tone(0.05)
+        for _ in range(4):
+            yield pcm
+            time.sleep(0.15)
+
+    assert _play(monkeypatch, slow()).underruns > 0
+
+
+def test_start_callback_runs_off_the_audio_thread(monkeypatch):
+    """on_start never runs in the device callback."""
+    threads = []
+    monkeypatch.setattr(audio_output.sd, "RawOutputStream", _Device)
+    engine = PlaybackEngine(PlaybackConfig(rate=RATE, blocksize=BLOCK))
+    done = threading.Event()
+    try:
+        engine.play([_tone(0.1)], on_start=lambda: (threads.append(
+            threading.current_thread().name), done.set()))
+        assert done.wait(5)
+    finally:
+        engine.close()
+    assert threads == ["playback-events"]
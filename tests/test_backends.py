@@ -0,0 +1,119 @@
+"""Backend registry, the OpenAI chat model and Piper."""
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from backends import (BackendConfig, ChatModel, ChatReply, FakeChatModel, OpenAIChatModel,
+                      available, create_backend)
+from mock_openai_server import MockOpenAIServer, MockServerConfig
+from tts import PCM_RATE
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    """A mock API answering at once."""
+    config = MockServerConfig(first_token_latency=0.0, tokens_per_second=10000.0)
+    with MockOpenAIServer(config) as server:
+        yield server
+
+
+def test_every_kind_has_a_fake_and_an_openai_engine():
+    """The defaults and the offline engines are registered."""
+    for kind in ("stt", "tts", "llm"):
+        assert {"fake", "openai"} <= set(available(kind))
+
+
+def test_unknown_engine_names_the_available_ones():
+    """A typo in the configuration is reported with the choices."""
+    with pytest.raises(ValueError, match="available: .*fake"):
+        create_backend("llm", BackendConfig(llm="gpt"))
+
+
+def test_defaults_only_reach_the_engines_accepting_them():
+    """Shared settings are filtered, the configured options win."""
+    config = BackendConfig(llm="fake", options={"llm": {"reply": "Bonjour"}})
+    model = create_backend("llm", config, api_key="sk-test", model="gpt-4o-mini")
+
+    assert isinstance(model, FakeChatModel)
+    assert isinstance(model, ChatModel)
+    assert model.complete([{"role": "user", "content": "Salut"}]) == ChatReply("Bonjour")
+
+
+def test_configuration_file_and_environment(tmp_path, monkeypatch):
+    """Options come from the file, engine names from the environment first."""
+    path = tmp_path / "backends.json"
+    path.write_text('{"stt": "fake", "llm": {"name": "fake", "reply": "Oui"}}',
+                    encoding="utf-8")
+    monkeypatch.setenv("HERMINE_BACKENDS", str(path))
+    monkeypatch.setenv("HERMINE_STT", "openai")
+
+    config = BackendConfig.from_environment()
+
+    assert (config.stt, config.tts, config.llm) == ("openai", "openai", "fake")
+    assert config.options == {"llm": {"reply": "Oui"}}
+
+
+def test_openai_chat_model_goes_through_the_cache(server):
+    """Repeated questions are answered by the response cache."""
+    config = BackendConfig(options={"llm": {"cache": True}})
+    model = create_backend("llm", config, api_key="sk-test", base_url=server.base_url)
+    messages = [{"role": "user", "content": "Quelle version ?"}]
+
+    first = model.complete(messages)
+    second = model.complete(messages)
+
+    assert first.content == server.config.reply
+    assert second == first
+    assert model.generator.cache.stats.hits == 1
+    assert "".join(model.stream(messages)) == server.config.reply
+
+
+def test_openai_chat_model_reports_failures_as_an_empty_reply(capsys):
+    """An unreachable API does not raise into the pipeline."""
+    model = OpenAIChatModel(api_key="sk-test", base_url="http://127.0.0.1:9/v1")
+    model.generator.client = model.generator.client.with_options(max_retries=0)
+
+    assert model.complete([{"role": "user", "content": "Bonjour"}]) == ChatReply("")
+    assert "Error generating text" in capsys.readouterr().out
+
+
+def test_openai_chat_model_without_choices(monkeypatch):
+    """A completion without any choice is an empty reply, not an IndexError."""
+    model = OpenAIChatModel(api_key="sk-test")
+    empty = SimpleNamespace(choices=[], usage=None)
+    monkeypatch.setattr(model.generator.client.chat.completions, "create",
+                        lambda **_: empty)
+
+    assert model.complete([{"role": "user", "content": "Bonjour"}]) == ChatReply("")
+
+
+def test_piper_without_a_voice_is_a_configuration_error():
+    """A missing required option is named instead of raising a TypeError."""
+    with pytest.raises(ValueError, match="piper tts backend needs the 'model' option"):
+        create_backend("tts", BackendConfig(tts="piper"), api_key="sk-test")
+
+
+def test_piper_output_is_resampled(tmp_path):
+    """Piper's 22.05 kHz output reaches PCM_RATE with its pitch intact."""
+    piper = tmp_path / "piper"
+    piper.write_text(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        "import numpy as np\n"
+        "sys.stdin.read()\n"
+        "t = np.arange(22050) / 22050\n"
+        "tone = 8000 * np.sin(2 * np.pi * 440 * t)\n"
+        "sys.stdout.buffer.write(tone.astype(np.int16).tobytes())\n",
+        encoding="utf-8")
+    piper.chmod(0o755)
+    config = BackendConfig(tts="piper", options={"tts": {
+        "model": str(tmp_path / "voice.onnx"), "executable": str(piper), "chunk_size": 1001}})
+
+    pcm = create_backend("tts", config).synthesize("Bonjour")
+
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float64)
+    assert abs(len(samples) - PCM_RATE) <= 32
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    assert abs(np.argmax(spectrum) * PCM_RATE / len(samples) - 440) < 2
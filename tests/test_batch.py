@@ -0,0 +1,143 @@
+"""Batch processing within the rate limits."""
+import asyncio
+import json
+import time
+
+import httpx
+import openai
+import pytest
+
+from batch import BatchCheckpoint, BatchConfig, BatchRunner, RateLimiter, item_key, parse_duration
+
+REQUEST = httpx.Request("POST", "http://127.0.0.1/v1/chat/completions")
+
+
+def _rate_limited(retry_after_ms: int) -> openai.RateLimitError:
+    """A 429 as raised by the OpenAI client."""
+    response = httpx.Response(429, request=REQUEST, headers={
+        "retry-after-ms": str(retry_after_ms),
+        "x-ratelimit-limit-requests": "600",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "100ms",
+    })
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def _runner(**options) -> BatchRunner:
+    """A runner with short backoffs."""
+    return BatchRunner(BatchConfig(backoff=0.01, max_backoff=0.05, **options))
+
+
+def test_parse_duration():
+    """Reset durations use the units of the x-ratelimit headers."""
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("soon") is None
+    assert parse_duration(None) is None
+
+
+def test_transient_errors_are_retried_after_the_requested_delay(capsys):
+    """A 429 is retried no sooner than Retry-After, results keep input order."""
+    attempts = {}
+
+    async def worker(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 2 and attempts[item] == 1:
+            raise _rate_limited(200)
+        if item == 3 and attempts[item] < 3:
+            raise openai.APIConnectionError(request=REQUEST)
+        await asyncio.sleep(0.01 * (5 - item))
+        return item * 10, {}, None
+
+    start = time.monotonic()
+    results = asyncio.run(_runner(concurrency=5).run(range(5), worker))
+
+    assert results == [0, 10, 20, 30, 40]
+    assert attempts == {0: 1, 1: 1, 2: 2, 3: 3, 4: 1}
+    assert time.monotonic() - start >= 0.2
+    assert capsys.readouterr().out == ""
+
+
+def test_failures_give_none_without_stopping_the_batch(capsys):
+    """Items failing for good, or with a non transient error, are None."""
+    attempts = {}
+
+    async def worker(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == "timeout":
+            raise openai.APIConnectionError(request=REQUEST)
+        if item == "invalid":
+            raise ValueError("Transcription error")
+        return item.upper(), {}, None
+
+    results = asyncio.run(_runner(max_retries=2).run(["a", "timeout", "invalid", "b"], worker))
+
+    assert results == ["A", None, None, "B"]
+    assert attempts["timeout"] == 3 and attempts["invalid"] == 1
+    output = capsys.readouterr().out
+    assert "after 3 attempts" in output and "Transcription error" in output
+
+
+def test_checkpoint_resumes_where_the_batch_stopped(tmp_path):
+    """Finished items are not processed again, failed ones are."""
+    checkpoint = tmp_path / "batch.jsonl"
+    processed = []
+
+    async def flaky(item):
+        processed.append(item)
+        if item % 2:
+            raise ValueError("failed")
+        return item * 10, {}, None
+
+    first = asyncio.run(_runner().run(range(6), flaky, checkpoint=checkpoint))
+    assert first == [0, None, 20, None, 40, None]
+    # A crash while appending leaves a partial last line.
+    with open(checkpoint, "a", encoding="utf-8") as f:
+        f.write('{"index": 1, "key": ')
+
+    processed.clear()
+
+    async def working(item):
+        processed.append(item)
+        return item * 10, {}, None
+
+    second = asyncio.run(_runner().run(range(6), working, checkpoint=checkpoint))
+
+    assert second == [0, 10, 20, 30, 40, 50]
+    assert sorted(processed) == [1, 3, 5]
+
+    processed.clear()
+    assert asyncio.run(_runner().run(range(6), working, checkpoint=checkpoint)) == second
+    assert not processed
+
+
+def test_checkpoint_entries_only_match_the_same_input(tmp_path):
+    """An index whose input changed since the checkpoint is processed again."""
+    store = BatchCheckpoint(tmp_path / "batch.jsonl")
+    store.record(0, item_key("old.wav"), "ancien")
+    store.record(1, item_key("same.wav"), "pareil")
+
+    done = store.load([item_key("new.wav"), item_key("same.wav")])
+
+    assert done == {1: "pareil"}
+    lines = (tmp_path / "batch.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["index"] for line in lines] == [0, 1]
+    store.remove()
+    assert not (tmp_path / "batch.jsonl").exists()
+
+
+def test_limiter_follows_the_response_headers():
+    """The request bucket is sized from the headers and an exhausted one pauses."""
+    limiter = RateLimiter()
+    limiter.update({"x-ratelimit-limit-requests": "600",
+                    "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": "150ms"})
+
+    async def acquire():
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert limiter.requests.capacity == 600
+    assert asyncio.run(acquire()) >= 0.15
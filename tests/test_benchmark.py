@@ -0,0 +1,32 @@
+"""End-to-end latency benchmark."""
+from benchmark import PipelineBenchmark, synthesize_fixture
+from backends import BackendConfig
+from mock_openai_server import MockOpenAIServer, MockServerConfig
+
+
+def test_offline_turns_are_timed_from_the_pipeline_traces(tmp_path):
+    """Each stage of a fake turn ends after its simulated latency."""
+    backends = BackendConfig(stt="fake", tts="fake", llm="fake", options={
+        "stt": {"latency": 0.1}, "llm": {"latency": 0.1}, "tts": {"latency": 0.1}})
+    benchmark = PipelineBenchmark(backends=backends)
+
+    report = benchmark.run([synthesize_fixture(tmp_path / "fixture.wav", 0.2)], turns=2)
+
+    for timing in report.turns:
+        assert 0.1 <= timing.time_to_transcript < timing.time_to_first_token
+        assert timing.time_to_first_token + 0.1 <= timing.time_to_first_audio
+        assert timing.time_to_first_audio <= timing.turn_total < 1.0
+
+
+def test_turns_against_the_mock_server(tmp_path):
+    """The OpenAI engines are benchmarked through the whole pipeline."""
+    config = MockServerConfig(transcription_latency=0.05, first_token_latency=0.1,
+                              tokens_per_second=1000.0, speech_first_byte_latency=0.05,
+                              speech_bytes_per_second=10_000_000.0)
+    with MockOpenAIServer(config) as server:
+        benchmark = PipelineBenchmark(server.base_url)
+        timing = benchmark.run_turn(synthesize_fixture(tmp_path / "fixture.wav", 0.2))
+
+    assert 0.05 <= timing.time_to_transcript
+    assert timing.time_to_transcript + 0.1 <= timing.time_to_first_token
+    assert timing.time_to_first_token + 0.05 <= timing.time_to_first_audio <= timing.turn_total
@@ -0,0 +1,159 @@
+"""Always-open microphone capture."""
+import threading
+import time
+
+import numpy as np
+import pyaudio
+import pytest
+
+from capture import CaptureConfig, CaptureEngine
+
+RATE = 16000
+CHUNK = 512
+
+
+class _Stream:
+    """Input stream whose callback the test calls in place of PortAudio."""
+
+    def __init__(self, **options):
+        self.options = options
+
+    def start_stream(self):
+        """Nothing to start, the test feeds the callback."""
+
+    def stop_stream(self):
+        """Nothing to stop."""
+
+    def close(self):
+        """Nothing to release."""
+
+
+class _Audio:
+    """PyAudio with one input device of a given native format."""
+
+    def __init__(self, rate=RATE, channels=1):
+        self.info = {"defaultSampleRate": float(rate), "maxInputChannels": channels}
+        self.stream = None
+
+    def get_sample_size(self, _):
+        """16-bit samples."""
+        return 2
+
+    def get_default_input_device_info(self):
+        """The native format of the device."""
+        return self.info
+
+    def open(self, **options):
+        """Open the fake input stream."""
+        self.stream = _Stream(**options)
+        return self.stream
+
+    def terminate(self):
+        """Nothing to release."""
+
+
+def _capture(engine, samples, status=0):
+    """Deliver samples to the engine as PortAudio would, a buffer at a time."""
+    callback = engine._stream.options["stream_callback"]  # pylint: disable=protected-access
+    channels = engine._stream.options["channels"]  # pylint: disable=protected-access
+    step = engine._stream.options["frames_per_buffer"] * channels  # pylint: disable=protected-access
+    for offset in range(0, len(samples), step):
+        block = samples[offset:offset + step]
+        assert callback(block.astype(np.int16).tobytes(), len(block) // channels,
+                        {}, status) == (None, pyaudio.paContinue)
+
+
+def _engine(**options):
+    """A started engine on a 16 kHz mono device."""
+    engine = CaptureEngine(CaptureConfig(rate=RATE, chunk=CHUNK, **options), _Audio())
+    engine.start()
+    return engine
+
+
+def test_reader_starts_with_the_preroll():
+    """A new reader gets the last moments before it was created, then what follows."""
+    engine = _engine(preroll=0.1)
+    ramp = np.arange(RATE) % 30000
+    _capture(engine, ramp[:RATE // 2])
+
+    reader = engine.reader()
+    _capture(engine, ramp[RATE // 2:])
+    data = np.frombuffer(reader.read(RATE // 10 + CHUNK), dtype=np.int16)
+
+    start = RATE // 2 - RATE // 10
+    assert np.array_equal(data, ramp[start:start + len(data)])
+
+
+def test_reads_wrap_around_the_ring():
+    """Audio crossing the end of the ring comes back in order."""
+    engine = _engine(buffer_seconds=0.1, preroll=0.0)
+    reader = engine.reader()
+    samples = (np.arange(CHUNK * 32) * 7) % 30000
+    read = []
+    for offset in range(0, len(samples), CHUNK * 2):
+        _capture(engine, samples[offset:offset + CHUNK * 2])
+        read.append(np.frombuffer(reader.read(CHUNK * 2), dtype=np.int16))
+
+    assert np.array_equal(np.concatenate(read), samples)
+    assert reader.overruns == 0
+
+
+def test_a_reader_left_behind_skips_to_buffered_audio():
+    """Falling more than a ring behind is counted and skips ahead."""
+    engine = _engine(buffer_seconds=0.1, preroll=0.0)
+    reader = engine.reader()
+    samples = np.arange(RATE // 2) % 30000
+    _capture(engine, samples)
+
+    data = np.frombuffer(reader.read(CHUNK), dtype=np.int16)
+
+    assert reader.overruns == 1
+    # What is returned is still in the ring, and newer than what was lost.
+    oldest = len(samples) - int(0.1 * RATE)
+    assert data[0] >= samples[oldest]
+    assert np.array_equal(data, samples[data[0]:data[0] + CHUNK])
+
+    strict = engine.reader(preroll=0.0)
+    _capture(engine, samples)
+    with pytest.raises(OSError, match="overrun"):
+        strict.read(CHUNK, exception_on_overflow=True)
+
+
+def test_input_overflows_are_counted():
+    """Buffers PortAudio dropped are reported by the stream status."""
+    engine = _engine()
+    _capture(engine, np.zeros(CHUNK * 3), status=pyaudio.paInputOverflow)
+    assert engine.overflows == 3
+
+
+def test_blocked_reader_wakes_up_on_audio_and_on_stop():
+    """Readers wait for data without polling and fail once the engine stops."""
+    engine = _engine(preroll=0.0)
+    reader = engine.reader()
+    feeder = threading.Timer(0.1, _capture, (engine, np.ones(CHUNK)))
+    feeder.start()
+    start = time.perf_counter()
+    assert len(reader.read(CHUNK)) == CHUNK * 2
+    assert time.perf_counter() - start < 0.4
+    feeder.join()
+
+    threading.Timer(0.1, engine.stop).start()
+    with pytest.raises(OSError, match="stopped"):
+        reader.read(CHUNK)
+
+
+def test_native_stereo_device_is_converted():
+    """A 48 kHz stereo microphone is opened as is and stored as 16 kHz mono."""
+    audio = _Audio(rate=48000, channels=2)
+    engine = CaptureEngine(CaptureConfig(rate=RATE, chunk=CHUNK, preroll=0.0), audio)
+    engine.start()
+    reader = engine.reader()
+    assert (audio.stream.options["rate"], audio.stream.options["channels"]) == (48000, 2)
+
+    t = np.arange(48000) / 48000
+    tone = 8000 * np.sin(2 * np.pi * 440 * t)
+    _capture(engine, np.repeat(tone, 2))
+    data = np.frombuffer(reader.read(RATE // 2), dtype=np.int16).astype(np.float64)
+
+    spectrum = np.abs(np.fft.rfft(data * np.hanning(len(data))))
+    assert abs(np.argmax(spectrum) * RATE / len(data) - 440) < 4
@@ -0,0 +1,68 @@
+"""Conversation history limit (HERMINE_HISTORY_LIMIT)."""
+from journal import SessionJournal
+from pipeline import Conversation
+
+
+def _exchange(conversation: Conversation, index: int, tool: bool = False) -> None:
+    """Add a question, optionally a tool result, and the reply."""
+    conversation.add({"role": "user", "content": f"question {index}"})
+    if tool:
+        conversation.add({"role": "function", "name": "take_screenshot",
+                          "content": f"screenshot {index}"})
+    conversation.add({"role": "assistant", "content": f"reply {index}"})
+    conversation.trim()
+
+
+def test_keeps_the_latest_messages_after_the_system_prompt():
+    """Older turns are dropped, the system prompt stays."""
+    conversation = Conversation(max_messages=6)
+    system = conversation.messages[0]
+    for index in range(10):
+        _exchange(conversation, index)
+
+    assert conversation.messages[0] is system
+    assert [m["content"] for m in conversation.messages[1:]] == [
+        "question 7", "reply 7", "question 8", "reply 8", "question 9", "reply 9"
+    ]
+
+
+def test_cuts_at_a_question():
+    """The history never starts with a reply or a tool result."""
+    conversation = Conversation(max_messages=5)
+    for index in range(6):
+        _exchange(conversation, index, tool=index % 2 == 0)
+
+    history = conversation.messages[1:]
+    assert len(history) <= 5
+    assert history[0]["role"] == "user"
+    # No tool result is left without the question that asked for it.
+    for position, message in enumerate(history):
+        if message["role"] == "function":
+            assert history[position - 1]["role"] == "user"
+
+
+def test_zero_keeps_the_whole_history():
+    """A limit of 0 disables trimming."""
+    conversation = Conversation(max_messages=0)
+    for index in range(100):
+        _exchange(conversation, index)
+
+    assert len(conversation.messages) == 201
+
+
+def test_resume_loads_the_limit_from_a_question(tmp_path):
+    """A restarted session loads its tail, starting at a question."""
+    journal = SessionJournal(tmp_path / "journal.sqlite3")
+    conversation = Conversation(journal=journal, session="test", max_messages=0)
+    for index in range(40):
+        _exchange(conversation, index, tool=True)
+
+    resumed = Conversation.resume(journal, "test")
+    everything = journal.tail("test", limit=-1)
+    journal.close()
+
+    history = resumed.messages[1:]
+    assert len(everything) == 120
+    assert len(history) <= resumed.max_messages
+    assert history[0]["role"] == "user"
+    assert history[-1] == everything[-1]
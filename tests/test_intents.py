@@ -0,0 +1,89 @@
+"""Local intent fast path and its confirmation cache."""
+import pytest
+
+from embeddings import HashingEmbedder
+from intents import CONFIRMATIONS, ConfirmationCache, IntentMatcher
+from pipeline import TOOLS
+
+
+@pytest.fixture(name="matcher")
+def fixture_matcher():
+    """The built-in grammar over the pipeline's tools."""
+    return IntentMatcher(TOOLS)
+
+
+@pytest.mark.parametrize("transcript, name", [
+    ("Verrouille l'écran.", "lock_session"),
+    ("Peux-tu verrouiller la session s'il te plaît ?", "lock_session"),
+    ("Lock the screen please", "lock_session"),
+    ("Fais une capture d'écran", "take_screenshot"),
+    ("Take a screenshot.", "take_screenshot"),
+    ("Quelle est la version du noyau ?", None),
+])
+def test_grammar(matcher, transcript, name):
+    """Exact phrasings are recognized, anything else goes to the model."""
+    found = matcher.match(transcript)
+    assert (found.name if found else None) == name
+    if found:
+        assert found.confidence == 1.0
+        assert found.confirmation == CONFIRMATIONS[name]
+
+
+@pytest.mark.parametrize("transcript", [
+    "Ne verrouille pas l'écran",
+    "Don't lock the screen",
+    "Do not take a screenshot",
+    "Non, fais une capture d'écran",
+])
+def test_negated_commands_go_to_the_model(matcher, transcript):
+    """A negation anywhere in the sentence disables the fast path."""
+    assert matcher.match(transcript) is None
+
+
+def test_file_searches_go_to_the_model(matcher):
+    """Only the model can present the files it found."""
+    assert matcher.match("Cherche le fichier rapport.pdf") is None
+    assert "search_file_and_get_urls" not in matcher.patterns
+
+
+def test_embeddings_only_catch_harmless_tools():
+    """Variants are matched for a screenshot, never for locking the session."""
+    matcher = IntentMatcher(TOOLS, embedder=HashingEmbedder(), threshold=0.7)
+
+    found = matcher.match("capture de l'écran")
+    assert found is not None and found.name == "take_screenshot" and found.confidence < 1.0
+    assert matcher.match("verrouillage de l'écran") is None
+
+
+def test_confirmations_are_stored_and_replayed(tmp_path):
+    """A clip is synthesized once, then read back from disk."""
+    calls = []
+
+    def synthesize(text):
+        calls.append(text)
+        yield b"\x01\x00" * 10
+        yield b"\x02\x00" * 10
+
+    cache = ConfirmationCache(tmp_path, voice="openai/tts-1/sage/24000")
+    first = b"".join(cache.stream("Session verrouillée.", synthesize))
+    replayed = b"".join(ConfirmationCache(tmp_path, voice="openai/tts-1/sage/24000")
+                        .stream("Session verrouillée.", synthesize, chunk_size=7))
+    other_voice = ConfirmationCache(tmp_path, voice="piper/siwis/22050")
+
+    assert replayed == first and calls == ["Session verrouillée."]
+    assert other_voice.get("Session verrouillée.") is None
+    assert [path.suffix for path in tmp_path.iterdir()] == [".pcm"]
+
+
+def test_an_interrupted_synthesis_is_not_stored(tmp_path):
+    """A clip cut short by a failure is never replayed."""
+    def synthesize(_):
+        yield b"\x01\x00" * 10
+        raise RuntimeError("Speech generation error")
+
+    cache = ConfirmationCache(tmp_path)
+    with pytest.raises(RuntimeError):
+        b"".join(cache.stream("Session verrouillée.", synthesize))
+
+    assert cache.get("Session verrouillée.") is None
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,124 @@
+"""Session journal: retention, purge and recovery."""
+import os
+import sqlite3
+import stat
+import time
+
+import pytest
+
+from journal import SessionJournal
+
+DAY = 86400
+
+
+@pytest.fixture(name="path")
+def fixture_path(tmp_path):
+    """Location of the journal."""
+    return tmp_path / "hermine" / "journal.sqlite3"
+
+
+def _age(path, session, days):
+    """Backdate every record of a session."""
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE records SET created = created - ? WHERE session = ?",
+                           (days * DAY, session))
+    connection.close()
+
+
+def _audio(journal, tmp_path, name, days=0.0):
+    """Keep a recording in the journal, as old as given."""
+    source = tmp_path / name
+    source.write_bytes(b"RIFF")
+    kept = journal.keep_audio(source)
+    then = time.time() - days * DAY
+    os.utime(kept, (then, then))
+    return kept
+
+
+def test_tail_starts_after_the_last_reset(path):
+    """A reset hides what came before it, the limit keeps the latest."""
+    journal = SessionJournal(path)
+    for index in range(3):
+        journal.append("window", "message", {"role": "user", "content": f"avant {index}"})
+    journal.append("window", "reset", {})
+    for index in range(5):
+        journal.append("window", "message", {"role": "user", "content": f"après {index}"})
+    journal.append("daemon", "message", {"role": "user", "content": "ailleurs"})
+
+    assert [m["content"] for m in journal.tail("window", limit=2)] == ["après 3", "après 4"]
+    assert len(journal.tail("window", limit=-1)) == 5
+    journal.close()
+
+
+def test_journal_is_private(path):
+    """The directory and the database files are readable by their owner only."""
+    journal = SessionJournal(path)
+    journal.append("window", "message", {"role": "user", "content": "secret"})
+    journal.flush()
+
+    assert stat.S_IMODE(path.parent.stat().st_mode) == 0o700
+    for suffix in ("", "-wal", "-shm"):
+        assert stat.S_IMODE(os.stat(f"{path}{suffix}").st_mode) == 0o600
+    journal.close()
+
+
+def test_old_records_and_audio_are_deleted_on_open(path, tmp_path):
+    """Retention drops what is older than the period and keeps the rest."""
+    journal = SessionJournal(path, keep_audio=True)
+    journal.append("old", "message", {"role": "user", "content": "il y a longtemps"})
+    journal.append("recent", "message", {"role": "user", "content": "hier"})
+    old_audio = _audio(journal, tmp_path, "old.wav", days=40)
+    recent_audio = _audio(journal, tmp_path, "recent.wav", days=1)
+    journal.close()
+    _age(path, "old", 40)
+    _age(path, "recent", 1)
+
+    journal = SessionJournal(path, keep_audio=True, retention_days=30)
+
+    assert journal.tail("old") == []
+    assert [m["content"] for m in journal.tail("recent")] == ["hier"]
+    assert not os.path.exists(old_audio) and os.path.exists(recent_audio)
+    assert journal.prune(0.5) == 1
+    assert journal.tail("recent") == []
+    journal.close()
+
+
+def test_purge_erases_a_session(path, tmp_path):
+    """Records and audio of the session are gone, from the files too."""
+    journal = SessionJournal(path, keep_audio=True)
+    journal.append("window", "message", {"role": "user", "content": "mot de passe hunter2"})
+    kept = _audio(journal, tmp_path, "question.wav")
+    journal.append("window", "audio", {"role": "user", "path": kept})
+    journal.append("daemon", "message", {"role": "user", "content": "autre session"})
+
+    assert journal.purge("window") == 2
+
+    assert journal.tail("window") == []
+    assert len(journal.tail("daemon")) == 1
+    assert not os.path.exists(kept)
+    for suffix in ("", "-wal"):
+        assert b"hunter2" not in open(f"{path}{suffix}", "rb").read()  # pylint: disable=consider-using-with
+    journal.close()
+
+
+def test_corrupt_journal_is_moved_aside(path, monkeypatch, capsys):
+    """A damaged database is kept for inspection and a new one is started."""
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"not a database" * 512)
+    monkeypatch.setenv("HERMINE_JOURNAL", str(path))
+
+    journal = SessionJournal.from_environment()
+
+    assert journal is not None
+    journal.append("window", "message", {"role": "user", "content": "nouveau départ"})
+    assert len(journal.tail("window")) == 1
+    journal.close()
+    aside = [p for p in path.parent.iterdir() if ".corrupt-" in p.name]
+    assert len(aside) == 1 and aside[0].read_bytes().startswith(b"not a database")
+    assert "corrupt" in capsys.readouterr().out
+
+
+def test_an_empty_setting_disables_the_journal(monkeypatch):
+    """HERMINE_JOURNAL= keeps conversations in memory only."""
+    monkeypatch.setenv("HERMINE_JOURNAL", "")
+    assert SessionJournal.from_environment() is None
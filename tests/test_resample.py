@@ -0,0 +1,64 @@
+"""Sample rate and channel conversion."""
+import numpy as np
+import pytest
+
+from resample import FormatConverter, Resampler
+
+
+def _tone(frequency, rate, channels=1, seconds=1.0):
+    """Interleaved 16-bit PCM of a sine tone."""
+    t = np.arange(int(seconds * rate)) / rate
+    signal = 8000 * np.sin(2 * np.pi * frequency * t)
+    return np.repeat(signal[:, None], channels, axis=1).astype(np.int16).tobytes()
+
+
+def _convert(converter, pcm, block):
+    """Convert PCM block by block as the capture callback does."""
+    out = b"".join(converter.convert(pcm[i:i + block]) for i in range(0, len(pcm), block))
+    return np.frombuffer(out + converter.flush(), dtype=np.int16).astype(np.float64)
+
+
+@pytest.mark.parametrize("rate, channels, target", [
+    (48000, 2, 16000), (44100, 2, 16000), (32000, 1, 16000), (8000, 1, 16000),
+    (22050, 1, 24000),
+])
+def test_a_tone_keeps_its_shape(rate, channels, target):
+    """A 1 kHz tone comes out at the target rate more than 60 dB above the error."""
+    converter = FormatConverter(rate, channels, target)
+    out = _convert(converter, _tone(1000, rate, channels), 1024 * channels * 2)
+
+    assert abs(len(out) - target) <= converter.resampler.taps
+    reference = 8000 * np.sin(2 * np.pi * 1000 / target
+                              * (np.arange(len(out)) - converter.resampler.delay))
+    core = slice(target // 10, len(out) - target // 10)
+    snr = 10 * np.log10(np.sum(reference[core] ** 2)
+                        / np.sum((out[core] - reference[core]) ** 2))
+    assert snr > 60
+
+
+@pytest.mark.parametrize("rate", [48000, 44100, 32000])
+def test_tones_above_the_output_nyquist_are_filtered(rate):
+    """An 11 kHz tone is at least 40 dB down after conversion to 16 kHz."""
+    out = _convert(FormatConverter(rate, 1, 16000), _tone(min(11000, 0.45 * rate), rate), 2048)
+
+    level = 10 * np.log10(np.mean(out[1600:-1600] ** 2) / (8000 ** 2 / 2))
+    assert level < -40
+
+
+def test_output_does_not_depend_on_the_block_size():
+    """Streaming in odd-sized blocks gives the same samples as one block."""
+    pcm = _tone(440, 44100, channels=2)
+    whole = _convert(FormatConverter(44100, 2, 16000), pcm, len(pcm))
+    streamed = _convert(FormatConverter(44100, 2, 16000), pcm, 4 * 37)
+
+    assert np.array_equal(whole, streamed)
+
+
+def test_same_rate_passes_through():
+    """No filtering at all when the rates match."""
+    resampler = Resampler(16000, 16000)
+    samples = np.arange(-100, 100, dtype=np.float32)
+
+    assert resampler.identity
+    assert np.array_equal(resampler.process(samples), samples)
+    assert len(resampler.flush()) == 0
@@ -0,0 +1,44 @@
+"""Response cache of the text generator."""
+from response_cache import CacheConfig, ResponseCache
+
+QUESTION = [{"role": "system", "content": "Hermine"},
+            {"role": "user", "content": "Quelle est la version du noyau ?"}]
+
+
+def test_the_same_question_is_answered_from_the_cache():
+    """Case and spacing do not matter, a rephrasing is a miss."""
+    cache = ResponseCache()
+    cache.put("gpt-4o-mini", QUESTION, "6.8")
+
+    assert cache.get("gpt-4o-mini", [QUESTION[0], {
+        "role": "user", "content": "quelle est  la version du NOYAU ?"}]) == "6.8"
+    assert cache.get("gpt-4o-mini", [QUESTION[0], {
+        "role": "user", "content": "Quel noyau est installé ?"}]) is None
+    assert cache.get("gpt-4o", QUESTION) is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+
+def test_tool_turns_are_never_cached():
+    """The result of a tool depends on the state of the machine."""
+    cache = ResponseCache()
+    messages = QUESTION + [{"role": "function", "name": "take_screenshot", "content": "ok"},
+                           {"role": "user", "content": "Et maintenant ?"}]
+    cache.put("gpt-4o-mini", messages, "Rien")
+
+    assert cache.get("gpt-4o-mini", messages) is None
+    assert cache.stats.skipped == 1
+    assert not cache
+
+
+def test_entries_expire_and_are_evicted():
+    """Old entries and the least recently used beyond the limit are dropped."""
+    cache = ResponseCache(CacheConfig(ttl=0.0, max_entries=1))
+    cache.put("gpt-4o-mini", QUESTION, "6.8")
+    assert cache.get("gpt-4o-mini", QUESTION) is None
+
+    cache = ResponseCache(CacheConfig(max_entries=1))
+    cache.put("gpt-4o-mini", QUESTION, "6.8")
+    cache.put("gpt-4o", QUESTION, "6.9")
+    assert len(cache) == 1
+    assert cache.get("gpt-4o-mini", QUESTION) is None
+    assert cache.stats.evictions == 1
@@ -0,0 +1,105 @@
+"""Per-turn latency tracing and metrics."""
+import contextvars
+import json
+import threading
+
+import pytest
+
+from tracing import Tracer, current_turn, mark, span, use_turn
+
+
+@pytest.fixture(name="tracer")
+def fixture_tracer(tmp_path):
+    """A tracer exporting into a temporary directory."""
+    return Tracer(tmp_path / "traces.jsonl", tmp_path / "metrics.prom")
+
+
+def test_spans_belong_to_the_current_turn(tracer, tmp_path):
+    """Stages, milestones and the turn itself are recorded under one ID."""
+    turn = tracer.start_turn()
+    with span("outside"):
+        pass
+    with use_turn(turn):
+        with span("llm.completion") as stats:
+            stats["completion_tokens"] = 12
+            with span("llm.cache", hit=False):
+                mark("llm.first_token")
+    assert current_turn() is None
+    turn.finish()
+    turn.finish()
+
+    names = [recorded.name for recorded in turn.spans]
+    assert names == ["llm.first_token", "llm.cache", "llm.completion", "turn"]
+    first_token, cache, completion, turn_span = turn.spans
+    # The inner stage runs within the stage around it.
+    assert completion.start <= cache.start
+    assert cache.start + cache.duration <= completion.start + completion.duration
+    # Milestones are measured from the start of the turn.
+    assert first_token.start == turn.started_at
+    marked = first_token.start + first_token.duration
+    assert completion.start <= marked <= cache.start + cache.duration
+    assert turn_span.start == turn.started_at
+    assert turn_span.duration >= completion.duration
+
+    lines = (tmp_path / "traces.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["turn_id"] for line in lines] == [turn.turn_id] * 4
+    assert json.loads(lines[2])["attributes"] == {"completion_tokens": 12}
+
+
+def test_spans_follow_the_turn_into_other_threads(tracer):
+    """A thread started with the caller's context records into its turn."""
+    turn = tracer.start_turn()
+    with use_turn(turn):
+        context = contextvars.copy_context()
+    worker = threading.Thread(target=context.run, args=(mark, "tts.first_byte"))
+    worker.start()
+    worker.join()
+
+    assert [recorded.name for recorded in turn.spans] == ["tts.first_byte"]
+
+
+def test_failed_stages_record_the_error(tracer):
+    """The exception propagates and its type is kept on the span."""
+    turn = tracer.start_turn()
+    with pytest.raises(TimeoutError), use_turn(turn), span("stt"):
+        raise TimeoutError
+
+    assert turn.spans[0].attributes == {"error": "TimeoutError"}
+
+
+def test_metrics(tracer, tmp_path):
+    """Durations are bucketed and counts summed per stage."""
+    turn = tracer.start_turn()
+    turn.record("tts", 0.0, 0.2, bytes=4800)
+    turn.record("tts", 0.0, 3.0, bytes=1200)
+    turn.record("playback", 0.0, 1.0, underruns=2, device="default")
+    tracer.write_metrics()
+
+    text = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    assert text == tracer.prometheus_text()
+    assert not (tmp_path / "metrics.tmp").exists()
+    lines = set(text.splitlines())
+    assert 'hermine_stage_duration_seconds_bucket{stage="tts",le="0.1"} 0' in lines
+    assert 'hermine_stage_duration_seconds_bucket{stage="tts",le="0.25"} 1' in lines
+    assert 'hermine_stage_duration_seconds_bucket{stage="tts",le="5.0"} 2' in lines
+    assert 'hermine_stage_duration_seconds_bucket{stage="tts",le="+Inf"} 2' in lines
+    assert 'hermine_stage_duration_seconds_count{stage="tts"} 2' in lines
+    assert 'hermine_stage_duration_seconds_sum{stage="tts"} 3.2' in lines
+    assert 'hermine_stage_units_total{stage="tts",unit="bytes"} 6000' in lines
+    assert 'hermine_stage_units_total{stage="playback",unit="underruns"} 2' in lines
+    assert not any("device" in line for line in lines)
+
+
+def test_trace_file_is_rotated(tmp_path):
+    """The trace file stays under its size limit and keeps the newest backups."""
+    trace_file = tmp_path / "traces.jsonl"
+    tracer = Tracer(trace_file, max_bytes=1000, backups=2)
+    turn = tracer.start_turn()
+    for index in range(60):
+        turn.record("stt", 0.0, 0.1, index=index)
+
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert files == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"]
+    assert all(path.stat().st_size <= 1000 for path in tmp_path.iterdir())
+    newest = json.loads(trace_file.read_text(encoding="utf-8").splitlines()[-1])
+    assert newest["attributes"] == {"index": 59}
@@ -0,0 +1,72 @@
+"""Wake word voice activity detection and matching."""
+import numpy as np
+
+from wake_word import WakeWordConfig, WakeWordDetector
+
+RATE = 16000
+
+
+def _word(seconds: float = 0.6) -> np.ndarray:
+    """A voiced two-syllable utterance with a gliding pitch."""
+    t = np.arange(int(seconds * RATE)) / RATE
+    phase = 2 * np.pi * np.cumsum(140 + 80 * t / seconds) / RATE
+    # The syllables carry their energy around different harmonics.
+    center = np.where(t < seconds / 2, 2.0, 7.0)
+    voice = sum(np.sin(k * phase) * np.exp(-((k - center) / 3) ** 2) for k in range(1, 30))
+    voice /= np.sqrt(np.convolve(voice ** 2, np.ones(160) / 160, "same")) + 1e-9
+    return 1200 * voice * np.hanning(len(t)) ** 0.3
+
+
+def _detector(tmp_path) -> WakeWordDetector:
+    """A detector with the clean word enrolled."""
+    detector = WakeWordDetector(WakeWordConfig(template_dir=tmp_path), templates=[])
+    detector.enroll(_word().astype(np.int16))
+    return detector
+
+
+def _detections(detector: WakeWordDetector, audio: np.ndarray) -> list:
+    """Seconds at which the detector fired, fed in capture-sized chunks."""
+    audio = np.clip(audio, -32768, 32767).astype(np.int16)
+    return [offset / RATE for offset in range(0, len(audio), 512)
+            if detector.process(audio[offset:offset + 512])]
+
+
+def _scene(noise_sigma: float, seconds: float = 20.0) -> np.ndarray:
+    """5 s of a quiet room, then noise for a while, the word and 2 s more noise."""
+    rng = np.random.default_rng(1)
+    audio = np.concatenate((rng.normal(0, 20, 5 * RATE),
+                            rng.normal(0, noise_sigma, int((seconds + 2) * RATE))))
+    word = _word()
+    start = int((5 + seconds) * RATE)
+    audio[start:start + len(word)] += word
+    return audio
+
+
+def test_detects_the_word_in_a_quiet_room(tmp_path):
+    """The enrolled word fires once, right after it is said."""
+    detections = _detections(_detector(tmp_path), _scene(20))
+    assert len(detections) == 1
+    assert 25.0 < detections[0] < 26.5
+
+
+def test_adapts_to_a_step_up_in_background_noise(tmp_path):
+    """A fan switching on raises the floor instead of opening an endless segment."""
+    detector = _detector(tmp_path)
+    detections = _detections(detector, _scene(200))
+
+    assert detector.noise_floor > 200 / 32768 * 0.5
+    assert len(detections) == 1
+    assert 25.0 < detections[0] < 26.5
+
+
+def test_long_sounds_are_dropped(tmp_path):
+    """A segment longer than any word is closed instead of growing forever."""
+    detector = _detector(tmp_path)
+    t = np.arange(10 * RATE) / RATE
+    config = detector.config
+    max_hops = int((config.max_word + config.hangover) * RATE / config.hop)
+
+    _detections(detector, 8000 * np.sin(2 * np.pi * 300 * t) * (1 + 0.5 * np.sin(t * 7)))
+    # pylint: disable=protected-access
+    assert detector._segment_hops <= max_hops
+    assert len(detector._segment) <= max_hops + detector._recent.maxlen